@@ -1,13 +1,265 @@
+import argparse
+import importlib
 import sys
-from methods import heuristic_method, mip_method  
 
-def main():
-    if len(sys.argv) > 1 and sys.argv[1] == "optimize":
-        print("Execution of the MIP program...")
-        mip_method.run()  
+PROFILE_JSON = "output/profile.json"
+
+def _given(**kwargs):
+    # options set on the command line, the others keep the defaults of the called function
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+def _config(text):
+    # "0.5:1.5" -> (0.5, 1.5)
+    try:
+        c_rate, cycles = text.split(":")
+        return float(c_rate), float(cycles)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"configuration '{text}' is not C-RATE:CYCLES (e.g. 0.5:1.5)")
+
+def _data_options(parser, countries=True, configs=True, output=True):
+    if countries:
+        parser.add_argument("--countries", nargs="+", metavar="CODE", help="country codes (default: all five)")
+    if configs:
+        parser.add_argument("--configs", nargs="+", type=_config, metavar="C-RATE:CYCLES",
+                            help="configuration grid, e.g. 0.25:1 0.5:2 (default: the 9 of the brief)")
+    parser.add_argument("--input", metavar="XLSX", help="price workbook (default: input/TechArena2025_data.xlsx)")
+    parser.add_argument("--archive", metavar="DIR", help="PriceArchive directory instead of the workbook")
+    parser.add_argument("--start", metavar="DATE", help="first day in the archive")
+    if output:
+        parser.add_argument("--output", metavar="DIR", help="output directory")
+
+# subcommands
+
+def heuristic(args, heuristic_method):
+    heuristic_method.run(**_given(workers=args.workers, archive=args.archive, start=args.start, countries=args.countries,
+                                  configs=args.configs, xls_path=args.input, out_dir=args.output, limit_days=args.days))
+
+def sweep(args, heuristic_method):
+    cfg, (code, c_rate, cycles, _, _) = heuristic_method.configurations(**_given(
+        countries=args.countries, configs=args.configs, xls_path=args.input, archive=args.archive, start=args.start,
+        limit_days=args.days, workers=args.workers))
+    print(cfg.to_string(index=False))
+    print(f"Best: {code}, C-rate {c_rate}, {cycles} cycles per day")
+    if args.csv:
+        cfg.to_csv(args.csv, index=False)
+        print(f"Written to {args.csv}")
+
+def roi(args, Finance):
+    e_nom = Finance.E_NOM_MWH if args.e_nom is None else args.e_nom
+    profit = args.profit
+    rates = {}
+    if profit is None or (args.country and (args.wacc is None or args.inflation is None)):
+        if not args.country:
+            raise SystemExit("roi: give --profit, or --country to simulate it with the heuristic")
+        from methods import heuristic_method
+        xls = _given(xls_path=args.input)
+        if profit is None:
+            da, fcr, afrr, avail = heuristic_method.load_prices(**xls)
+            _, profit, _ = heuristic_method.simulate_country(da, fcr, afrr, avail, args.country, args.c_rate,
+                                                             args.cycles, e_nom_mwh=e_nom)
+        (wacc,), (infl,) = heuristic_method._country_rates(heuristic_method.load_finance(**xls), [args.country])
+        rates = {"wacc": float(wacc), "inflation": float(infl)}
+    kwargs = {**rates, **_given(wacc=args.wacc, inflation=args.inflation, capex_per_mwh=args.capex_per_mwh,
+                                capex_power_per_mw=args.capex_power_per_mw, opex_rate=args.opex_rate,
+                                years=args.years)}
+    res = Finance.evaluate(profit, args.c_rate * e_nom, e_nom_mwh=e_nom, **kwargs)
+    print(f"yearly profit       {float(profit):>14.2f} EUR")
+    for name, value in kwargs.items():
+        print(f"{name:<19} {value:>14}")
+    print(f"CAPEX               {float(res['capex']):>14.2f} EUR")
+    print(f"NPV                 {float(res['npv']):>14.2f} EUR")
+    print(f"yearly profits      {float(res['profit_kEUR_MW']):>14.2f} kEUR/MW")
+    print(f"levelized ROI       {100 * float(res['levelized_roi']):>14.2f} %")
+
+def optimize(args, mip_method):
+    # positional words of the former CLI: "year", "bench", a formulation, "budget=<s>", "gap=<rel>"
+    print("Execution of the MIP program...")
+    words = [w for w in args.words if "=" not in w]
+    options = dict(w.split("=", 1) for w in args.words if "=" in w)
+    unknown = [w for w in words if w not in ("year", "bench") and w not in mip_method.FORMULATIONS]
+    if unknown:
+        raise SystemExit(f"optimize: unknown {unknown}, expected year, bench or {list(mip_method.FORMULATIONS)}")
+    formulation = args.formulation or next((w for w in words if w in mip_method.FORMULATIONS), "milp")
+    budget = args.budget if args.budget is not None else options.get("budget")
+    gap = args.gap if args.gap is not None else options.get("gap")
+    mip_method.run(year="year" in words, formulation=formulation, benchmark="bench" in words,
+                   budget_s=None if budget is None else float(budget), mip_gap=None if gap is None else float(gap),
+                   **_given(countries=args.countries, configs=args.configs, xls_path=args.input, out_dir=args.output,
+                            archive=args.archive, start=args.start))
+
+def bench(args, Benchmark):
+    # "bench [1d 1m 1y 5y] [baseline]": timings on synthetic data, compared to the baseline
+    # "bench startup": start time of every subcommand against its target
+    if "startup" in args.words:
+        Benchmark.startup()
+        return
+    horizons = [w for w in args.words if w in Benchmark.HORIZONS] or list(Benchmark.HORIZONS)
+    Benchmark.run(horizons, update_baseline="baseline" in args.words)
+
+def dp(args, dp_method):
+    # "dp": heuristic sweep and CSVs dispatched by dynamic programming (output/dp)
+    # "dp gap": DP against the MIP, day by day
+    if args.mode == "gap":
+        dp_method.solver_gap(**_given(code=args.country))
+    else:
+        dp_method.run(**_given(out_dir=args.output))
+
+def archive(args, PriceArchive, heuristic_method):
+    # "archive [x.xlsx ...]": memory-mapped price archive of the workbooks (input/archive)
+    # "archive run [YYYY-MM-DD]": heuristic on the year of the archive starting that day
+    root = args.dir or PriceArchive.ARCHIVE_DIR
+    if args.words[:1] == ["run"]:
+        heuristic_method.run(archive=root, start=args.words[1] if len(args.words) > 1 else None,
+                             **_given(countries=args.countries, out_dir=args.output))
     else:
+        built = PriceArchive.from_workbooks(root, xls_paths=args.words or [heuristic_method.DATA_XLS])
+        print(f"Archive written to {built.root.resolve()}: {built.meta['markets']['da']}")
+
+def mc(args, MonteCarlo):
+    # "mc [n]": P10 / P50 / P90 of profit and ROI over n bootstrapped years
+    MonteCarlo.run(n_scenarios=args.n, **_given(countries=args.countries, configs=args.configs, xls_path=args.input,
+                                                archive=args.archive, start=args.start, out_dir=args.output))
+
+def lifetime(args, Lifetime):
+    # "lifetime [years]": heuristic year after year with the rainflow capacity fade (output/lifetime)
+    model = None
+    if args.cycle_life is not None or args.calendar_fade is not None:
+        from methods.Degradation import StressModel
+        model = StressModel(**_given(cycle_life=args.cycle_life, calendar_fade_per_year=args.calendar_fade))
+    Lifetime.run(years=args.years, model=model, **_given(
+        eta_fade_per_year=args.eta_fade, workers=args.workers, countries=args.countries, configs=args.configs,
+        xls_path=args.input, archive=args.archive, start=args.start, out_dir=args.output))
+
+def online(args, OnlineHeuristic):
+    # the year of one country fed price by price to the incremental heuristic (output/online)
+    OnlineHeuristic.replay(code=args.country, c_rate=args.c_rate, cycles=args.cycles)
+
+def dispatch(args, Dispatcher):
+    # receding horizon MIP replayed quarter by quarter (output/dispatch)
+    Dispatcher.replay(code=args.country, c_rate=args.c_rate, cycles=args.cycles, days=args.days,
+                      horizon_hours=args.horizon, **_given(xls_path=args.input))
+
+def serve(args, Server):
+    # markets kept in memory, JSON requests on localhost (methods/Server.py)
+    Server.serve(host=args.host, port=args.port, **_given(
+        xls_path=args.input, archive=args.archive, start=args.start, countries=args.countries, workers=args.workers))
+
+# handler and modules of each subcommand, the modules are imported only when
+# it runs (Pyomo, openpyxl and pandas are not loaded by a command that does not need them)
+COMMANDS = {
+    "heuristic": (heuristic, ("methods.heuristic_method",)),
+    "sweep": (sweep, ("methods.heuristic_method",)),
+    "roi": (roi, ("methods.Finance",)),
+    "optimize": (optimize, ("methods.mip_method",)),
+    "bench": (bench, ("methods.Benchmark",)),
+    "dp": (dp, ("methods.dp_method",)),
+    "archive": (archive, ("methods.PriceArchive", "methods.heuristic_method")),
+    "mc": (mc, ("methods.MonteCarlo",)),
+    "lifetime": (lifetime, ("methods.Lifetime",)),
+    "online": (online, ("methods.OnlineHeuristic",)),
+    "dispatch": (dispatch, ("methods.Dispatcher",)),
+    "serve": (serve, ("methods.Server",)),
+}
+
+def parser():
+    p = argparse.ArgumentParser(prog="main.py", description="TechArena 2025 battery optimizer")
+    p.add_argument("--profile", action="store_true", help=f"time / memory of every stage, written to {PROFILE_JSON}")
+    p.add_argument("--imports-only", action="store_true", help=argparse.SUPPRESS)
+    sub = p.add_subparsers(dest="command", metavar="command")
+
+    s = sub.add_parser("heuristic", help="heuristic sweep and the three Phase 1 CSVs (default)")
+    _data_options(s)
+    s.add_argument("--days", type=int, help="simulated days (default 365)")
+    s.add_argument("--workers", type=int, help="processes of the sweep (default: all cores)")
+
+    s = sub.add_parser("sweep", help="Configuration table of the heuristic, nothing else written")
+    _data_options(s, output=False)
+    s.add_argument("--days", type=int, help="simulated days (default 365)")
+    s.add_argument("--workers", type=int, help="processes of the sweep (default: all cores)")
+    s.add_argument("--csv", metavar="PATH", help="also write the table to this CSV")
+
+    s = sub.add_parser("roi", help="levelized ROI of a yearly profit, or of a country simulated by the heuristic")
+    s.add_argument("--profit", type=float, help="yearly profit [EUR]")
+    s.add_argument("--country", help="simulate the profit and take WACC / inflation of this country")
+    s.add_argument("--c-rate", type=float, default=0.5)
+    s.add_argument("--cycles", type=float, default=1.0)
+    s.add_argument("--input", metavar="XLSX", help="price workbook (default: input/TechArena2025_data.xlsx)")
+    for name in ("wacc", "inflation", "capex-per-mwh", "capex-power-per-mw", "opex-rate", "e-nom"):
+        s.add_argument(f"--{name}", type=float)
+    s.add_argument("--years", type=int)
+
+    s = sub.add_parser("optimize", help="MIP: test day, full year (year) or formulation benchmark (bench)")
+    s.add_argument("words", nargs="*", metavar="year|bench|milp|tight|lp|budget=S|gap=G")
+    s.add_argument("--formulation", help="milp, tight or lp")
+    s.add_argument("--budget", type=float, help="solver time [s] per country / configuration")
+    s.add_argument("--gap", type=float, help="relative MIP gap target")
+    _data_options(s)
+
+    s = sub.add_parser("bench", help="timings on synthetic data, or the start time of the subcommands (startup)")
+    s.add_argument("words", nargs="*", metavar="1d|1m|1y|5y|baseline|startup")
+
+    s = sub.add_parser("dp", help="heuristic sweep dispatched by dynamic programming, or its gap to the MIP (gap)")
+    s.add_argument("mode", nargs="?", choices=["gap"])
+    s.add_argument("--country")
+    s.add_argument("--output", metavar="DIR", help="output directory")
+
+    s = sub.add_parser("archive", help="build the price archive of workbooks, or run the heuristic on it (run)")
+    s.add_argument("words", nargs="*", metavar="XLSX|run [DATE]")
+    s.add_argument("--dir", help="archive directory (default: input/archive)")
+    s.add_argument("--countries", nargs="+", metavar="CODE")
+    s.add_argument("--output", metavar="DIR", help="output directory")
+
+    s = sub.add_parser("mc", help="Monte Carlo P10 / P50 / P90 of profit and ROI")
+    s.add_argument("n", nargs="?", type=int, default=1000, help="scenarios (default 1000)")
+    _data_options(s)
+
+    s = sub.add_parser("lifetime", help="heuristic year after year with capacity fade, ROI of the yearly profits")
+    s.add_argument("years", nargs="?", type=int, default=10, help="years of operation (default 10)")
+    s.add_argument("--cycle-life", type=float, help="full 100%% DoD cycles to the end of life (default 6000)")
+    s.add_argument("--calendar-fade", type=float, help="capacity lost per year by calendar ageing (default 0)")
+    s.add_argument("--eta-fade", type=float, help="round-trip efficiency lost per year (default 0)")
+    s.add_argument("--workers", type=int, help="processes (default: all cores)")
+    _data_options(s)
+
+    for name, help_text in (("online", "incremental heuristic replayed on a year"),
+                            ("dispatch", "receding horizon MIP replayed quarter by quarter")):
+        s = sub.add_parser(name, help=help_text)
+        s.add_argument("--country", default="DE")
+        s.add_argument("--c-rate", type=float, default=0.5)
+        s.add_argument("--cycles", type=float, default=1.0)
+        if name == "dispatch":
+            s.add_argument("days", nargs="?", type=float, default=365, help="replayed days (default 365)")
+            s.add_argument("--horizon", type=float, default=8, help="optimized hours ahead (default 8)")
+            s.add_argument("--input", metavar="XLSX", help="price workbook")
+
+    s = sub.add_parser("serve", help="keep the markets in memory and answer JSON requests on localhost")
+    s.add_argument("port", nargs="?", type=int, default=8765)
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--workers", type=int)
+    _data_options(s, configs=False, output=False)
+    return p
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # "--profile" anywhere on the line
+    profile = "--profile" in argv
+    argv = [a for a in argv if a != "--profile"]
+    args = parser().parse_args(argv or ["heuristic"])
+    if args.command is None:
+        args = parser().parse_args(argv + ["heuristic"])
+
+    handler, names = COMMANDS[args.command]
+    modules = [importlib.import_module(name) for name in names]
+    if args.imports_only:
+        return
+    if profile:
+        from methods import Profiler
+        Profiler.enable()
+    if args.command == "heuristic":
         print("Execution of the heuristic program...")
-        heuristic_method.run()  
+    handler(args, *modules)
+    if profile:
+        Profiler.write(PROFILE_JSON)
 
 if __name__ == "__main__":
     main()
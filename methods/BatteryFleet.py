@@ -0,0 +1,218 @@
+import numpy as np
+
+from methods.Billing import *
+from methods.LUNA2000Battery import LUNA2000Battery
+
+# status codes of the units (same names as LUNA2000Battery.status)
+STATUS = ("empty", "process", "full")
+EMPTY = 0
+PROCESS = 1
+FULL = 2
+
+# 'status' of the results (inactive unit, done, nothing to do)
+CHARGE_MESSAGES = np.array(['', 'Charge réussie', 'Batterie déjà pleine'])
+DISCHARGE_MESSAGES = np.array(['', 'Décharge réussie', 'Batterie déjà vide (SOC minimum atteint)'])
+
+class BatteryFleet:
+    """
+    N LUNA2000 batteries as arrays (struct of arrays).
+
+    Every method applies to all the units at once and gives, unit by unit,
+    the same result as the corresponding LUNA2000Battery method. Prices,
+    powers, durations and temperatures are scalars or arrays of N values;
+    `active` (boolean mask) restricts an operation to some units.
+
+    The capacity fade is the DoD bucket model of LUNA2000Battery; the
+    optional rainflow degradation of the scalar class is not supported.
+
+    `balance` holds the billing of each unit (current_billing of the scalar
+    class). With ledger=True every transaction is also written to one Billing
+    ledger (period = the `period` argument of charge / discharge), spilled to
+    spill_dir if given.
+    """
+
+    def __init__(self, n, capacity_kwh=4472, power_kw=2236, cycles_max=1.0, c_rate_max=0.5,
+                 ledger=True, spill_dir=None):
+        ref = LUNA2000Battery(capacity_kwh=4472, power_kw=2236, cycles_max=1.0)
+        self.n = n
+        self.capacity_kwh = np.broadcast_to(np.asarray(capacity_kwh, dtype=float), (n,)).copy()
+        self.power_kw = np.broadcast_to(np.asarray(power_kw, dtype=float), (n,)).copy()
+        self.cycles_max = np.broadcast_to(np.asarray(cycles_max, dtype=float), (n,)).copy()
+        self.c_rate_max = np.broadcast_to(np.asarray(c_rate_max, dtype=float), (n,)).copy()
+
+        # state
+        self.soc_kwh = np.zeros(n)
+        self.capacity_fade = np.ones(n)
+        self.dod_weighted_cycles = np.zeros(n)
+        self.cycle_count = np.zeros(n)
+        self.temp_current = np.full(n, float(ref.temp_current))
+        self.status = np.full(n, EMPTY, dtype=np.int8)
+
+        # limits and efficiencies, shared by all the units
+        self.soc_min = ref.soc_min
+        self.soc_max = ref.soc_max
+        self.efficiency_charge = ref.efficiency_charge
+        self.efficiency_discharge = ref.efficiency_discharge
+        self.temp_optimal = ref.temp_optimal
+        self.power_derating_low_soc = ref.power_derating_low_soc
+        self.power_derating_high_soc = ref.power_derating_high_soc
+
+        self.balance = np.zeros(n)
+        self.billing = Billing(spill_dir=spill_dir) if ledger else None
+
+    @classmethod
+    def from_battery(cls, battery, n):
+        """Fleet of n copies of a LUNA2000Battery (parameters and state)"""
+        if battery.rainflow is not None:
+            raise ValueError("The fleet only has the DoD bucket degradation, "
+                             "use a LUNA2000Battery without rainflow degradation")
+        fleet = cls(n, battery.capacity_kwh, battery.power_kw, battery.cycles_max, battery.c_rate_max)
+        fleet.balance[:] = battery.billing.current_billing
+        fleet.soc_kwh[:] = battery.soc_kwh
+        fleet.capacity_fade[:] = battery.capacity_fade
+        fleet.dod_weighted_cycles[:] = battery.dod_weighted_cycles
+        fleet.cycle_count[:] = battery.cycle_count
+        fleet.temp_current[:] = battery.temp_current
+        fleet.status[:] = STATUS.index(battery.status) if battery.status in STATUS else PROCESS
+        return fleet
+
+    def get_status(self):
+        return np.array(STATUS)[self.status]
+
+    def get_soc_percentage(self):
+        """SoC of every unit in %"""
+        return (self.soc_kwh / (self.capacity_kwh * self.capacity_fade)) * 100
+
+    def get_usable_capacity(self):
+        return self.capacity_kwh * self.capacity_fade * (self.soc_max - self.soc_min)
+
+    def get_temperature_factor(self):
+        temp_diff = np.abs(self.temp_current - self.temp_optimal)
+        factor = np.where(temp_diff <= 10, 1.0, np.maximum(0.85, 1.0 - (temp_diff - 10) * 0.01))
+        factor = np.where(self.temp_current > 45, 0.8, factor)
+        return np.where(self.temp_current < -10, 0.7, factor)
+
+    def get_power_limit_charge(self):
+        """Charge power limit of every unit (SoC derating above 90%, temperature, C-rate)"""
+        soc_pct = self.get_soc_percentage() / 100
+        soc_factor = np.where(soc_pct > self.power_derating_high_soc,
+                              np.maximum(0.2, 1.0 - 2 * (soc_pct - self.power_derating_high_soc)), 1.0)
+        max_power_crate = self.capacity_kwh * self.capacity_fade * self.c_rate_max
+        return np.minimum(self.power_kw, max_power_crate) * self.get_temperature_factor() * soc_factor
+
+    def get_power_limit_discharge(self):
+        """Discharge power limit of every unit (SoC derating below 10%, temperature, C-rate)"""
+        soc_pct = self.get_soc_percentage() / 100
+        soc_factor = np.where(soc_pct < self.power_derating_low_soc,
+                              np.maximum(0.2, soc_pct / self.power_derating_low_soc), 1.0)
+        max_power_crate = self.capacity_kwh * self.capacity_fade * self.c_rate_max
+        return np.minimum(self.power_kw, max_power_crate) * self.get_temperature_factor() * soc_factor
+
+    def update_degradation(self, energy_processed, active=None):
+        """Cycle counting and capacity fade for the energy processed by each unit"""
+        active = self._mask(active)
+        dod = energy_processed / (self.capacity_kwh * self.capacity_fade)
+        cycle_weight = np.where(dod > 0.8, 1.0, np.where(dod > 0.5, 0.5, 0.2))
+        dwc = np.where(active, self.dod_weighted_cycles + dod * cycle_weight, self.dod_weighted_cycles)
+        passed = np.where(dwc >= 100, np.floor(dwc / 100), 0.0)
+        self.capacity_fade = self.capacity_fade * 0.9995 ** passed
+        self.dod_weighted_cycles = np.where(passed > 0, dwc % 100, dwc)
+
+    def _mask(self, active):
+        if active is None:
+            return np.ones(self.n, dtype=bool)
+        return np.broadcast_to(np.asarray(active, dtype=bool), (self.n,))
+
+    def _bill(self, sell, price, energy, day, go, period):
+        # same amounts as Billing.buy / Billing.sell, per unit and in the ledger
+        prices = np.broadcast_to(np.asarray(price, dtype=float) / 1000, (self.n,))
+        montants = prices * energy * day
+        self.balance = self.balance + (montants if sell else -montants)
+        if self.billing is not None:
+            # day and period may also be given per unit: only the rows of the units that operate
+            day = np.broadcast_to(np.asarray(day, dtype=float), (self.n,))[go]
+            period = np.broadcast_to(np.asarray(period), (self.n,))[go]
+            entry = self.billing.sell_many if sell else self.billing.buy_many
+            entry(prices[go], energy[go], day, period)
+
+    def _requested(self, power_kw, power_limit):
+        # power_kw=None (or 0) means the maximum power, like in LUNA2000Battery
+        if power_kw is None:
+            return power_limit
+        power_kw = np.broadcast_to(np.asarray(power_kw, dtype=float), (self.n,))
+        return np.minimum(np.where(power_kw > 0, power_kw, power_limit), power_limit)
+
+    def charge(self, price=0, power_kw=None, duration_hours=1.0, day=1, intake=False, temperature_c=25,
+               active=None, period=-1):
+        """Charge every active unit, see LUNA2000Battery.charge. Returns a dict of arrays"""
+        active = self._mask(active)
+        self.temp_current = np.where(active, temperature_c, self.temp_current)
+
+        current_capacity = self.capacity_kwh * self.capacity_fade
+        max_soc_kwh = current_capacity * self.soc_max
+        full = self.soc_kwh >= max_soc_kwh
+        go = active & ~full
+
+        power_limit = self.get_power_limit_charge()
+        power_actual = self._requested(power_kw, power_limit)
+        energy_net = power_actual * duration_hours * self.efficiency_charge
+        energy_stored = np.where(go, np.minimum(energy_net, max_soc_kwh - self.soc_kwh), 0.0)
+        energy_consumed = energy_stored / self.efficiency_charge
+        power_real = np.where(np.asarray(duration_hours) > 0,
+                              energy_consumed / np.maximum(duration_hours, 1e-300), 0.0)
+
+        self.soc_kwh = self.soc_kwh + energy_stored
+        self.update_degradation(energy_stored, go)
+
+        self._bill(intake, price, energy_consumed, day, go, period)
+
+        status = np.where(self.soc_kwh >= self.capacity_kwh - (self.capacity_kwh * .06), FULL, PROCESS)
+        self.status = np.where(go, status, np.where(active & full, FULL, self.status)).astype(np.int8)
+        return {
+            'energy_charged': energy_stored,
+            'energy_consumed': energy_consumed,
+            'power_actual': np.where(go, power_real, 0.0),
+            'soc_final': self.get_soc_percentage(),
+            'power_limit': power_limit,
+            'efficiency': np.where(go, self.efficiency_charge, 0.0),
+            'status': CHARGE_MESSAGES[np.where(go, 1, np.where(full, 2, 0))],
+            'temperature_factor': self.get_temperature_factor(),
+        }
+
+    def discharge(self, price=0, power_kw=None, duration_hours=1.0, day=1, temperature_c=25,
+                  active=None, period=-1):
+        """Discharge every active unit, see LUNA2000Battery.discharge. Returns a dict of arrays"""
+        active = self._mask(active)
+        self.temp_current = np.where(active, temperature_c, self.temp_current)
+
+        current_capacity = self.capacity_kwh * self.capacity_fade
+        min_soc_kwh = current_capacity * self.soc_min
+        empty = self.soc_kwh <= min_soc_kwh
+        go = active & ~empty
+
+        power_limit = self.get_power_limit_discharge()
+        power_actual = self._requested(power_kw, power_limit)
+        energy_demanded = power_actual * duration_hours
+        energy_available = self.soc_kwh - min_soc_kwh
+        energy_internal = np.where(go, np.minimum(energy_demanded / self.efficiency_discharge, energy_available), 0.0)
+        energy_delivered = energy_internal * self.efficiency_discharge
+        power_real = np.where(np.asarray(duration_hours) > 0,
+                              energy_delivered / np.maximum(duration_hours, 1e-300), 0.0)
+
+        self.soc_kwh = self.soc_kwh - energy_internal
+        self.update_degradation(energy_internal, go)
+
+        self._bill(True, price, energy_delivered, day, go, period)
+
+        status = np.where(self.soc_kwh <= self.capacity_kwh - (self.capacity_kwh * .96), EMPTY, PROCESS)
+        self.status = np.where(go, status, np.where(active & empty, EMPTY, self.status)).astype(np.int8)
+        return {
+            'energy_discharged': energy_delivered,
+            'energy_internal': energy_internal,
+            'power_actual': np.where(go, power_real, 0.0),
+            'soc_final': self.get_soc_percentage(),
+            'power_limit': power_limit,
+            'efficiency': np.where(go, self.efficiency_discharge, 0.0),
+            'status': DISCHARGE_MESSAGES[np.where(go, 1, np.where(empty, 2, 0))],
+            'temperature_factor': self.get_temperature_factor(),
+        }
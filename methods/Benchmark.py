@@ -0,0 +1,212 @@
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from methods.LUNA2000Battery import LUNA2000Battery
+from methods.XLSCache import load_tables
+from methods.SyntheticData import write_workbook
+from methods.Solver import Solver
+from methods.MatrixSolver import MatrixSolver
+from methods import Finance, heuristic_method
+
+#############################################
+## Benchmarks on synthetic market data     ##
+#############################################
+# Every stage of the pipeline is timed on a synthetic workbook of each horizon
+# and the results are written to a JSON file. The first run (or
+# update_baseline=True) becomes the baseline, the next runs are compared to it.
+
+HORIZONS = {"1d": 1, "1m": 30, "1y": 365, "5y": 1825}
+OUT_DIR = Path("output") / "benchmark"
+
+# start time [s] of each subcommand of main.py (imports included, no work),
+# on one core: a command only pays for the modules it needs
+STARTUP_TARGETS_S = {
+    "roi": 0.3,
+    "heuristic": 0.8, "sweep": 0.8, "archive": 0.8, "mc": 0.8, "online": 0.8, "serve": 0.8, "dp": 0.8, "lifetime": 0.8,
+    "optimize": 1.5, "dispatch": 1.5, "bench": 1.5,
+}
+
+# the Pyomo build is slow on long horizons: above this size only the matrix
+# backend is timed
+PYOMO_MAX_QUARTERS = 96 * 30
+
+def _timed(fn, repeat=1):
+    # best time of `repeat` calls and the result of the last one
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _solver_prices(tables, code="DE", da_column="DE_LU"):
+    return (
+        tables["da"][da_column].tolist(),
+        tables["fcr"][code].tolist(),
+        tables["afrr"][(code, "Pos")].tolist(),
+        tables["afrr"][(code, "Neg")].tolist(),
+    )
+
+def _solver_stage(solver_class, battery, prices, n_quarters, time_limit):
+    build_s, solver = _timed(lambda: solver_class(battery, *prices, battery.c_rate_max, battery.cycles_max,
+                                                  n_quarters=n_quarters))
+    solve_s, _ = _timed(lambda: solver.solve(time_limit=time_limit, mip_gap=0.01, verbose=False))
+    # no incumbent within the time limit: no gap (NaN is not valid JSON)
+    gap = solver.gap if solver.gap is not None and np.isfinite(solver.gap) else None
+    return {"build_s": build_s, "solve_s": solve_s, "status": solver.status(), "mip_gap": gap}
+
+def bench_horizon(days, data_dir, volatility=1.0, seed=0, c_rate=0.5, cycles=1.0, repeat=3,
+                  time_limit=30.0, pyomo_max_quarters=PYOMO_MAX_QUARTERS):
+    """
+    Timings of one horizon: workbook ingestion (parse + cache, then cached),
+    simulate_country, levelized_roi, a million scenarios of
+    Finance.sensitivity, Solver and MatrixSolver build / solve on the whole
+    horizon.
+    """
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    xls_path = data_dir / f"synthetic_{days}d_{seed}.xlsx"
+    if not xls_path.exists():
+        print(f"Writing the synthetic workbook of {days} days...")
+        write_workbook(xls_path, days=days, volatility=volatility, seed=seed)
+    cache_dir = data_dir / ".cache"
+
+    result = {"days": days, "quarters": days * 96}
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    result["ingest_parse_s"], _ = _timed(lambda: load_tables(xls_path, cache_dir=cache_dir))
+    result["ingest_cached_s"], tables = _timed(lambda: load_tables(xls_path, cache_dir=cache_dir), repeat)
+
+    da = tables["da"].rename(columns={"DE_LU": "DE"})
+    avail = set(tables["afrr"].columns.get_level_values(0))
+    result["simulate_country_s"], (_, profit, p_max) = _timed(
+        lambda: heuristic_method.simulate_country(da, tables["fcr"], tables["afrr"], avail, "DE", c_rate, cycles,
+                                                  limit_days=days), repeat)
+
+    # one call is a few µs: mean over a batch of calls
+    calls = 1000
+    roi_s, _ = _timed(lambda: [heuristic_method.levelized_roi(profit, p_max) for _ in range(calls)], repeat)
+    result["levelized_roi_s"] = roi_s / calls
+    # a million finance scenarios around the simulated profit in one call
+    result["finance_1m_scenarios_s"], _ = _timed(lambda: Finance.sensitivity(
+        profit, p_max, wacc=np.linspace(0.05, 0.15, 101), inflation=np.linspace(0.0, 0.05, 101),
+        capex_per_mwh=np.linspace(300000, 450000, 100)), repeat)
+
+    battery = LUNA2000Battery(cycles_max=cycles)
+    battery.c_rate_max = c_rate
+    prices = _solver_prices(tables)
+    n_quarters = days * 96
+    for name, solver_class in (("solver", Solver), ("matrix_solver", MatrixSolver)):
+        if solver_class is Solver and n_quarters > pyomo_max_quarters:
+            result[f"{name}_skipped"] = f"more than {pyomo_max_quarters} quarters"
+            continue
+        stage = _solver_stage(solver_class, battery, prices, n_quarters, time_limit)
+        for key, value in stage.items():
+            result[f"{name}_{key}"] = value
+    return result
+
+def environment():
+    import highspy
+    import pyomo
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pyomo": pyomo.__version__,
+        "highspy": getattr(highspy, "__version__", "unknown"),
+    }
+
+def compare(current, baseline, tolerance=0.25, min_delta_s=0.01):
+    """
+    Timings of `current` against `baseline` (both as written by run).
+    A stage regresses when it is slower by more than `tolerance` (relative)
+    and by more than min_delta_s seconds.
+    """
+    rows = []
+    for horizon, values in current["horizons"].items():
+        base = baseline["horizons"].get(horizon, {})
+        for key, value in values.items():
+            if not key.endswith("_s") or key not in base or value is None or base[key] is None:
+                continue
+            ratio = value / base[key] if base[key] > 0 else np.inf
+            rows.append({
+                "horizon": horizon,
+                "stage": key,
+                "baseline [s]": base[key],
+                "current [s]": value,
+                "ratio": ratio,
+                "regression": bool(ratio > 1 + tolerance and value - base[key] > min_delta_s),
+            })
+    return pd.DataFrame(rows, columns=["horizon", "stage", "baseline [s]", "current [s]", "ratio", "regression"])
+
+def startup(targets=STARTUP_TARGETS_S, repeat=3, out_dir=OUT_DIR):
+    """
+    Start time of every subcommand (best of repeat fresh interpreters running
+    main.py with --imports-only) against its target. Written to startup.json.
+    """
+    root = Path(__file__).resolve().parent.parent
+    rows = []
+    for command, target in targets.items():
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, str(root / "main.py"), "--imports-only", command], cwd=root, check=True)
+            times.append(time.perf_counter() - t0)
+        rows.append({"command": command, "startup [s]": min(times), "target [s]": target, "ok": min(times) <= target})
+    table = pd.DataFrame(rows)
+    print(table.to_string(index=False))
+    slow = table[~table["ok"]]
+    if len(slow):
+        print(f"{len(slow)} subcommand(s) above their start time target: {list(slow['command'])}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "startup.json").write_text(json.dumps({**environment(), "startup": rows}, indent=2, default=bool))
+    return table
+
+def run(horizons=tuple(HORIZONS), out_dir=OUT_DIR, update_baseline=False, volatility=1.0, seed=0,
+        repeat=3, time_limit=30.0, tolerance=0.25):
+    """
+    Run the benchmark on the given horizons ("1d", "1m", "1y", "5y"), write
+    latest.json and compare it to baseline.json (created when missing or
+    with update_baseline). Returns the results and the comparison table.
+    """
+    unknown = [h for h in horizons if h not in HORIZONS]
+    if unknown:
+        raise ValueError(f"Unknown horizons {unknown}, choose among {list(HORIZONS)}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    results = {
+        **environment(),
+        "settings": {"volatility": volatility, "seed": seed, "repeat": repeat, "time_limit": time_limit},
+        "horizons": {},
+    }
+    for horizon in horizons:
+        print(f"Benchmark {horizon} ({HORIZONS[horizon]} days)...")
+        results["horizons"][horizon] = bench_horizon(HORIZONS[horizon], out_dir / "data", volatility, seed,
+                                                     repeat=repeat, time_limit=time_limit)
+
+    (out_dir / "latest.json").write_text(json.dumps(results, indent=2))
+    baseline_path = out_dir / "baseline.json"
+    if update_baseline or not baseline_path.exists():
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {baseline_path}")
+        return results, None
+
+    table = compare(results, json.loads(baseline_path.read_text()), tolerance)
+    print(table.to_string(index=False))
+    regressions = table[table["regression"]]
+    if len(regressions):
+        print(f"{len(regressions)} stage(s) slower than the baseline by more than {tolerance:.0%}")
+    return results, table
@@ -1,30 +1,186 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# transaction types, stored as int8 codes
+TYPES = ("buy", "sell")
+BUY = 0
+SELL = 1
+
 class Billing:
+    """
+    Ledger of the buy / sell transactions of a battery.
+
+    The transactions are stored column by column in growable typed arrays
+    (type code, period, price, amount, balance). With spill_dir the columns
+    are memory-mapped files in that directory instead of RAM. Totals by type
+    and by (type, period) are kept up to date at each entry.
+    """
+    columns = {"type": np.int8, "period": np.int32, "price": np.float64, "amount": np.float64, "balance": np.float64}
+    chunk = 4096  # staged scalar transactions
 
-    def __init__(self):
+    def __init__(self, capacity=1024, spill_dir=None):
         self.current_billing = 0
-        self.transaction_history = []
+        self.n = 0
+        self.spill_dir = spill_dir
+        self.capacity = 0
+        self._cols = {}
+        # running aggregates: [type] and {period: [type]}
+        self.total_amount = [0.0] * len(TYPES)
+        self.total_count = [0] * len(TYPES)
+        self.period_amount = {}
+        self.period_count = {}
+        self._pending = []
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._grow(max(int(capacity), 1))
 
-    def buy(self, current_price, puissance, n = 1):
-        montant = -(current_price * puissance * n)
+    def _path(self, name):
+        return os.path.join(self.spill_dir, f"{name}.bin")
+
+    def _grow(self, capacity):
+        # in RAM: new arrays + copy, memory-mapped: the files are extended in place
+        for name, dtype in self.columns.items():
+            if self.spill_dir is None:
+                col = np.empty(capacity, dtype=dtype)
+                if self.n:
+                    col[:self.n] = self._cols[name][:self.n]
+            else:
+                if name in self._cols:
+                    self._cols[name].flush()
+                with open(self._path(name), "ab") as f:
+                    f.truncate(capacity * np.dtype(dtype).itemsize)
+                col = np.memmap(self._path(name), dtype=dtype, mode="r+", shape=(capacity,))
+            self._cols[name] = col
+        self.capacity = capacity
+
+    def _reserve(self, k):
+        if self.n + k > self.capacity:
+            capacity = self.capacity
+            while capacity < self.n + k:
+                capacity *= 2
+            self._grow(capacity)
+
+    def _write(self, codes, periods, prices, montants, balances):
+        k = len(montants)
+        self._reserve(k)
+        i, j = self.n, self.n + k
+        cols = self._cols
+        cols["type"][i:j] = codes
+        cols["period"][i:j] = periods
+        cols["price"][i:j] = prices
+        cols["amount"][i:j] = montants
+        cols["balance"][i:j] = balances
+        self.n = j
+
+        # aggregates by type and by (period, type)
+        n_types = len(TYPES)
+        codes = np.broadcast_to(codes, (k,))
+        for c, (s, m) in enumerate(zip(np.bincount(codes, montants, n_types).tolist(),
+                                       np.bincount(codes, minlength=n_types).tolist())):
+            self.total_amount[c] += s
+            self.total_count[c] += m
+        keys, inverse = np.unique(np.broadcast_to(periods, (k,)), return_inverse=True)
+        slots = inverse * n_types + codes
+        sums = np.bincount(slots, montants, len(keys) * n_types).reshape(-1, n_types).tolist()
+        counts = np.bincount(slots, minlength=len(keys) * n_types).reshape(-1, n_types).tolist()
+        for p, s, m in zip(keys.tolist(), sums, counts):
+            if p not in self.period_amount:
+                self.period_amount[p] = [0.0] * n_types
+                self.period_count[p] = [0] * n_types
+            for c in range(n_types):
+                self.period_amount[p][c] += s[c]
+                self.period_count[p][c] += m[c]
+
+    def _append(self, code, prices, montants, periods):
+        self._flush_pending()
+        balances = self.current_billing + np.cumsum(montants)
+        self._write(code, periods, prices, montants, balances)
+        if len(montants):
+            self.current_billing = float(balances[-1])
+        return balances
+
+    def _one(self, code, current_price, montant, period):
+        # scalar path: rows are staged in a short list and written (with the
+        # aggregates) by chunks
         self.current_billing += montant
-        self.transaction_history.append({
-            "type": "buy",
+        self._pending.append((code, period, current_price, montant, self.current_billing))
+        if len(self._pending) >= self.chunk:
+            self._flush_pending()
+        return {
+            "type": TYPES[code],
             "price": current_price,
             "amount": montant,
             "balance": self.current_billing
-        })
-        return self.transaction_history[-1]  # last 
+        }
+
+    def _flush_pending(self):
+        if self._pending:
+            codes, periods, prices, montants, balances = (np.array(c) for c in zip(*self._pending))
+            self._pending = []
+            self._write(codes, periods, prices, montants, balances)
 
-    def sell(self, current_price, puissance, n = 1):
+    def buy(self, current_price, puissance, n = 1, period=-1):
+        montant = -(current_price * puissance * n)
+        return self._one(BUY, current_price, montant, period)
+
+    def sell(self, current_price, puissance, n = 1, period=-1):
         montant = current_price * puissance * n
-        self.current_billing += montant
-        self.transaction_history.append({
-            "type": "sell",
-            "price": current_price,
-            "amount": montant,
-            "balance": self.current_billing
-        })
-        return self.transaction_history[-1]  # last 
+        return self._one(SELL, current_price, montant, period)
+
+    def buy_many(self, current_prices, puissances, n = 1, periods=-1):
+        """Vectorized buy: one transaction per element, returns the balances after each"""
+        prices = np.asarray(current_prices, dtype=float)
+        montants = -(prices * np.asarray(puissances, dtype=float) * n)
+        return self._append(BUY, np.broadcast_to(prices, montants.shape), montants, periods)
+
+    def sell_many(self, current_prices, puissances, n = 1, periods=-1):
+        """Vectorized sell: one transaction per element, returns the balances after each"""
+        prices = np.asarray(current_prices, dtype=float)
+        montants = prices * np.asarray(puissances, dtype=float) * n
+        return self._append(SELL, np.broadcast_to(prices, montants.shape), montants, periods)
+
+    def total(self, type=None, period=None):
+        """Sum of the amounts, for one type ("buy" / "sell") and/or one period"""
+        self._flush_pending()
+        codes = range(len(TYPES)) if type is None else [TYPES.index(type)]
+        if period is None:
+            return sum(self.total_amount[c] for c in codes)
+        amounts = self.period_amount.get(period, [0.0] * len(TYPES))
+        return sum(amounts[c] for c in codes)
+
+    def count(self, type=None, period=None):
+        self._flush_pending()
+        codes = range(len(TYPES)) if type is None else [TYPES.index(type)]
+        if period is None:
+            return sum(self.total_count[c] for c in codes)
+        counts = self.period_count.get(period, [0] * len(TYPES))
+        return sum(counts[c] for c in codes)
+
+    def __len__(self):
+        return self.n + len(self._pending)
 
     def get_history(self):
-        return self.transaction_history
\ No newline at end of file
+        """DataFrame view on the ledger (no copy): type, period, price, amount, balance"""
+        self._flush_pending()
+        n = self.n
+        cols = self._cols
+        return pd.DataFrame({
+            "type": pd.Categorical.from_codes(cols["type"][:n], categories=list(TYPES)),
+            "period": cols["period"][:n],
+            "price": cols["price"][:n],
+            "amount": cols["amount"][:n],
+            "balance": cols["balance"][:n],
+        }, copy=False)
+
+    @property
+    def transaction_history(self):
+        # list of dicts, as the ledger used to store it
+        return self.get_history()[["type", "price", "amount", "balance"]].to_dict(orient="records")
+
+    def flush(self):
+        self._flush_pending()
+        if self.spill_dir is not None:
+            for col in self._cols.values():
+                col.flush()
@@ -0,0 +1,182 @@
+import numpy as np
+
+from methods.heuristic_method import AggregateSink
+
+#############################################
+## Rainflow cycle counting and fade        ##
+#############################################
+# The SoC trajectory (share of the nominal capacity) is fed by chunks of any
+# size. Only the turning points are kept (numpy on the chunk), and the
+# three-point rule (ASTM E1049) runs on them with a stack: a closed cycle is
+# costed at once by the stress model and forgotten, so the memory is the
+# residue of the stack (the not yet closed half cycles), not the trajectory.
+# When the result is asked for, the last point closes what it can on a copy
+# of the stack and the residue is counted as half cycles.
+
+DOD_BINS = np.linspace(0.0, 1.0, 11)
+
+class StressModel:
+    """
+    Capacity lost per cycle as a function of its depth (DoD, Wöhler power law)
+    and of its mean SoC:
+
+        damage = count * DoD ** dod_exponent / cycle_life * exp(soc_coeff * (mean SoC - soc_ref))
+
+    A damage of 1 is the end of life (cycle_life full cycles of 100% DoD),
+    where the capacity is eol_capacity. calendar_fade_per_year adds a linear
+    calendar loss. soc_coeff=0 ignores the mean SoC.
+    """
+
+    def __init__(self, cycle_life=6000, dod_exponent=1.5, eol_capacity=0.8, soc_coeff=0.0, soc_ref=0.5,
+                 calendar_fade_per_year=0.0):
+        if cycle_life <= 0:
+            raise ValueError(f"cycle_life must be positive, got {cycle_life}")
+        self.cycle_life = cycle_life
+        self.dod_exponent = dod_exponent
+        self.eol_capacity = eol_capacity
+        self.soc_coeff = soc_coeff
+        self.soc_ref = soc_ref
+        self.calendar_fade_per_year = calendar_fade_per_year
+
+    def damage(self, dod, mean, count=1.0):
+        """Damage of cycles (scalars or arrays)"""
+        dod = np.asarray(dod, dtype=float)
+        stress = dod ** self.dod_exponent / self.cycle_life
+        if self.soc_coeff:
+            stress = stress * np.exp(self.soc_coeff * (np.asarray(mean, dtype=float) - self.soc_ref))
+        return count * stress
+
+    def capacity(self, damage, years=0.0):
+        """Remaining share of the nominal capacity after a cycle damage and years of calendar ageing"""
+        return max(0.0, 1.0 - (1.0 - self.eol_capacity) * damage - self.calendar_fade_per_year * years)
+
+class Rainflow:
+    """
+    Streaming rainflow counter: update(soc) with chunks of the trajectory,
+    result() at any time. O(n) in the points, memory bounded by the residue.
+    """
+
+    def __init__(self, model=None, bins=DOD_BINS):
+        self.model = StressModel() if model is None else model
+        self.bins = np.asarray(bins, dtype=float)
+        self.reset()
+
+    def reset(self):
+        self.stack = []        # turning points not closed yet
+        self.last = None       # last point seen
+        self.direction = 0.0   # sign of the last move
+        self.points = 0
+        self.damage = 0.0      # closed cycles only
+        self.cycles = 0.0      # closed cycles (a half cycle counts 0.5)
+        self.histogram = np.zeros(len(self.bins) - 1)
+
+    def update(self, soc):
+        """Add the next points of the SoC trajectory (array-like or scalar)"""
+        x = np.atleast_1d(np.asarray(soc, dtype=float))
+        if not len(x):
+            return self
+        self.points += len(x)
+        seq = x if self.last is None else np.concatenate(([self.last], x))
+        d = np.diff(seq)
+        moves = np.flatnonzero(d)
+        if len(moves):
+            sign = np.sign(d[moves])
+            previous = np.concatenate(([self.direction], sign[:-1]))
+            turns = moves[(sign != previous) & (previous != 0)]
+            points = seq[turns].tolist()
+            if self.direction == 0:
+                # very first move: the starting point is a reversal
+                points.insert(0, float(seq[0]))
+            self._push(points)
+            self.direction = float(sign[-1])
+        self.last = float(seq[-1])
+        return self
+
+    def _push(self, points):
+        self._add(*_close(self.stack, points))
+
+    def _add(self, dods, means, counts):
+        # the closed cycles are costed together with numpy
+        if not dods:
+            return
+        dod = np.array(dods)
+        count = np.array(counts)
+        self.damage += float(np.sum(self.model.damage(dod, np.array(means), count)))
+        self.cycles += float(count.sum())
+        k = np.clip(np.searchsorted(self.bins, dod, side="right") - 1, 0, len(self.histogram) - 1)
+        np.add.at(self.histogram, k, count)
+
+    def _closing(self):
+        # the last point ends the trajectory: three-point rule on a copy of the stack
+        stack = list(self.stack)
+        closed = [], [], []
+        if self.last is not None and (not stack or stack[-1] != self.last):
+            closed = _close(stack, [self.last])
+        return stack, closed
+
+    def residue(self):
+        """(dod, mean) arrays of the half cycles still open if the trajectory ended at the last point"""
+        p = np.array(self._closing()[0])
+        return np.abs(np.diff(p)), (p[1:] + p[:-1]) / 2
+
+    def result(self, years=0.0):
+        """Closed cycles (the last point included) plus the residue as half cycles, and the capacity it leaves"""
+        stack, (dods, means, counts) = self._closing()
+        p = np.array(stack)
+        dod = np.concatenate((dods, np.abs(np.diff(p))))
+        mean = np.concatenate((means, (p[1:] + p[:-1]) / 2))
+        count = np.concatenate((counts, np.full(max(len(p) - 1, 0), 0.5)))
+        damage = self.damage + float(np.sum(self.model.damage(dod, mean, count)))
+        return {
+            "points": self.points,
+            "cycles": self.cycles + float(count.sum()),
+            "damage": damage,
+            "capacity": self.model.capacity(damage, years),
+            "residue": len(stack),
+        }
+
+def _close(stack, points):
+    # ASTM E1049 three-point rule: pushes the reversals on the stack (changed
+    # in place), returns the (dod, mean, count) lists of the cycles it closes
+    dods, means, counts = [], [], []
+    for p in points:
+        stack.append(p)
+        while len(stack) >= 3:
+            x = abs(stack[-1] - stack[-2])
+            y = abs(stack[-2] - stack[-3])
+            if x < y:
+                break
+            if len(stack) == 3:
+                # range with the starting point: half cycle
+                dods.append(y); means.append((stack[0] + stack[1]) / 2); counts.append(0.5)
+                del stack[0]
+            else:
+                dods.append(y); means.append((stack[-2] + stack[-3]) / 2); counts.append(1.0)
+                del stack[-3:-1]
+    return dods, means, counts
+
+def trace_degradation(soc, model=None, years=None, steps_per_year=96 * 365):
+    """Rainflow result of a whole SoC trajectory (e.g. op["SoC [-]"] of the Operation trace)"""
+    soc = np.asarray(soc, dtype=float)
+    years = len(soc) / steps_per_year if years is None else years
+    return Rainflow(model).update(soc).result(years)
+
+class DegradationSink(AggregateSink):
+    """
+    AggregateSink that also counts the cycles of the SoC column, for
+    simulate_stream: close() gives the totals and the degradation.
+    """
+
+    def __init__(self, model=None, steps_per_year=96 * 365):
+        super().__init__()
+        self.rainflow = Rainflow(model)
+        self.steps_per_year = steps_per_year
+
+    def write(self, index, cols):
+        super().write(index, cols)
+        self.rainflow.update(cols["SoC [-]"])
+
+    def close(self):
+        result = super().close()
+        result.update(self.rainflow.result(self.steps / self.steps_per_year))
+        return result
@@ -0,0 +1,339 @@
+import math
+import time
+from pathlib import Path
+
+import highspy
+import numpy as np
+import pandas as pd
+
+from methods.LUNA2000Battery import LUNA2000Battery
+from methods.MatrixSolver import MatrixSolver
+from methods.Solver import repair_schedule, lp_repair
+from methods.heuristic_method import OUT_DIR
+from methods.mip_method import _country_prices
+from methods.XLSManager import xls_sheet
+
+#############################################
+## Receding horizon dispatch               ##
+#############################################
+# The optimizer run live: every 15 min the next hours are solved again with the
+# latest prices and the measured SoC. The MatrixSolver model is built once for
+# a window of fixed length starting on the current 4h block; a cycle only
+# changes costs and bounds in place:
+#   - costs: prices of the window (updated forecasts included)
+#   - quarters of the block already elapsed: charge / discharge fixed to what
+#     was executed, the SoC of the last one fixed to the measured SoC
+#   - reserves of the current block (sold at its start) and of the blocks
+#     committed with commit(): fixed
+# and HiGHS starts from the previous plan (repaired on the new window when the
+# window moves to the next block). While the plan of the window is optimal and
+# was executed as planned (same prices), the new bounds only fix what it
+# already does, so it is kept without solving again.
+# The MIP of a long window is rarely closed in 0.7 s (24h ahead: the gap stays
+# around 10%); 8h ahead (windows of 12h) almost every cycle is optimal, so it
+# is the default.
+
+QUARTERS_PER_BLOCK = MatrixSolver.quarters_per_block
+
+class Dispatcher:
+    """
+    Persistent receding horizon optimizer of one battery on price series
+    (one value per quarter for DA, per 4h block for FCR / aFRR), e.g.
+
+        dispatcher = Dispatcher(battery, da, fcr, pos, neg, horizon_hours=8)
+        decision = dispatcher.step(t, measured_soc)
+
+    step() returns the decision of the quarter t (power, reserves, planned SoC)
+    with the status and gap of its plan: a cycle stopped by time_limit returns
+    the best incumbent at that time, not an optimal plan.
+    """
+
+    def __init__(self, battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg,
+                 horizon_hours=8, time_limit=0.7, mip_gap=1e-3, formulation="milp"):
+        if formulation == "lp":
+            raise ValueError("The dispatcher needs the binaries: use the 'milp' or 'tight' formulation")
+        self.da = np.array(market_da_prices, dtype=float)
+        self.fcr = np.array(market_fcr_prices, dtype=float)
+        self.pos = np.array(market_afrr_prices_pos, dtype=float)
+        self.neg = np.array(market_afrr_prices_neg, dtype=float)
+        self.time_limit = time_limit
+        self.mip_gap = mip_gap
+        # from any quarter of a block, horizon_hours ahead are in the window
+        self.horizon = int(round(horizon_hours / MatrixSolver.dt))
+        self.n_quarters = math.ceil((self.horizon + QUARTERS_PER_BLOCK - 1) / QUARTERS_PER_BLOCK) * QUARTERS_PER_BLOCK
+        self.n_blocks = self.n_quarters // QUARTERS_PER_BLOCK
+        if self.n_quarters > len(self.da):
+            raise ValueError(f"{len(self.da)} DA prices, the horizon needs at least {self.n_quarters}")
+
+        self.solver = MatrixSolver(battery, self.da, self.fcr, self.pos, self.neg, start=0,
+                                   n_quarters=self.n_quarters, formulation=formulation)
+        s = self.solver
+        self.Pmax = s.P * s.C_rate
+        # first row of soc_cons (after the B rows of fcr_rule): SoC[0] - ... = SoC0
+        self._soc0_row = self.n_blocks
+        self._step_cols = np.concatenate([s.col[name] for name in ("Pch", "Pdis", "SoC")]).astype(np.int32)
+        self._step_lower = np.zeros(3 * self.n_quarters)
+        self._step_upper = np.concatenate([np.full(2 * self.n_quarters, self.Pmax), np.ones(self.n_quarters)])
+        self._reserve_names = ("R_FCR", "R_aFRR_pos", "R_aFRR_neg")
+        self._reserve_upper = {"R_FCR": s.Pnom, "R_aFRR_pos": self.Pmax, "R_aFRR_neg": self.Pmax}
+        self._cost_cols = np.concatenate([s.col[name] for name in ("Pdis", "Pch") + self._reserve_names]).astype(np.int32)
+        self._cost = s.lp["col_cost"].copy()
+        self._binaries = np.concatenate([s.col["u_ch"], s.col["u_dis"]]).astype(np.int32)
+
+        # absolute block -> (R_FCR, R_aFRR_pos, R_aFRR_neg); absolute quarter -> (Pch, Pdis)
+        self.committed = {}
+        self.executed = {}
+        self.window_start = None
+        self.plan = None
+        self.plan_optimal = False
+        self.prices_changed = False
+        self.last_schedule = None
+        self.cycles = 0
+        self.solves = 0
+
+    def update_prices(self, step, da=None, block=None, fcr=None, pos=None, neg=None):
+        """New prices (forecasts or cleared): da from the quarter step, reserves from the 4h block"""
+        self.prices_changed = True
+        if da is not None:
+            self.da[step:step + len(da)] = da
+        for series, values in ((self.fcr, fcr), (self.pos, pos), (self.neg, neg)):
+            if values is not None:
+                if block is None:
+                    raise ValueError("block is needed to update the reserve prices")
+                series[block:block + len(values)] = values
+
+    def commit(self, block, fcr=0.0, pos=0.0, neg=0.0):
+        """Reserves already sold for a 4h block (absolute index), fixed in every later cycle"""
+        self.committed[block] = (fcr, pos, neg)
+
+    def record(self, step, p_charge, p_discharge):
+        """Charge / discharge actually executed in the quarter step (default: the decision)"""
+        self.executed[step] = (p_charge, p_discharge)
+
+    def _fix_window(self, ws, k, soc):
+        s = self.solver
+        h = s.highs
+        H = self.n_quarters
+        B = self.n_blocks
+        first_block = ws // QUARTERS_PER_BLOCK
+
+        # prices of the window
+        da = self.da[ws:ws + H]
+        s.start = ws
+        s.c_DA = da
+        s.c_FCR_block = self.fcr[first_block:first_block + B]
+        s.c_aFRR_pos_block = self.pos[first_block:first_block + B]
+        s.c_aFRR_neg_block = self.neg[first_block:first_block + B]
+        cost = np.concatenate([da * s.dt, -da * s.dt, s.c_FCR_block * s.dt_block,
+                               s.c_aFRR_pos_block * s.dt_block, s.c_aFRR_neg_block * s.dt_block])
+        h.changeColsCost(len(self._cost_cols), self._cost_cols, cost)
+        self._cost[self._cost_cols] = cost
+
+        # elapsed quarters of the block: executed power, free SoC but the last one (measured)
+        lower = self._step_lower.copy()
+        upper = self._step_upper.copy()
+        for j in range(k):
+            pch, pdis = self.executed.get(ws + j, (0.0, 0.0))
+            lower[j] = upper[j] = pch
+            lower[H + j] = upper[H + j] = pdis
+            lower[2 * H + j] = -np.inf
+            upper[2 * H + j] = np.inf
+        if k:
+            lower[2 * H + k - 1] = upper[2 * H + k - 1] = soc
+            h.changeRowBounds(self._soc0_row, -np.inf, np.inf)
+        else:
+            h.changeRowBounds(self._soc0_row, soc, soc)
+        h.changeColsBounds(len(self._step_cols), self._step_cols, lower, upper)
+
+        # committed reserves fixed, the others free up to their bound
+        for r, name in enumerate(self._reserve_names):
+            lo = np.zeros(B)
+            up = np.full(B, self._reserve_upper[name])
+            for b in range(B):
+                fixed = self.committed.get(first_block + b)
+                if fixed is not None:
+                    lo[b] = up[b] = fixed[r]
+            cols = s.col[name].astype(np.int32)
+            h.changeColsBounds(B, cols, lo, up)
+
+    def _seed(self, ws, soc, deadline):
+        # first incumbent of a new block: the best of the previous plan (repaired
+        # on the new window) and of the LP relaxation made feasible by lp_repair.
+        # The LP and its repair get at most half of the time left before deadline.
+        s = self.solver
+        h = s.highs
+        s.SoC0 = soc
+        candidates = []
+        if self.last_schedule is not None:
+            candidates.append(repair_schedule(s, self.last_schedule)[0])
+        seed_deadline = time.perf_counter() + (deadline - time.perf_counter()) / 2
+        n = len(self._binaries)
+        h.changeColsIntegrality(n, self._binaries, np.zeros(n, dtype=np.uint8))
+        h.setOptionValue("time_limit", max(seed_deadline - time.perf_counter(), 0.0))
+        h.run()
+        left = seed_deadline - time.perf_counter()
+        if h.getModelStatus() == highspy.HighsModelStatus.kOptimal and left > 0:
+            s.solution = np.asarray(h.getSolution().col_value)
+            h.setOptionValue("time_limit", left)
+            lp_repair(s)
+            values = {name: s.values(name).copy() for name in s.col}
+            blocks = np.arange(self.n_quarters) // QUARTERS_PER_BLOCK
+            values["u_ch"] = (values["Pch"] + values["R_aFRR_neg"][blocks] > 1e-9).astype(float)
+            values["u_dis"] = (values["Pdis"] + values["R_aFRR_pos"][blocks] > 1e-9).astype(float)
+            candidates.append(values)
+        h.changeColsIntegrality(n, self._binaries, np.ones(n, dtype=np.uint8))
+        # lp_repair fixed columns to 0: bounds of the window again
+        self._fix_window(ws, 0, soc)
+        if candidates:
+            values = max(candidates, key=lambda v: sum(self._cost[s.col[name]] @ v[name] for name in s.col))
+            cols = np.concatenate([s.col[name] for name in values]).astype(np.int32)
+            h.setSolution(len(cols), cols, np.concatenate([values[name] for name in values]))
+
+    def step(self, t, soc):
+        """
+        One cycle at the quarter t with the measured SoC (share of the capacity
+        at the start of t): re-optimize the window and return the decision of t.
+        """
+        t0 = time.perf_counter()
+        s = self.solver
+        ws = t - t % QUARTERS_PER_BLOCK
+        k = t - ws
+        if ws + self.n_quarters > len(self.da):
+            raise ValueError(f"Not enough prices after the quarter {t} for the horizon ({self.n_quarters} quarters)")
+        soc = min(max(float(soc), 0.0), 1.0)
+        self._fix_window(ws, k, soc)
+
+        same_window = self.plan is not None and ws == self.window_start
+        if same_window and self.plan_optimal and not self.prices_changed and self._as_planned(ws, k, soc):
+            # the new bounds only fix what the optimal plan already does: it is still optimal
+            solved = False
+        else:
+            if same_window:
+                # same window: the previous solution, still feasible if the SoC went as planned
+                s.highs.setSolution(len(self.plan), np.arange(len(self.plan), dtype=np.int32), self.plan)
+            elif k == 0:
+                self._seed(ws, soc, t0 + self.time_limit)
+            # the seed and the solve share time_limit
+            s.solve(time_limit=max(t0 + self.time_limit - time.perf_counter(), 0.0), mip_gap=self.mip_gap,
+                    verbose=False)
+            self.solves += 1
+            self.prices_changed = False
+            solved = True
+
+        block = t // QUARTERS_PER_BLOCK
+        if not solved:
+            pch, pdis, soc_end = (float(s.values(name)[k]) for name in ("Pch", "Pdis", "SoC"))
+            reserves = tuple(float(s.values(name)[0]) for name in self._reserve_names)
+            objective = s.objective_value()
+        elif s.feasible():
+            self.plan_optimal = s.status() == "optimal"
+            self.plan = s.solution.copy()
+            self.last_schedule = s.schedule()
+            self.window_start = ws
+            pch, pdis, soc_end = (float(s.values(name)[k]) for name in ("Pch", "Pdis", "SoC"))
+            reserves = tuple(float(s.values(name)[0]) for name in self._reserve_names)
+            objective = s.objective_value()
+        else:
+            # no schedule in time: idle, the reserves already sold are kept
+            pch = pdis = 0.0
+            reserves = self.committed.get(block, (0.0, 0.0, 0.0))
+            soc_end = soc
+            objective = math.nan
+            self.plan_optimal = False
+        # the reserves of the block are sold at its first quarter
+        self.committed.setdefault(block, reserves)
+        self.record(t, pch, pdis)
+        for old in [q for q in self.executed if q < ws]:
+            del self.executed[old]
+        self.cycles += 1
+        return {
+            "time_step": t,
+            "P_charge_MW": pch,
+            "P_discharge_MW": pdis,
+            "SoC": soc_end,
+            "R_FCR": reserves[0],
+            "R_AFRR_pos": reserves[1],
+            "R_AFRR_neg": reserves[2],
+            "status": s.status(),
+            "objective": objective,
+            "gap": s.gap,
+            "solved": solved,
+            "latency_s": time.perf_counter() - t0,
+        }
+
+    def _as_planned(self, ws, k, soc):
+        # elapsed quarters executed and SoC measured as in the plan
+        s = self.solver
+        for j in range(k):
+            executed = self.executed.get(ws + j, (0.0, 0.0))
+            planned = (s.values("Pch")[j], s.values("Pdis")[j])
+            if not all(math.isclose(a, b, abs_tol=1e-7) for a, b in zip(executed, planned)):
+                return False
+        return k == 0 or math.isclose(soc, s.values("SoC")[k - 1], abs_tol=1e-7)
+
+    def schedule(self):
+        """Plan of the last cycle over its window (MatrixSolver.schedule)"""
+        return self.solver.schedule()
+
+def replay(code="DE", c_rate=0.5, cycles=1.0, days=365, horizon_hours=8, time_limit=0.7, mip_gap=1e-3,
+           xls_path="input/TechArena2025_data.xlsx", out_dir=OUT_DIR / "dispatch"):
+    """
+    Latency benchmark: the historical prices of one country fed to a
+    Dispatcher one quarter at a time (prices known over the horizon, the
+    measured SoC is the planned one). Writes the decisions and returns the
+    latency percentiles and the revenue.
+    """
+    prices = _country_prices(xls_sheet(xls_path), code)
+    battery = LUNA2000Battery(cycles_max=cycles)
+    battery.c_rate_max = c_rate
+    dispatcher = Dispatcher(battery, *prices, horizon_hours=horizon_hours, time_limit=time_limit, mip_gap=mip_gap)
+    n = min(int(days * 96), len(prices[0]) - dispatcher.n_quarters)
+
+    rows = []
+    soc = 0.0
+    for t in range(n):
+        row = dispatcher.step(t, soc)
+        soc = row["SoC"]
+        rows.append(row)
+        if (t + 1) % 96 == 0:
+            lat = np.array([r["latency_s"] for r in rows[-96:]])
+            optimal = sum(r["status"] == "optimal" for r in rows[-96:])
+            print(f"{code} day {(t + 1) // 96}: p50 {np.percentile(lat, 50):.3f} s, max {lat.max():.3f} s, "
+                  f"{optimal}/96 optimal")
+    decisions = pd.DataFrame(rows)
+
+    dt = MatrixSolver.dt
+    block = decisions["time_step"].to_numpy() // QUARTERS_PER_BLOCK
+    da = np.asarray(prices[0][:n])
+    energy = float(((decisions["P_discharge_MW"] - decisions["P_charge_MW"]) * da * dt).sum())
+    capacity = float((decisions["R_FCR"] * np.asarray(prices[1])[block] * dt
+                      + decisions["R_AFRR_pos"] * np.asarray(prices[2])[block] * dt
+                      + decisions["R_AFRR_neg"] * np.asarray(prices[3])[block] * dt).sum())
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"dispatch_{code}_{c_rate}_{cycles}.csv"
+    decisions.to_csv(path, index=False)
+
+    latency = decisions["latency_s"].to_numpy()
+    gap = decisions["gap"].to_numpy(dtype=float)
+    result = {
+        "cycles": n,
+        "mean [s]": float(latency.mean()),
+        "p50 [s]": float(np.percentile(latency, 50)),
+        "p99 [s]": float(np.percentile(latency, 99)),
+        "max [s]": float(latency.max()),
+        "over 1 s": int((latency > 1.0).sum()),
+        "solves": int(decisions["solved"].sum()),
+        "optimal": int((decisions["status"] == "optimal").sum()),
+        "time limit (incumbent)": int((decisions["status"] == "maxTimeLimit").sum()),
+        "no schedule (idle)": int(decisions["objective"].isna().sum()),
+        "gap p50 [%]": 100 * float(np.nanpercentile(gap, 50)),
+        "gap p90 [%]": 100 * float(np.nanpercentile(gap, 90)),
+        "gap max [%]": 100 * float(np.nanmax(gap)),
+        "energy revenue [EUR]": energy,
+        "capacity revenue [EUR]": capacity,
+    }
+    print(pd.Series(result).to_string())
+    print(f"Written to {path}")
+    return result
@@ -0,0 +1,151 @@
+import numpy as np
+
+#############################################
+## Levelized ROI on arrays                 ##
+#############################################
+# Every input broadcasts against the others (numpy rules), so one call can
+# evaluate a whole sensitivity grid. The NPV uses the closed form of the two
+# geometric sums (inflated profits, constant OPEX) instead of a loop over the
+# years; cash_flows() gives the year by year table of the Investment CSV.
+# evaluate_yearly() / yearly_cash_flows() take one profit per year instead
+# (lifetime simulation with capacity fade).
+
+CAPEX_PER_MWH = 380000
+CAPEX_POWER_PER_MW = 200000
+E_NOM_MWH = 4.472
+OPEX_RATE = 0.02
+YEARS = 10
+
+def _geometric_sum(r, n):
+    # 1 + r + ... + r^(n-1), n when r = 1
+    r = np.asarray(r, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = (1.0 - r ** n) / (1.0 - r)
+    return np.where(np.abs(1.0 - r) < 1e-12, n, s)
+
+def evaluate(year_profit_eur, p_max_mw, wacc=0.10, inflation=0.02, capex_per_mwh=CAPEX_PER_MWH,
+             capex_power_per_mw=CAPEX_POWER_PER_MW, e_nom_mwh=E_NOM_MWH, opex_rate=OPEX_RATE, years=YEARS):
+    """
+    CAPEX, OPEX, NPV and levelized ROI (NPV / CAPEX) of broadcast arrays.
+
+    The yearly profit grows with the inflation, the OPEX is a constant share
+    of the CAPEX and both are discounted at the WACC over `years` (may be an
+    array too). Returns a dict of float64 arrays (0-d for scalar inputs),
+    with the yearly profit per MW in kEUR/MW as in the Configuration CSV.
+    """
+    profit = np.asarray(year_profit_eur, dtype=float)
+    p_max = np.asarray(p_max_mw, dtype=float)
+    wacc = np.asarray(wacc, dtype=float)
+    years = np.asarray(years)
+
+    capex = capex_per_mwh * e_nom_mwh + capex_power_per_mw * p_max
+    opex = capex * opex_rate
+    d = 1.0 / (1.0 + wacc)
+    npv = -capex + profit * d * _geometric_sum((1.0 + np.asarray(inflation, dtype=float)) * d, years) \
+        - opex * d * _geometric_sum(d, years)
+
+    shape = np.broadcast_shapes(npv.shape, p_max.shape)
+    roi = np.divide(npv, capex, out=np.zeros(shape), where=capex > 0)
+    profit_mw = np.divide(np.broadcast_to(profit, shape), p_max, out=np.zeros(shape), where=p_max > 0)
+    return {
+        "capex": np.broadcast_to(capex, shape),
+        "opex": np.broadcast_to(opex, shape),
+        "npv": np.broadcast_to(npv, shape),
+        "levelized_roi": roi,
+        "profit_kEUR_MW": profit_mw / 1000.0,
+    }
+
+def cash_flows(year_profit_eur, p_max_mw, wacc=0.10, inflation=0.02, capex_per_mwh=CAPEX_PER_MWH,
+               capex_power_per_mw=CAPEX_POWER_PER_MW, e_nom_mwh=E_NOM_MWH, opex_rate=OPEX_RATE, years=YEARS):
+    """
+    Year by year cash flows, on a last axis of max(years) years (zero after
+    the lifetime of a scenario). Columns named like the Investment CSV.
+    """
+    profit = np.asarray(year_profit_eur, dtype=float)[..., None]
+    wacc = np.asarray(wacc, dtype=float)[..., None]
+    infl = np.asarray(inflation, dtype=float)[..., None]
+    life = np.asarray(years)[..., None]
+    capex = capex_per_mwh * e_nom_mwh + capex_power_per_mw * np.asarray(p_max_mw, dtype=float)[..., None]
+    opex = capex * opex_rate
+
+    y = np.arange(1, int(np.max(years)) + 1)
+    alive = y <= life
+    prof = profit * (1 + infl) ** (y - 1)
+    discount = 1 / ((1 + wacc) ** y)
+    disc = (prof - opex) / ((1 + wacc) ** y)
+    shape = np.broadcast_shapes(prof.shape, discount.shape, opex.shape, alive.shape)
+    return {
+        "Year": np.broadcast_to(y, shape),
+        "Yearly profits [EUR]": np.where(alive, prof, 0.0),
+        "OPEX [EUR]": np.where(alive, opex, 0.0),
+        "Discount factor": np.where(alive, discount, 0.0),
+        "Discounted CF [EUR]": np.where(alive, disc, 0.0),
+    }
+
+def evaluate_yearly(yearly_profit_eur, p_max_mw, wacc=0.10, inflation=0.02, capex_per_mwh=CAPEX_PER_MWH,
+                    capex_power_per_mw=CAPEX_POWER_PER_MW, e_nom_mwh=E_NOM_MWH, opex_rate=OPEX_RATE):
+    """
+    Same as evaluate with a profit per year on the last axis (lifetime of
+    the simulation, in prices of the first year: the inflation is applied
+    on top), e.g. the profits of a degrading battery.
+    """
+    profits = np.asarray(yearly_profit_eur, dtype=float)
+    p_max = np.asarray(p_max_mw, dtype=float)
+    wacc = np.asarray(wacc, dtype=float)
+    y = np.arange(1, profits.shape[-1] + 1)
+
+    capex = capex_per_mwh * e_nom_mwh + capex_power_per_mw * p_max
+    opex = capex * opex_rate
+    d = 1.0 / (1.0 + wacc)
+    growth = (1.0 + np.asarray(inflation, dtype=float)[..., None]) ** (y - 1)
+    npv = -capex + np.sum(profits * growth * d[..., None] ** y, axis=-1) \
+        - opex * d * _geometric_sum(d, len(y))
+
+    shape = np.broadcast_shapes(npv.shape, p_max.shape)
+    roi = np.divide(npv, capex, out=np.zeros(shape), where=capex > 0)
+    profit_mw = np.divide(np.broadcast_to(profits[..., 0], shape), p_max, out=np.zeros(shape), where=p_max > 0)
+    return {
+        "capex": np.broadcast_to(capex, shape),
+        "opex": np.broadcast_to(opex, shape),
+        "npv": np.broadcast_to(npv, shape),
+        "levelized_roi": roi,
+        "profit_kEUR_MW": profit_mw / 1000.0,
+    }
+
+def yearly_cash_flows(yearly_profit_eur, p_max_mw, wacc=0.10, inflation=0.02, capex_per_mwh=CAPEX_PER_MWH,
+                      capex_power_per_mw=CAPEX_POWER_PER_MW, e_nom_mwh=E_NOM_MWH, opex_rate=OPEX_RATE):
+    """cash_flows of evaluate_yearly (one column per year of the profits)"""
+    profits = np.asarray(yearly_profit_eur, dtype=float)
+    wacc = np.asarray(wacc, dtype=float)[..., None]
+    infl = np.asarray(inflation, dtype=float)[..., None]
+    capex = capex_per_mwh * e_nom_mwh + capex_power_per_mw * np.asarray(p_max_mw, dtype=float)[..., None]
+    opex = capex * opex_rate
+
+    y = np.arange(1, profits.shape[-1] + 1)
+    prof = profits * (1 + infl) ** (y - 1)
+    discount = 1 / ((1 + wacc) ** y)
+    shape = np.broadcast_shapes(prof.shape, discount.shape, opex.shape)
+    return {
+        "Year": np.broadcast_to(y, shape),
+        "Yearly profits [EUR]": np.broadcast_to(prof, shape),
+        "OPEX [EUR]": np.broadcast_to(opex, shape),
+        "Discount factor": np.broadcast_to(discount, shape),
+        "Discounted CF [EUR]": np.broadcast_to((prof - opex) * discount, shape),
+    }
+
+def sensitivity(year_profit_eur, p_max_mw, **axes):
+    """
+    Full factorial grid: every keyword of evaluate given as a list of values
+    gets its own axis (in the keyword order), without building the grid of
+    inputs. Returns the axes and the evaluate dict of N-d arrays, e.g.
+    sensitivity(3e5, 2.2, wacc=np.linspace(0.05, 0.15, 101),
+    inflation=np.linspace(0, 0.05, 101), capex_per_mwh=np.linspace(3e5, 4.5e5, 100))
+    is a million scenarios.
+    """
+    names = list(axes)
+    kwargs = {}
+    for k, name in enumerate(names):
+        shape = [1] * len(names)
+        shape[k] = -1
+        kwargs[name] = np.asarray(axes[name]).reshape(shape)
+    return {name: np.asarray(axes[name]) for name in names}, evaluate(year_profit_eur, p_max_mw, **kwargs)
@@ -8,7 +8,7 @@ class LUNA2000Battery:
     status = "empty"
     last_transaction = None
 
-    def __init__(self, capacity_kwh=4472, power_kw=2236, cycles_max=1.0):
+    def __init__(self, capacity_kwh=4472, power_kw=2236, cycles_max=1.0, degradation=None):
         # Specifications
         self.model = "LUNA2000-4.5MWH-2H1"
         self.capacity_kwh = capacity_kwh
@@ -43,6 +43,13 @@ class LUNA2000Battery:
         
         # Residual capacity (degradation)
         self.capacity_fade = 1.0  # 1.0 = No degradation, 0.8 = 80% of the remaining capacity
+
+        # Optional rainflow counter on the SOC (a StressModel or a Rainflow), else the DoD buckets
+        self.rainflow = None
+        if degradation is not None:
+            from methods.Degradation import Rainflow
+            self.rainflow = degradation if isinstance(degradation, Rainflow) else Rainflow(degradation)
+            self.rainflow.update(self.soc_kwh / self.capacity_kwh)
         
         # create billing
         self.billing = Billing()
@@ -102,6 +109,11 @@ class LUNA2000Battery:
 
     def update_degradation(self, energy_processed, is_charge=True):
         """Met à jour la dégradation basée sur les cycles"""
+        if self.rainflow is not None:
+            # rainflow on the SOC trajectory (share of the nominal capacity)
+            self.rainflow.update(self.soc_kwh / self.capacity_kwh)
+            self.capacity_fade = self.rainflow.result()["capacity"]
+            return
         # Calculate the DOD (Depth of Discharge) for partial cycle
         dod = energy_processed / (self.capacity_kwh * self.capacity_fade)
         
@@ -116,6 +128,12 @@ class LUNA2000Battery:
             self.capacity_fade *= (0.9995 ** cycles_passed)  # 0.05% of loss
             self.dod_weighted_cycles %= 100
 
+    def trajectory_degradation(self, soc_kwh, years=0.0):
+        """Rainflow result of a whole SOC trajectory in kWh (the battery itself is not changed)"""
+        from methods.Degradation import Rainflow
+        model = self.rainflow.model if self.rainflow is not None else None
+        return Rainflow(model).update(np.asarray(soc_kwh, dtype=float) / self.capacity_kwh).result(years)
+
     def fcr_capacite(self, price=0, power_kw=None, duration_hours=4.0, temperature_c=25):
         """
         Provides stored energy (FCR capacity discharge)."
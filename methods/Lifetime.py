@@ -0,0 +1,194 @@
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from methods import Finance
+from methods.Degradation import StressModel, DegradationSink
+from methods.heuristic_method import (
+    OUT_DIR, COUNTRIES, CONFIGS, DATA_XLS, LIMIT_DAYS, prepare_market, simulate_prepared, _year_prices,
+    _country_rates,
+)
+
+#############################################
+## Lifetime simulation with capacity fade  ##
+#############################################
+# The heuristic runs year after year on the same prepared price arrays, each
+# year with the capacity left by the rainflow damage of the previous ones and
+# starting from the SoC where the previous year ended.
+# The kernel limits the power by the C-rate of the remaining capacity (as
+# LUNA2000Battery does), so every energy of the dispatch scales with it and
+# the SoC trajectory does not change: a year at capacity c is the year at
+# the nominal capacity times c, same cycles and same damage. A year is then
+# only simulated when its state (efficiency, initial SoC) is new; the other
+# years are scaled. A new initial SoC is only simulated until the SoC meets
+# the first simulated year at the start of a day, the rest of that year is
+# taken as it is. reuse=False simulates every year at its capacity.
+# Each year is counted on its own by the rainflow (its residue as half cycles).
+# Limitation: p_max fades with the capacity instead of staying at the power of
+# the inverter, so the reserves (and profits) of the late years are
+# underestimated compared to a re-dispatch at a fixed inverter power.
+
+E_NOM_MWH = 4.472
+YEARS = 10
+SOC_TOL = 1e-9   # SoC difference under which a spliced year joins its reference
+
+def _splice(arrays, stats, c_rate, cycles_per_day, soc0, ref, **kwargs):
+    # year starting at soc0, simulated day by day until its SoC at the start
+    # of a day is the one of the reference year (same prices and efficiency):
+    # from there the state is the same (cycles of the day reset), so are the days
+    n = len(arrays["da"])
+    bounds = np.concatenate(([0], np.flatnonzero(arrays["new_day"][1:]) + 1, [n]))
+    parts = []
+    soc = soc0
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        if a and math.isclose(soc, ref["SoC [-]"][a - 1], rel_tol=0, abs_tol=SOC_TOL):
+            parts.append({key: col[a:] for key, col in ref.items()})
+            break
+        part = {key: arr[a:b] for key, arr in arrays.items()}
+        parts.append(simulate_prepared(part, stats, c_rate, cycles_per_day, soc0=soc, **kwargs))
+        soc = float(parts[-1]["SoC [-]"][-1])
+    return {key: np.concatenate([part[key] for part in parts]) for key in ref}
+
+def _year(arrays, stats, c_rate, cycles_per_day, soc0, model, ref=None, **kwargs):
+    if ref is None:
+        cols = simulate_prepared(arrays, stats, c_rate, cycles_per_day, soc0=soc0, **kwargs)
+    else:
+        cols = _splice(arrays, stats, c_rate, cycles_per_day, soc0, ref, **kwargs)
+    sink = DegradationSink(model)
+    sink.write(range(len(arrays["da"])), cols)
+    return cols, sink.close(), float(cols["SoC [-]"][-1])
+
+def lifetime(market, c_rate, cycles_per_day, model=None, years=YEARS, eta_rt=0.88, eta_fade_per_year=0.0,
+             soc0=0.6, e_nom_mwh=E_NOM_MWH, limit_days=LIMIT_DAYS, reuse=True):
+    """
+    Year by year rows of one configuration on a prepared market (index,
+    arrays, stats): capacity and efficiency at the start of the year, yearly
+    profit (prices of the first year), energies, cycles and damage.
+    """
+    model = StressModel() if model is None else model
+    _, arrays, stats = market
+    scale = 365 / limit_days
+    runs = {}   # (efficiency, initial SoC) -> totals and final SoC at e_nom_mwh
+    refs = {}   # efficiency -> columns of its first simulated year
+    rows = []
+    damage = 0.0
+    soc = soc0
+    for year in range(1, years + 1):
+        capacity = model.capacity(damage, year - 1)
+        eta = eta_rt - eta_fade_per_year * (year - 1)
+        if eta <= 0:
+            raise ValueError(f"round-trip efficiency of year {year} is {eta}, eta_fade_per_year is too large")
+        run = runs.get((eta, soc)) if reuse else None
+        simulated = run is None
+        if not reuse:
+            _, totals, end_soc = _year(arrays, stats, c_rate, cycles_per_day, soc, model,
+                                       e_nom_mwh=e_nom_mwh * capacity, eta_rt=eta)
+            run = (totals, end_soc, e_nom_mwh * capacity)
+        elif simulated:
+            cols, totals, end_soc = _year(arrays, stats, c_rate, cycles_per_day, soc, model, refs.get(eta),
+                                          e_nom_mwh=e_nom_mwh, eta_rt=eta)
+            refs.setdefault(eta, cols)
+            run = runs[(eta, soc)] = (totals, end_soc, e_nom_mwh)
+        totals, end_soc, e_run = run
+        factor = e_nom_mwh * capacity / e_run * scale
+        damage += totals["damage"] * scale
+        rows.append({
+            "Year": year,
+            "Capacity [-]": capacity,
+            "Round-trip efficiency [-]": eta,
+            "Yearly profits [EUR]": totals["Total revenue [EUR]"] * factor,
+            "Charge [MWh]": totals["Charge [MWh]"] * factor,
+            "Discharge [MWh]": totals["Discharge [MWh]"] * factor,
+            "Cycles": totals["cycles"] * scale,
+            "Damage": damage,
+            "Simulated": simulated,
+        })
+        soc = end_soc
+    return pd.DataFrame(rows)
+
+def _lifetime_job(code, stats, c_rate, cycles, kwargs):
+    from methods.heuristic_method import _shared_arrays
+    arrays = {key: _shared_arrays[(code, key)] for key in ("da", "fcr", "pos", "neg", "new_day")}
+    return lifetime((range(len(arrays["da"])), arrays, stats), c_rate, cycles, **kwargs)
+
+def lifetime_sweep(da, fcr, afrr, countries=COUNTRIES, configs=CONFIGS, workers=None, limit_days=LIMIT_DAYS,
+                   **kwargs):
+    """
+    lifetime() of every country x (c_rate, cycles) pair on markets prepared
+    once, yielded as (code, c_rate, cycles, years DataFrame) in job order.
+    The jobs are spread like heuristic_method.sweep (shared memory) over
+    `workers` processes, None = all the CPUs; with one process (or one job)
+    they run in this process.
+    """
+    from methods.heuristic_method import _share_arrays, _attach_shared
+    from concurrent.futures import ProcessPoolExecutor
+
+    prepared = {code: prepare_market(da, fcr, afrr, code, limit_days) for code in countries}
+    jobs = [(code, c_rate, cycles) for code in countries for c_rate, cycles in configs]
+    kwargs["limit_days"] = limit_days
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers > 1:
+        shm, layout = _share_arrays(prepared)
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach_shared, initargs=(shm.name, layout)) as pool:
+                futures = [pool.submit(_lifetime_job, code, prepared[code].stats, c_rate, cycles, kwargs)
+                           for code, c_rate, cycles in jobs]
+                for (code, c_rate, cycles), fut in zip(jobs, futures):
+                    yield code, c_rate, cycles, fut.result()
+        finally:
+            shm.close()
+            shm.unlink()
+        return
+    for code, c_rate, cycles in jobs:
+        yield code, c_rate, cycles, lifetime(prepared[code], c_rate, cycles, **kwargs)
+
+def run(countries=COUNTRIES, configs=CONFIGS, years=YEARS, model=None, eta_fade_per_year=0.0, workers=None,
+        xls_path=DATA_XLS, archive=None, start=None, limit_days=LIMIT_DAYS, e_nom_mwh=E_NOM_MWH,
+        out_dir=OUT_DIR / "lifetime"):
+    """
+    Lifetime of every country x configuration and its levelized ROI from the
+    yearly profits (next to the ROI of a constant first year), written to
+    TechArena_Lifetime_Configuration.csv and TechArena_Lifetime_Years.csv.
+    """
+    t0 = time.perf_counter()
+    da, fcr, afrr, avail_countries, finance = _year_prices(xls_path, archive, start, limit_days)
+    countries = [c for c in countries if c in avail_countries]
+    results = list(lifetime_sweep(da, fcr, afrr, countries, configs, workers=workers, limit_days=limit_days,
+                                  model=model, years=years, eta_fade_per_year=eta_fade_per_year,
+                                  e_nom_mwh=e_nom_mwh))
+    codes = [code for code, _, _, _ in results]
+    p_max = np.array([c_rate * e_nom_mwh for _, c_rate, _, _ in results])
+    profits = np.array([df["Yearly profits [EUR]"].to_numpy() for _, _, _, df in results])
+    wacc, infl = _country_rates(finance, codes)
+    res = Finance.evaluate_yearly(profits, p_max, wacc=wacc, inflation=infl, e_nom_mwh=e_nom_mwh)
+    flat = Finance.evaluate(profits[:, 0], p_max, wacc=wacc, inflation=infl, e_nom_mwh=e_nom_mwh, years=years)
+
+    cfg = pd.DataFrame({
+        "Country": codes,
+        "C-rate": [c_rate for _, c_rate, _, _ in results],
+        "number of cycles": [cycles for _, _, cycles, _ in results],
+        "yearly profits [kEUR/MW]": np.round(res["profit_kEUR_MW"], 2),
+        "final capacity [%]": [round(100 * df["Capacity [-]"].iloc[-1], 2) for _, _, _, df in results],
+        "levelized ROI without fade [%]": np.round(100 * flat["levelized_roi"], 2),
+        "levelized ROI [%]": np.round(100 * res["levelized_roi"], 2),
+    }).sort_values(["levelized ROI [%]"], ascending=False)
+    years_df = pd.concat([
+        df.assign(Country=code, **{"C-rate": c_rate, "number of cycles": cycles})
+        for code, c_rate, cycles, df in results
+    ], ignore_index=True)
+    years_df = years_df[["Country", "C-rate", "number of cycles"] + [c for c in years_df if c not in cfg]]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cfg.to_csv(out_dir / "TechArena_Lifetime_Configuration.csv", index=False)
+    years_df.to_csv(out_dir / "TechArena_Lifetime_Years.csv", index=False)
+    simulated = int(years_df["Simulated"].sum())
+    print(cfg.to_string(index=False))
+    print(f"{len(results)} configurations x {years} years ({simulated} simulated years) "
+          f"in {time.perf_counter() - t0:.1f} s")
+    print(f"Written to {out_dir}")
+    return cfg, years_df
@@ -1,161 +1,219 @@
+import numpy as np
 import pandas as pd
 
+HOUR_NS = 3600 * 10**9
+DAY_NS = 24 * HOUR_NS
+BLOCK_NS = 4 * HOUR_NS
+
+class PriceStore:
+    """
+    Compact price table: sorted int64 epoch index (ns) and float64 columns.
+    Queries on a day, an hour or a 4h block return views on the columns.
+    """
+    __slots__ = ("epoch", "values", "names", "step")
+
+    def __init__(self, epoch, values, names):
+        self.epoch = np.asarray(epoch, dtype=np.int64)
+        self.values = np.atleast_2d(np.asarray(values, dtype=np.float64))  # (n_columns, n)
+        self.names = list(names)
+        # constant time step -> positions are computed, no search needed
+        diffs = np.diff(self.epoch)
+        self.step = int(diffs[0]) if len(diffs) and (diffs == diffs[0]).all() else None
+
+    @classmethod
+    def from_dicts(cls, prices_by_name):
+        """Build the store from {name: {timestamp: price}} (missing keys -> NaN)"""
+        keys = None
+        for d in prices_by_name.values():
+            keys = list(d.keys()) if keys is None else keys
+            if list(d.keys()) != keys:
+                keys = sorted(set(keys).union(d.keys()))
+        epoch = pd.DatetimeIndex(keys).as_unit("ns").asi8 if keys else np.empty(0, dtype=np.int64)
+        values = np.array(
+            [[d.get(k, np.nan) for k in keys] for d in prices_by_name.values()], dtype=np.float64
+        ).reshape(len(prices_by_name), len(epoch))
+        # drop NaT keys (empty rows at the end of a sheet)
+        order = np.argsort(epoch, kind="stable")
+        order = order[epoch[order] != np.iinfo(np.int64).min]
+        return cls(epoch[order], values[:, order], prices_by_name.keys())
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def column(self, name):
+        return self.values[self.names.index(name)]
+
+    def to_dict(self, name):
+        return dict(zip(pd.DatetimeIndex(self.epoch), self.column(name).tolist()))
+
+    def _pos(self, t):
+        # first position with epoch >= t
+        if self.step is not None and len(self.epoch):
+            i = -(-(t - int(self.epoch[0])) // self.step)
+            return min(max(i, 0), len(self.epoch))
+        return int(np.searchsorted(self.epoch, t))
+
+    def range(self, start, end):
+        """slice of the positions with start <= epoch < end"""
+        return slice(self._pos(start), self._pos(end))
+
+    def period(self, date):
+        """slice of a 'YYYY-MM-DD' day (or any pandas period string: month, year...)"""
+        if isinstance(date, str) and len(date) == 10:
+            start = int(np.datetime64(date, "ns").astype(np.int64))
+            return self.range(start, start + DAY_NS)
+        per = pd.Period(date)
+        start = pd.Timestamp(per.start_time).as_unit("ns").value
+        end = pd.Timestamp(per.end_time).as_unit("ns").value + 1
+        return self.range(start, end)
+
+    def day(self, date, name):
+        return self.column(name)[self.period(date)]
+
+    def hour(self, ts, name):
+        t = pd.Timestamp(ts).floor("h").as_unit("ns").value
+        return self.column(name)[self.range(t, t + HOUR_NS)]
+
+    def block(self, ts, name):
+        """4h block containing ts (blocks start at 00:00, 04:00, ...)"""
+        t = pd.Timestamp(ts).as_unit("ns").value
+        t -= (t % DAY_NS) % BLOCK_NS
+        return self.column(name)[self.range(t, t + BLOCK_NS)]
+
+    def hourly_means(self, date, name):
+        """(hours, means) of the hours of the period that have data"""
+        sl = self.period(date)
+        vals = self.column(name)[sl]
+        if not len(vals):
+            return np.empty(0, dtype=np.int64), vals
+        if self.step is not None and HOUR_NS % self.step == 0:
+            per_hour = HOUR_NS // self.step
+            first_hour = (int(self.epoch[sl.start]) % DAY_NS) // HOUR_NS
+            first_ok = int(self.epoch[sl.start]) % HOUR_NS == 0
+            if first_ok and first_hour == 0 and len(vals) % (24 * per_hour) == 0:
+                # whole aligned days: (days, 24, steps per hour)
+                return np.arange(24), vals.reshape(-1, 24, per_hour).mean(axis=(0, 2))
+        # generic case (e.g. 4h blocks or incomplete days)
+        hours = (self.epoch[sl] % DAY_NS) // HOUR_NS
+        counts = np.bincount(hours, minlength=24)
+        sums = np.bincount(hours, weights=vals, minlength=24)
+        present = np.flatnonzero(counts)
+        return present, sums[present] / counts[present]
+
+def _hourly_series(date, hours, means):
+    index = pd.Timestamp(date) + pd.to_timedelta(np.asarray(hours), unit="h")
+    return pd.Series(means, index=pd.DatetimeIndex(index))
+
 class DA:
-    prices = {}
+    __slots__ = ("store", "_prices")
 
     def __init__(self,DA_prices):
-        self.prices = DA_prices
-    
+        self.store = PriceStore.from_dicts({"price": DA_prices})
+        self._prices = None
+
+    @classmethod
+    def from_store(cls, store):
+        """Wrap an existing PriceStore (column "price"), e.g. a window of the PriceArchive"""
+        obj = cls.__new__(cls)
+        obj.store = store
+        obj._prices = None
+        return obj
+
+    @property
+    def prices(self):
+        # dict view built on the first access only (the store does not change)
+        if self._prices is None:
+            self._prices = self.store.to_dict("price")
+        return self._prices
+
+    def get_day(self, date):
+        return self.store.day(date, "price")
+
     def get_daily_prices(self, date):
-        hourly_totals = {h: [] for h in range(24)}
-
-        # Parcourir toutes les données du mois
-        for k, price in self.prices.items():
-            key_str = str(k)
-            if key_str.startswith(date):
-                try:
-                    # Extraire l'heure de manière plus robuste
-                    if ' ' in key_str or ':' in key_str:
-                        # Format avec espace ou deux-points (YYYY-MM-DD HH:MM:SS)
-                        hour_part = key_str.split()[1] if ' ' in key_str else key_str
-                        hour = int(hour_part.split(':')[0])
-                    else:
-                        # Format timestamp ou autre format
-                        hour = pd.to_datetime(key_str).hour
-                    
-                    if 0 <= hour <= 23:
-                        hourly_totals[hour].append(price)
-                except (ValueError, IndexError):
-                    # Gérer les formats de date invalides
-                    continue
-
-        # Calculer la moyenne pour chaque heure
-        hourly_avg = {}
-        for hour in range(24):
-            if hourly_totals[hour]:
-                hourly_avg[hour] = sum(hourly_totals[hour]) / len(hourly_totals[hour])
-            else:
-                hourly_avg[hour] = None  # Pas de données pour cette heure
-
-        # Créer la Series pandas avec un index datetime correct
-        hours = list(hourly_avg.keys())
-        dates = [f"{date} {hour:02d}:00:00" for hour in hours]
-        
-        return pd.Series([hourly_avg[h] for h in hours], 
-                    index=pd.to_datetime(dates))
+        hours, means = self.store.hourly_means(date, "price")
+        # every hour is present, NaN when there is no data
+        hourly_avg = np.full(24, np.nan)
+        hourly_avg[hours] = means
+        return _hourly_series(date, np.arange(24), hourly_avg)
 
 class FCR:
-    prices = {}
+    __slots__ = ("store", "_prices")
 
     def __init__(self,FCR_prices):
-        self.prices = FCR_prices
-    
+        self.store = PriceStore.from_dicts({"price": FCR_prices})
+        self._prices = None
+
+    @classmethod
+    def from_store(cls, store):
+        """Wrap an existing PriceStore (column "price"), e.g. a window of the PriceArchive"""
+        obj = cls.__new__(cls)
+        obj.store = store
+        obj._prices = None
+        return obj
+
+    @property
+    def prices(self):
+        if self._prices is None:
+            self._prices = self.store.to_dict("price")
+        return self._prices
+
+    def get_day(self, date):
+        return self.store.day(date, "price")
+
+    def get_block(self, ts):
+        return self.store.block(ts, "price")
+
     def get_daily_prices(self, date):
-        hourly_totals = {h: [] for h in range(24)}
-
-        # Parcourir toutes les données du mois
-        for k, price in self.prices.items():
-            key_str = str(k)
-            if key_str.startswith(date):
-                try:
-                    # Extraire l'heure de manière plus robuste
-                    if ' ' in key_str or ':' in key_str:
-                        # Format avec espace ou deux-points (YYYY-MM-DD HH:MM:SS)
-                        hour_part = key_str.split()[1] if ' ' in key_str else key_str
-                        hour = int(hour_part.split(':')[0])
-                    else:
-                        # Format timestamp ou autre format
-                        hour = pd.to_datetime(key_str).hour
-                    
-                    if 0 <= hour <= 23:
-                        hourly_totals[hour].append(price)
-                except (ValueError, IndexError):
-                    # Gérer les formats de date invalides
-                    continue
-
-        # Calculer la moyenne pour chaque heure
-        hourly_avg = {}
-        for hour in range(24):
-            if hourly_totals[hour]:
-                hourly_avg[hour] = sum(hourly_totals[hour]) / len(hourly_totals[hour])
-            else:
-                pass # Pas de données pour cette heure
-
-        # Créer la Series pandas avec un index datetime correct
-        hours = list(hourly_avg.keys())
-        dates = [f"{date} {hour:02d}:00:00" for hour in hours]
-        
-        return pd.Series([hourly_avg[h] for h in hours], 
-                    index=pd.to_datetime(dates))
+        # only the hours with data (4h blocks)
+        hours, means = self.store.hourly_means(date, "price")
+        return _hourly_series(date, hours, means)
 
 class AFRR:
-    prices = {}
+    __slots__ = ("store", "_prices")
 
     def __init__(self,AFRR_prices):
-        self.prices = AFRR_prices
-    
+        self.store = PriceStore.from_dicts({"Pos": AFRR_prices['Pos'], "Neg": AFRR_prices['Neg']})
+        self._prices = None
+
+    @classmethod
+    def from_store(cls, store):
+        """Wrap an existing PriceStore (columns "Pos" and "Neg")"""
+        obj = cls.__new__(cls)
+        obj.store = store
+        obj._prices = None
+        return obj
+
+    @property
+    def prices(self):
+        if self._prices is None:
+            self._prices = {'Pos': self.store.to_dict("Pos"), 'Neg': self.store.to_dict("Neg")}
+        return self._prices
+
+    def get_day(self, date, price_type):
+        return self.store.day(date, price_type)
+
+    def get_block(self, ts, price_type):
+        return self.store.block(ts, price_type)
+
     def get_daily_prices(self, date):
-        hourly_totals_pos = {h: [] for h in range(24)}
-        hourly_totals_neg = {h: [] for h in range(24)}
-
-        # Parcourir les prix positifs
-        for k, price in self.prices['Pos'].items():
-            key_str = str(k)
-            if key_str.startswith(date):
-                try:
-                    if ' ' in key_str or ':' in key_str:
-                        hour_part = key_str.split()[1] if ' ' in key_str else key_str
-                        hour = int(hour_part.split(':')[0])
-                    else:
-                        hour = pd.to_datetime(key_str).hour
-                    
-                    if 0 <= hour <= 23:
-                        hourly_totals_pos[hour].append(price)
-                except (ValueError, IndexError):
-                    continue
-
-        # Parcourir les prix négatifs
-        for k, price in self.prices['Neg'].items():
-            key_str = str(k)
-            if key_str.startswith(date):
-                try:
-                    if ' ' in key_str or ':' in key_str:
-                        hour_part = key_str.split()[1] if ' ' in key_str else key_str
-                        hour = int(hour_part.split(':')[0])
-                    else:
-                        hour = pd.to_datetime(key_str).hour
-                    
-                    if 0 <= hour <= 23:
-                        hourly_totals_neg[hour].append(price)
-                except (ValueError, IndexError):
-                    continue
-
-        # Calcul des moyennes par heure
-        hourly_avg_pos = {}
-        hourly_avg_neg = {}
-        for hour in range(24):
-            if hourly_totals_pos[hour]:
-                hourly_avg_pos[hour] = sum(hourly_totals_pos[hour]) / len(hourly_totals_pos[hour])
-            if hourly_totals_neg[hour]:
-                hourly_avg_neg[hour] = sum(hourly_totals_neg[hour]) / len(hourly_totals_neg[hour])
-
-        # Construire les pandas Series avec un index datetime correct
-        hours = sorted(set(list(hourly_avg_pos.keys()) + list(hourly_avg_neg.keys())))
-        dates = [f"{date} {hour:02d}:00:00" for hour in hours]
-        
-        result = pd.DataFrame({
-            "positive": [hourly_avg_pos.get(h, None) for h in hours],
-            "negative": [hourly_avg_neg.get(h, None) for h in hours],
-        }, index=pd.to_datetime(dates))
-        
+        hours_pos, avg_pos = self.store.hourly_means(date, "Pos")
+        hours_neg, avg_neg = self.store.hourly_means(date, "Neg")
+
+        # union of the hours of both directions
+        hours = np.union1d(hours_pos, hours_neg)
+        pos = np.full(len(hours), np.nan)
+        neg = np.full(len(hours), np.nan)
+        pos[np.searchsorted(hours, hours_pos)] = avg_pos
+        neg[np.searchsorted(hours, hours_neg)] = avg_neg
         return {
-            "positive": pd.Series([hourly_avg_pos.get(h, None) for h in hours], index=pd.to_datetime(dates)),
-            "negative": pd.Series([hourly_avg_neg.get(h, None) for h in hours], index=pd.to_datetime(dates))   
+            "positive": _hourly_series(date, hours, pos),
+            "negative": _hourly_series(date, hours, neg),
         }
-    
-    def get_daily_prices_per_month(self,date):        
-        return result
-    
+
+    def get_daily_prices_per_month(self, date):
+        # 'YYYY-MM': hourly means over the whole month
+        return self.get_daily_prices(date)
+
 class Country_Market:
     country = "Fr"
 
@@ -0,0 +1,345 @@
+import math
+import time
+import tracemalloc
+
+import highspy
+import numpy as np
+import pandas as pd
+
+from methods import Profiler
+from methods.Solver import (
+    Solver, SolveProgress, _as_list, _finite, repair_schedule, lp_repair, get_formulation, big_m, time_left,
+)
+
+#############################################
+## Matrix-form backend (no Pyomo)          ##
+#############################################
+# Same model as Solver, assembled directly as a CSR matrix with numpy and passed
+# to highspy in one call. Rows follow the order of the Pyomo constraints and
+# columns are numbered by first appearance, like the Pyomo HiGHS interface
+# does, so both backends give HiGHS the very same LP.
+
+# same status names as the Pyomo termination conditions
+_STATUS = {
+    highspy.HighsModelStatus.kOptimal: "optimal",
+    highspy.HighsModelStatus.kTimeLimit: "maxTimeLimit",
+    highspy.HighsModelStatus.kInfeasible: "infeasible",
+    highspy.HighsModelStatus.kIterationLimit: "maxIterations",
+}
+
+class MatrixSolver:
+    n_quarters = Solver.n_quarters
+    quarters_per_block = Solver.quarters_per_block
+    dt = Solver.dt
+    dt_block = Solver.dt_block
+
+    # variable families, in the order of the natural column layout
+    var_names = ("u_ch", "u_dis", "Pch", "Pdis", "SoC", "R_FCR", "R_aFRR_pos", "R_aFRR_neg")
+
+    @Profiler.timed("model_build")
+    def __init__(self, battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg, c_rate= 0.25, daily_cycle= 1.0,
+                 start=0, n_quarters=None, soc0=0.0, formulation="milp"):
+        self.formulation = formulation
+        self.form = get_formulation(formulation)
+        if start % self.quarters_per_block != 0:
+            raise ValueError(f"The window must start on a 4h block (start={start})")
+        n_quarters = self.n_quarters if n_quarters is None else n_quarters
+        t0 = time.perf_counter()
+
+        self.start = start
+        self.SoC0 = soc0
+        self.results = None
+        self.solve_time = None
+        self.gap = None
+        self.solution = None
+        self.warm_stats = None
+        self.first_incumbent_time = None
+        self.repair = None
+        self.bound = None
+        self.progress = None
+        self._restricted = None   # (columns, lower, upper) before _solve_restricted
+
+        # battery parameters (same as Solver)
+        self.C_rate = battery.c_rate_max
+        self.cycles_max = battery.cycles_max
+        self.Pnom = battery.power_kw / 1000
+        self.P = battery.c_rate_max * self.Pnom
+        self.Cap_nom = battery.capacity_kwh / 1000
+
+        da = np.asarray(_as_list(market_da_prices)[start:start + n_quarters], dtype=float)
+        first_block = start // self.quarters_per_block
+        n_blocks = math.ceil(len(da) / self.quarters_per_block)
+        self.c_DA = da
+        self.c_FCR_block = np.asarray(_as_list(market_fcr_prices)[first_block:first_block + n_blocks], dtype=float)
+        self.c_aFRR_pos_block = np.asarray(_as_list(market_afrr_prices_pos)[first_block:first_block + n_blocks], dtype=float)
+        self.c_aFRR_neg_block = np.asarray(_as_list(market_afrr_prices_neg)[first_block:first_block + n_blocks], dtype=float)
+
+        self.lp = self._build()
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        self._options = {name: self.highs.getOptionValue(name)[1] for name in ("time_limit", "mip_rel_gap")}
+        self._pass_model()
+        self.build_time = time.perf_counter() - t0
+
+    def _build(self):
+        T = len(self.c_DA)
+        B = len(self.c_FCR_block)
+        steps_per_day = int(24 / self.dt)
+        n_days = (T + 1) // steps_per_day
+
+        # natural column numbers (no u_ch / u_dis without binaries)
+        sizes = {"u_ch": T, "u_dis": T, "Pch": T, "Pdis": T, "SoC": T, "R_FCR": B, "R_aFRR_pos": B, "R_aFRR_neg": B}
+        names = self.var_names if self.form["binaries"] else self.var_names[2:]
+        nat = {}
+        offset = 0
+        for name in names:
+            nat[name] = np.arange(offset, offset + sizes[name])
+            offset += sizes[name]
+        n_col = offset
+
+        t = np.arange(T)
+        b_of_t = t // self.quarters_per_block
+        b = np.arange(B)
+        t_end = np.minimum((b + 1) * self.quarters_per_block - 1, T - 1)
+        ones = np.ones(T)
+        a = self.dt / self.Cap_nom
+        c = self.dt_block / self.Cap_nom
+        inf = highspy.kHighsInf
+
+        # each family: (columns (rows, terms), coefs (rows, terms), lower, upper)
+        # with the terms in the order Pyomo writes them
+        families = []
+
+        def family(cols, coefs, lower, upper):
+            cols = np.column_stack(cols)
+            coefs = np.column_stack([np.broadcast_to(x, (len(cols),)) for x in coefs])
+            families.append((cols, coefs, np.broadcast_to(lower, (len(cols),)), np.broadcast_to(upper, (len(cols),))))
+
+        # fcr_rule: R_FCR[b] <= SoC[b] * Cap
+        family([nat["R_FCR"], nat["SoC"][b]], [1.0, -self.Cap_nom], -inf, 0.0)
+        # soc_cons: first quarter from SoC0, then SoC[t-1]
+        family([nat["SoC"][:1], nat["Pch"][:1], nat["Pdis"][:1], nat["R_aFRR_neg"][:1], nat["R_aFRR_pos"][:1]],
+               [1.0, -a, a, -c, c], 0.0 - (-self.SoC0), 0.0 - (-self.SoC0))
+        if T > 1:
+            bt = b_of_t[1:]
+            family([nat["SoC"][1:], nat["SoC"][:-1], nat["Pch"][1:], nat["Pdis"][1:], nat["R_aFRR_neg"][bt], nat["R_aFRR_pos"][bt]],
+                   [1.0, -1.0, -a, a, -c, c], 0.0, 0.0)
+        # afrr_pos / afrr_neg on the SoC at the end of each block
+        family([nat["R_aFRR_pos"], nat["SoC"][t_end]], [self.dt_block, -self.Cap_nom], -inf, 0.0)
+        family([nat["R_aFRR_neg"], nat["SoC"][t_end]], [self.dt_block, self.Cap_nom], -inf, self.Cap_nom)
+        M = big_m(self) if self.form["tight"] else self.Pnom
+        if self.form["binaries"]:
+            # fcr_availability_rule
+            family([nat["R_FCR"][b_of_t], nat["u_ch"], nat["u_dis"]], [1.0, self.Pnom, self.Pnom], -inf, self.Pnom)
+            # no_simul
+            family([nat["u_ch"], nat["u_dis"]], [1.0, 1.0], -inf, 1.0)
+            # bind_ch
+            family([nat["Pch"], nat["R_aFRR_neg"][b_of_t], nat["u_ch"]], [1.0, 1.0, -M], -inf, 0.0)
+        # crate_dis, bind_dis, crate_ch
+        if not self.form["tight"]:
+            family([nat["Pdis"], nat["R_aFRR_pos"][b_of_t]], [1.0, 1.0], -inf, self.P)
+        if self.form["binaries"]:
+            family([nat["Pdis"], nat["R_aFRR_pos"][b_of_t], nat["u_dis"]], [1.0, 1.0, -M], -inf, 0.0)
+        if not self.form["tight"]:
+            family([nat["Pch"], nat["R_aFRR_neg"][b_of_t]], [1.0, 1.0], -inf, self.P)
+        # power_cap
+        family([nat["Pdis"], nat["Pch"], nat["R_FCR"][b_of_t], nat["R_aFRR_pos"][b_of_t], nat["R_aFRR_neg"][b_of_t]],
+               [ones] * 5, -inf, self.Pnom)
+
+        starts = [0]
+        index = []
+        value = []
+        lower = []
+        upper = []
+        for cols, coefs, lo, up in families:
+            index.append(cols.ravel())
+            value.append(coefs.ravel())
+            starts.append(np.full(len(cols), cols.shape[1]))
+            lower.append(lo)
+            upper.append(up)
+
+        # cycles_rule_day: throughput of each (possibly truncated) day
+        for d in range(n_days):
+            td = np.arange(d * steps_per_day, min((d + 1) * steps_per_day - 1, T - 1) + 1)
+            index.append(np.column_stack([nat["Pch"][td], nat["Pdis"][td]]).ravel())
+            value.append(np.full(2 * len(td), self.dt))
+            starts.append(np.array([2 * len(td)]))
+            lower.append(np.array([-inf]))
+            upper.append(np.array([self.cycles_max * self.Cap_nom]))
+
+        index = np.concatenate(index)
+        value = np.concatenate(value)
+        start = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(np.concatenate(starts[1:]))])
+        row_lower = np.concatenate(lower).astype(float)
+        row_upper = np.concatenate(upper).astype(float)
+
+        # columns numbered by first appearance (rows in order, terms in order)
+        _, first = np.unique(index, return_index=True)
+        order = np.unique(index)[np.argsort(first)]
+        perm = np.empty(n_col, dtype=np.int64)
+        perm[order] = np.arange(len(order))
+        self.col = {name: perm[nat[name]] for name in names}
+
+        # bounds, integrality and costs in the final numbering
+        col_lower = np.zeros(n_col)
+        col_upper = np.empty(n_col)
+        integrality = np.zeros(n_col, dtype=np.int64)
+        cost = np.zeros(n_col)
+        for name in [n for n in ("u_ch", "u_dis") if n in self.col]:
+            col_upper[self.col[name]] = 1.0
+            integrality[self.col[name]] = 1
+        for name in ("Pch", "Pdis", "R_aFRR_pos", "R_aFRR_neg"):
+            col_upper[self.col[name]] = self.P * self.C_rate
+        col_upper[self.col["SoC"]] = 1.0
+        col_upper[self.col["R_FCR"]] = self.Pnom
+        cost[self.col["Pdis"]] = self.c_DA * self.dt
+        cost[self.col["Pch"]] = -self.c_DA * self.dt
+        cost[self.col["R_FCR"]] = self.c_FCR_block * self.dt_block
+        cost[self.col["R_aFRR_pos"]] = self.c_aFRR_pos_block * self.dt_block
+        cost[self.col["R_aFRR_neg"]] = self.c_aFRR_neg_block * self.dt_block
+
+        return {
+            "col_cost": cost, "col_lower": col_lower, "col_upper": col_upper, "integrality": integrality,
+            "row_lower": row_lower, "row_upper": row_upper,
+            "start": start, "index": perm[index], "value": value,
+        }
+
+    def _pass_model(self):
+        # whole matrix in a single addRows call (same calls as the Pyomo interface)
+        lp = self.lp
+        h = self.highs
+        n_col = len(lp["col_cost"])
+        h.addVars(n_col, lp["col_lower"], lp["col_upper"])
+        h.changeColsIntegrality(n_col, np.arange(n_col), lp["integrality"].astype(np.uint8))
+        h.addRows(len(lp["row_lower"]), lp["row_lower"], lp["row_upper"],
+                  len(lp["value"]), lp["start"][:-1], lp["index"], lp["value"])
+        h.changeObjectiveSense(highspy.ObjSense.kMaximize)
+        h.changeColsCost(n_col, np.arange(n_col), lp["col_cost"])
+
+    def warm_start(self, schedule):
+        """Repair schedule (e.g. heuristic_schedule(op)) into a feasible first incumbent for solve"""
+        values, stats = repair_schedule(self, schedule)
+        names = [name for name in values if name in self.col]
+        cols = np.concatenate([self.col[name] for name in names]).astype(np.int32)
+        self.highs.setSolution(len(cols), cols, np.concatenate([values[name] for name in names]))
+        self.warm_stats = stats
+        return stats
+
+    def _set_values(self, values):
+        for name, col in self.col.items():
+            self.solution[col] = values[name]
+
+    def _solve_restricted(self, zero):
+        # LP again with the columns of the mask fixed to 0 (lp_repair)
+        h = self.highs
+        # getCols needs sorted indices
+        cols = np.unique(np.concatenate([self.col[name][mask] for name, mask in zero.items()])).astype(np.int32)
+        _, _, _, lower, upper, _ = h.getCols(len(cols), cols)
+        self._restricted = (cols, lower, upper)
+        h.changeColsBounds(len(cols), cols, np.zeros(len(cols)), np.zeros(len(cols)))
+        h.run()
+        if h.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+            return False
+        self.solution = np.asarray(h.getSolution().col_value)
+        return True
+
+    def _on_incumbent(self, e):
+        if self.first_incumbent_time is None:
+            self.first_incumbent_time = e.data_out.running_time
+        self.progress.incumbent(e.data_out)
+
+    def _on_mip_log(self, e):
+        self.progress.log(e.data_out)
+
+    def solve(self, time_limit=None, mip_gap=None, verbose=True, deadline=None, on_progress=None):
+        """Same options as Solver.solve"""
+        h = self.highs
+        # nothing of a previous solve is kept: bounds fixed by lp_repair, options, results
+        if self._restricted is not None:
+            cols, lower, upper = self._restricted
+            h.changeColsBounds(len(cols), cols, lower, upper)
+            self._restricted = None
+        self.repair = None
+        self.gap = None
+        self.bound = None
+        self.first_incumbent_time = None
+        self.progress = SolveProgress(on_progress)
+        if not h.cbMipImprovingSolution.callbacks:
+            h.cbMipImprovingSolution.subscribe(self._on_incumbent)
+            h.cbMipInterrupt.subscribe(self._on_mip_log)
+        time_limit = time_left(time_limit, deadline)
+        h.setOptionValue("time_limit", self._options["time_limit"] if time_limit is None else float(time_limit))
+        h.setOptionValue("mip_rel_gap", self._options["mip_rel_gap"] if mip_gap is None else float(mip_gap))
+        t0 = time.perf_counter()
+        with Profiler.stage("highs_solve"):
+            h.run()
+        self.solve_time = time.perf_counter() - t0
+        Profiler.highs_stats("matrix", h)
+
+        info = h.getInfo()
+        self.results = h.getModelStatus()
+        self.solution = np.asarray(h.getSolution().col_value)
+        incumbent = info.objective_function_value
+        bound = info.mip_dual_bound if info.mip_node_count >= 0 else incumbent
+        self.bound = _finite(bound)
+        if info.primal_solution_status != 2 or not math.isfinite(bound):
+            self.gap = math.nan
+        else:
+            self.gap = abs(bound - incumbent) / max(abs(incumbent), 1e-9)
+        if not self.form["binaries"] and self.status() == "optimal":
+            self.repair = lp_repair(self)
+            self.gap = self.repair["gap"]
+        if verbose:
+            print(self.status())
+        return self.results
+
+    def feasible(self):
+        """True when the last solve has a feasible schedule (optimal or stopped with an incumbent)"""
+        return self.results is not None and (self.repair is not None or self.highs.getInfo().primal_solution_status == 2)
+
+    def status(self):
+        return _STATUS.get(self.results, self.highs.modelStatusToString(self.results))
+
+    def objective_value(self):
+        if self.repair is not None:
+            return self.repair["objective"]
+        return self.highs.getInfo().objective_function_value
+
+    def values(self, name):
+        return self.solution[self.col[name]]
+
+    @Profiler.timed("result_extraction")
+    def schedule(self):
+        """One row per quarter of the window, reserves repeated over their 4h block"""
+        T = len(self.c_DA)
+        blocks = np.minimum(np.arange(T) // self.quarters_per_block, len(self.c_FCR_block) - 1)
+        return pd.DataFrame({
+            'time_step': self.start + np.arange(T),
+            'P_charge_MW': self.values("Pch"),
+            'P_discharge_MW': self.values("Pdis"),
+            'SoC': self.values("SoC"),
+            'R_FCR': self.values("R_FCR")[blocks],
+            'R_AFRR_pos': self.values("R_aFRR_pos")[blocks],
+            'R_AFRR_neg': self.values("R_aFRR_neg")[blocks],
+        })
+
+def compare_backends(battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg,
+                     n_quarters=96, solve=True, time_limit=None, mip_gap=None):
+    """Build (and solve) the same window with Solver and MatrixSolver: time, peak memory, objective"""
+    rows = []
+    for name, cls in (("pyomo", Solver), ("matrix", MatrixSolver)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        solver = cls(battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg,
+                     n_quarters=n_quarters)
+        build_time = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        row = {"backend": name, "quarters": n_quarters, "build time [s]": build_time, "build peak memory [MB]": peak / 1e6}
+        if solve:
+            solver.solve(time_limit=time_limit, mip_gap=mip_gap, verbose=False)
+            row["solve time [s]"] = solver.solve_time
+            row["objective"] = solver.objective_value()
+            row["status"] = solver.status()
+        rows.append(row)
+    return pd.DataFrame(rows)
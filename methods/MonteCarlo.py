@@ -0,0 +1,207 @@
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from methods import Finance
+from methods.heuristic_method import (
+    OUT_DIR, DATA_XLS, LIMIT_DAYS, COUNTRIES, CONFIGS, prepare_market, _country_rates, _year_prices,
+)
+
+#############################################
+## Monte Carlo price scenarios             ##
+#############################################
+# A scenario year is a block bootstrap of the historical days: blocks of
+# block_days consecutive days, drawn near the same date of the year
+# (season_days) so the seasons stay in place. One draw picks the same days for
+# DA, FCR and aFRR, and the same draws are used for every country, so the
+# correlation between markets and countries is kept.
+# The heuristic then runs on all the scenarios and configurations at once:
+# the state (SoC, cycles of the day) is a (configs, scenarios) array and the
+# loop only goes over the 15 min steps.
+
+STEPS_PER_DAY = 96
+
+def day_blocks(n_days, n_scenarios, block_days=7, season_days=30, seed=0):
+    """
+    (n_scenarios, n_days) array: historical day used for every day of every
+    scenario. season_days=None draws the blocks anywhere in the year.
+    """
+    if not 1 <= block_days <= n_days:
+        raise ValueError(f"block_days must be between 1 and the number of days ({n_days}), got {block_days}")
+    rng = np.random.default_rng(seed)
+    days = np.empty((n_scenarios, n_days), dtype=np.int64)
+    offsets = np.arange(block_days)
+    for start in range(0, n_days, block_days):
+        size = min(block_days, n_days - start)
+        lo, hi = 0, n_days - block_days
+        if season_days is not None:
+            lo = min(max(0, start - season_days), hi)
+            hi = max(min(hi, start + season_days), lo)
+        first = rng.integers(lo, hi + 1, n_scenarios)
+        days[:, start:start + size] = first[:, None] + offsets[:size]
+    return days
+
+def scenario_arrays(arrays, days):
+    """
+    Prices of the scenarios as (steps, scenarios) arrays (da, fcr, pos, neg)
+    and the new day mask, from the arrays of country_arrays cut to whole days.
+    """
+    n_days = days.shape[1]
+    out = {}
+    for key in ("da", "fcr", "pos", "neg"):
+        by_day = arrays[key][:n_days * STEPS_PER_DAY].reshape(n_days, STEPS_PER_DAY)
+        out[key] = np.ascontiguousarray(by_day[days].reshape(len(days), -1).T)
+    new_day = np.zeros(n_days * STEPS_PER_DAY, dtype=bool)
+    new_day[::STEPS_PER_DAY] = True
+    out["new_day"] = new_day
+    return out
+
+def scenario_stats(prices):
+    """Thresholds of the heuristic computed on each scenario year, arrays (scenarios,)"""
+    return {
+        "fcr_med": np.median(prices["fcr"], axis=0),
+        "afr_pos_med": np.median(prices["pos"], axis=0),
+        "afr_neg_med": np.median(prices["neg"], axis=0),
+        "q_low": np.quantile(prices["da"], 0.30, axis=0),
+        "q_high": np.quantile(prices["da"], 0.70, axis=0),
+    }
+
+def simulate_batch(prices, stats, c_rate, cycles_per_day, eta_rt=0.88, soc_min=0.1, soc_max=0.9,
+                   e_nom_mwh=4.472, soc0=0.6, dt_h=0.25):
+    """
+    Heuristic of simulate_arrays on every scenario and configuration together.
+
+    prices: (steps, scenarios) arrays of scenario_arrays, stats: thresholds
+    per scenario, c_rate and cycles_per_day: arrays (configs,). Returns the
+    energy and capacity revenues of the period, arrays (configs, scenarios).
+    """
+    eta_c = math.sqrt(eta_rt)
+    eta_d = math.sqrt(eta_rt)
+    soc_range = soc_max - soc_min
+    p_max = (np.asarray(c_rate, dtype=float) * e_nom_mwh)[:, None]
+    cycles = np.asarray(cycles_per_day, dtype=float)[:, None]
+    da = prices["da"]
+    new_day = prices["new_day"].tolist()
+    n, n_scen = da.shape
+
+    # price tests for every step at once
+    fcr_on = prices["fcr"] >= stats["fcr_med"]
+    pos_on = prices["pos"] > stats["afr_pos_med"]
+    neg_on = prices["neg"] > stats["afr_neg_med"]
+    do_ch = da <= stats["q_low"]
+    do_dis = da >= stats["q_high"]
+    # power left to the arbitrage: p_max * (1 - fcr_half * soc_factor) * share_dt
+    fcr_half = 0.5 * fcr_on
+    share_dt = (1.0 - 0.5 * (pos_on.astype(float) + neg_on.astype(float))) * dt_h
+    # capacity revenue = 0.5 p_max dt (sum(afrr) + sum(soc_factor * fcr_weight)), with
+    # cfcr = 0.5 p_max soc_factor on the FCR steps and half of the rest on each aFRR direction
+    afrr_price = np.where(pos_on, prices["pos"], 0.0) + np.where(neg_on, prices["neg"], 0.0)
+    fcr_weight = np.where(fcr_on, prices["fcr"] - 0.5 * afrr_price, 0.0)
+    afrr_sum = afrr_price.sum(axis=0)
+    del fcr_on, pos_on, neg_on, afrr_price
+
+    shape = (len(p_max), n_scen)
+    soc = np.full(shape, soc0)
+    fce = np.zeros(shape)
+    energy = np.zeros(shape)
+    fcr_acc = np.zeros(shape)
+    factor = np.empty(shape)
+    e_avail = np.empty(shape)
+    e_ch = np.empty(shape)
+    e_dis = np.empty(shape)
+    for i in range(n):
+        if new_day[i]:
+            fce.fill(0.0)
+        # reserves from the SoC at the start of the step
+        np.subtract(soc, soc_min, out=factor)
+        np.maximum(factor, 0.0, out=factor)
+        factor /= soc_range
+        fcr_acc += factor * fcr_weight[i]
+
+        # energy available for the arbitrage, limited by the cycles left today
+        np.multiply(factor, fcr_half[i], out=e_avail)
+        np.subtract(1.0, e_avail, out=e_avail)
+        e_avail *= p_max
+        e_avail *= share_dt[i]
+        np.minimum(e_avail, (cycles - fce) * e_nom_mwh, out=e_avail)
+
+        np.minimum(e_avail, (soc_max - soc) * e_nom_mwh, out=e_ch)
+        np.maximum(e_ch, 0.0, out=e_ch)
+        e_ch *= do_ch[i]
+        np.minimum(e_avail, (soc - soc_min) * e_nom_mwh, out=e_dis)
+        np.maximum(e_dis, 0.0, out=e_dis)
+        e_dis *= do_dis[i]
+
+        soc += (e_ch * eta_c - e_dis / eta_d) / e_nom_mwh
+        np.clip(soc, soc_min, soc_max, out=soc)
+        fce += (e_ch + e_dis) / (2 * e_nom_mwh)
+        energy += (e_dis - e_ch) * da[i]
+
+    capacity = 0.5 * p_max * dt_h * (afrr_sum + fcr_acc)
+    return energy, capacity
+
+def simulate_scenarios(arrays, days, configs, chunk=128, e_nom_mwh=4.472, **kwargs):
+    """
+    Yearly profit [EUR] of every configuration (c_rate, cycles) on every
+    scenario of `days` (see day_blocks), array (configs, scenarios).
+    Scenarios are simulated by chunks of `chunk` to bound the memory.
+    """
+    c_rate = np.array([c for c, _ in configs], dtype=float)
+    cycles = np.array([k for _, k in configs], dtype=float)
+    profits = []
+    for a in range(0, len(days), chunk):
+        prices = scenario_arrays(arrays, days[a:a + chunk])
+        energy, capacity = simulate_batch(prices, scenario_stats(prices), c_rate, cycles,
+                                          e_nom_mwh=e_nom_mwh, **kwargs)
+        profits.append(energy + capacity)
+    return np.concatenate(profits, axis=1) * (365 / days.shape[1])
+
+def run(n_scenarios=1000, block_days=7, season_days=30, seed=0, chunk=128, countries=COUNTRIES, configs=CONFIGS,
+        xls_path=DATA_XLS, archive=None, start=None, limit_days=LIMIT_DAYS, e_nom_mwh=4.472,
+        out_dir=OUT_DIR / "montecarlo"):
+    """
+    P10 / P50 / P90 of the yearly profit and of the levelized ROI of every
+    country x configuration over n_scenarios bootstrapped years, written to
+    TechArena_Phase1_Risk.csv. The historical year is the one of the
+    workbook, or of the archive from `start` (see Lifetime.run).
+    """
+    da, fcr, afrr, avail_countries, finance = _year_prices(xls_path, archive, start, limit_days)
+    countries = [c for c in countries if c in avail_countries]
+    rows = []
+    for code in countries:
+        t0 = time.perf_counter()
+        _, arrays, _ = prepare_market(da, fcr, afrr, code, limit_days)
+        days = day_blocks(len(arrays["da"]) // STEPS_PER_DAY, n_scenarios, block_days, season_days, seed)
+        profit = simulate_scenarios(arrays, days, configs, chunk, e_nom_mwh)
+
+        p_max = np.array([c * e_nom_mwh for c, _ in configs])[:, None]
+        (wacc,), (infl,) = _country_rates(finance, [code])
+        res = Finance.evaluate(profit, p_max, wacc=wacc, inflation=infl, e_nom_mwh=e_nom_mwh)
+        p_profit = np.percentile(res["profit_kEUR_MW"], [10, 50, 90], axis=1)
+        p_roi = np.percentile(res["levelized_roi"], [10, 50, 90], axis=1)
+        for k, (c_rate, cycles) in enumerate(configs):
+            rows.append({
+                "Country": code,
+                "C-rate": c_rate,
+                "number of cycles": cycles,
+                "scenarios": n_scenarios,
+                "yearly profits P10 [kEUR/MW]": round(p_profit[0, k], 2),
+                "yearly profits P50 [kEUR/MW]": round(p_profit[1, k], 2),
+                "yearly profits P90 [kEUR/MW]": round(p_profit[2, k], 2),
+                "levelized ROI P10 [%]": round(100 * p_roi[0, k], 2),
+                "levelized ROI P50 [%]": round(100 * p_roi[1, k], 2),
+                "levelized ROI P90 [%]": round(100 * p_roi[2, k], 2),
+            })
+        print(f"{code}: {n_scenarios} scenarios x {len(configs)} configurations in {time.perf_counter() - t0:.1f} s")
+
+    risk = pd.DataFrame(rows)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / "TechArena_Phase1_Risk.csv"
+    risk.to_csv(path, index=False)
+    print(risk.to_string(index=False))
+    print(f"Written to {path}")
+    return risk
@@ -0,0 +1,319 @@
+import bisect
+import math
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from methods.heuristic_method import (
+    OUT_DIR, CHUNK_STEPS, OPERATION_COLUMNS, OperationCSVSink, load_prices, country_arrays, day_starts, simulate_prepared,
+)
+
+#############################################
+## Online heuristic                        ##
+#############################################
+# Same dispatch rule as simulate_arrays, one 15 min step at a time. The price
+# thresholds (DA quantiles, FCR / aFRR medians) come from streaming estimators
+# fed with the prices already seen, so a decision never uses a future price
+# and a new price costs O(1) (P²) or O(window) (rolling window: the search is
+# O(log window) but the insertion and the removal in the sorted list shift it,
+# a memmove of a few µs for a month of quarters, ~20 µs for a year, far below
+# the 15 min of a step).
+
+class P2Quantile:
+    """
+    P² estimator of a quantile (Jain & Chlamtac, 1985): five markers, O(1)
+    memory and time per value, over all the values added so far.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.n = 0
+        self.q = []
+        self.pos = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.des = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]
+        self.inc = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x):
+        if x != x:  # NaN
+            return
+        q = self.q
+        if self.n < 5:
+            bisect.insort(q, x)
+            self.n += 1
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        pos = self.pos
+        des = self.des
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        for i in range(5):
+            des[i] += self.inc[i]
+        # move the three middle markers towards their desired position
+        for i in (1, 2, 3):
+            d = des[i] - pos[i]
+            if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+                d = 1.0 if d > 0 else -1.0
+                qp = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                    + (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    j = i + int(d)
+                    qp = q[i] + d * (q[j] - q[i]) / (pos[j] - pos[i])
+                q[i] = qp
+                pos[i] += d
+        self.n += 1
+
+    def value(self):
+        if self.n >= 5:
+            return self.q[2]
+        return _quantile(self.q, self.p)
+
+class RollingQuantile:
+    """Exact quantile of the last `window` values (sorted window, same interpolation as pandas), O(window) per add"""
+
+    def __init__(self, p, window):
+        self.p = p
+        self.window = window
+        self.sorted = []
+        self.fifo = deque()
+
+    def add(self, x):
+        if x != x:  # NaN
+            return
+        bisect.insort(self.sorted, x)
+        self.fifo.append(x)
+        if len(self.fifo) > self.window:
+            del self.sorted[bisect.bisect_left(self.sorted, self.fifo.popleft())]
+
+    @property
+    def n(self):
+        return len(self.fifo)
+
+    def value(self):
+        return _quantile(self.sorted, self.p)
+
+def _quantile(values, p):
+    # linear interpolation between the closest ranks (pandas default)
+    if not values:
+        return math.nan
+    x = p * (len(values) - 1)
+    i = int(x)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (x - i)
+
+_COLUMNS = OPERATION_COLUMNS + ["Energy revenue [EUR]", "Capacity revenue [EUR]"]
+
+class OnlineHeuristic:
+    """
+    Incremental version of the heuristic: holds the battery state (SoC, full
+    cycles of the day) and the threshold estimators.
+
+    step() takes the prices of one 15 min step and returns the Operation row
+    of that step, update() does the same for a batch and returns columns
+    (OperationCSVSink accepts them). The thresholds of a step are estimated
+    on the previous steps only; nothing is traded before `warmup` steps.
+    window=None uses P² over all the history, window=n an exact quantile of
+    the last n steps. thresholds (a dict like the stats of country_arrays)
+    freezes them instead, which gives exactly simulate_arrays.
+    """
+
+    def __init__(self, c_rate, cycles_per_day, eta_rt=0.88, soc_min=0.1, soc_max=0.9, e_nom_mwh=4.472,
+                 soc0=0.6, dt_h=0.25, window=None, warmup=96, q_low=0.30, q_high=0.70, thresholds=None):
+        self.c_rate = c_rate
+        self.cycles_per_day = cycles_per_day
+        self.eta_c = math.sqrt(eta_rt)
+        self.eta_d = math.sqrt(eta_rt)
+        self.soc_min = soc_min
+        self.soc_max = soc_max
+        self.e_nom_mwh = e_nom_mwh
+        self.dt_h = dt_h
+        self.p_max = c_rate * e_nom_mwh
+        self.warmup = 0 if thresholds is not None else warmup
+
+        self.soc = soc0
+        self.fce_today = 0.0
+        self.steps = 0
+        self.last_day = None
+
+        self.frozen = thresholds
+        if thresholds is None:
+            def estimator(p):
+                return P2Quantile(p) if window is None else RollingQuantile(p, window)
+            self.estimators = {
+                "q_low": estimator(q_low), "q_high": estimator(q_high),
+                "fcr_med": estimator(0.5), "afr_pos_med": estimator(0.5), "afr_neg_med": estimator(0.5),
+            }
+
+    def thresholds(self):
+        """Current thresholds, same keys as the stats of country_arrays"""
+        if self.frozen is not None:
+            return dict(self.frozen)
+        return {name: est.value() for name, est in self.estimators.items()}
+
+    def _learn(self, da, fcr, pos, neg):
+        est = self.estimators
+        est["q_low"].add(da)
+        est["q_high"].add(da)
+        est["fcr_med"].add(fcr)
+        est["afr_pos_med"].add(pos)
+        est["afr_neg_med"].add(neg)
+
+    def step(self, da, fcr, pos, neg, new_day=False):
+        """Dispatch of one step: dict with the Operation columns and the revenues"""
+        soc_min = self.soc_min
+        soc_max = self.soc_max
+        e_nom = self.e_nom_mwh
+        p_max = self.p_max
+        soc_start = self.soc
+        if new_day:
+            self.fce_today = 0.0
+
+        e_ch = 0.0
+        e_dis = 0.0
+        cfcr = 0.0
+        cap_pos = 0.0
+        cap_neg = 0.0
+        if self.steps >= self.warmup:
+            if self.frozen is not None:
+                th = self.frozen
+                q_low, q_high = th["q_low"], th["q_high"]
+                fcr_med, pos_med, neg_med = th["fcr_med"], th["afr_pos_med"], th["afr_neg_med"]
+            else:
+                est = self.estimators
+                q_low, q_high = est["q_low"].value(), est["q_high"].value()
+                fcr_med = est["fcr_med"].value()
+                pos_med = est["afr_pos_med"].value()
+                neg_med = est["afr_neg_med"].value()
+
+            # same rule as simulate_arrays
+            fcr_base = 0.5 * p_max if fcr >= fcr_med else 0.0
+            pos_on = pos > pos_med
+            neg_on = neg > neg_med
+            share = 1.0 - 0.5 * (pos_on + neg_on)
+            soc = soc_start
+            e_headroom = (self.cycles_per_day - self.fce_today) * e_nom
+            do_ch = da <= q_low and soc < soc_max
+            do_dis = da >= q_high and soc > soc_min
+            soc_gap = soc - soc_min
+            soc_factor = (soc_gap if soc_gap > 0 else 0.0) / (soc_max - soc_min)
+            if e_headroom > 0 and (do_ch or do_dis):
+                e_avail = (p_max - fcr_base * soc_factor) * share * self.dt_h
+                if do_ch:
+                    e_ch = min(e_avail, (soc_max - soc) * e_nom, e_headroom)
+                    if e_ch < 0:
+                        e_ch = 0.0
+                if do_dis:
+                    e_dis = min(e_avail, soc_gap * e_nom, e_headroom)
+                    if e_dis < 0:
+                        e_dis = 0.0
+                soc = soc + (e_ch * self.eta_c - e_dis / self.eta_d) / e_nom
+                if soc < soc_min:
+                    soc = soc_min
+                elif soc > soc_max:
+                    soc = soc_max
+                self.fce_today += (e_ch + e_dis) / (2 * e_nom)
+                self.soc = soc
+
+            # reserves from the SoC at the start of the step
+            cfcr = fcr_base * soc_factor
+            cap_free = 0.5 * (p_max - cfcr)
+            cap_pos = cap_free if pos_on else 0.0
+            cap_neg = cap_free if neg_on else 0.0
+
+        if self.frozen is None:
+            self._learn(da, fcr, pos, neg)
+        self.steps += 1
+        soc = self.soc
+        return {
+            "Stored energy [MWh]": soc * e_nom,
+            "SoC [-]": soc,
+            "Charge [MWh]": e_ch,
+            "Discharge [MWh]": e_dis,
+            "Day-ahead buy [MWh]": e_ch,
+            "Day-ahead sell [MWh]": e_dis,
+            "FCR Capacity [MW]": cfcr,
+            "aFRR Capacity POS [MW]": cap_pos,
+            "aFRR Capacity NEG [MW]": cap_neg,
+            "Energy revenue [EUR]": e_dis * da - e_ch * da,
+            "Capacity revenue [EUR]": (cfcr * fcr + cap_pos * pos + cap_neg * neg) * self.dt_h,
+        }
+
+    def update(self, index, da, fcr, pos, neg):
+        """Batch of steps (index = their timestamps): dict of float64 columns"""
+        index = pd.DatetimeIndex(index)
+        new_day = day_starts(index)
+        if len(index) and self.last_day is not None:
+            new_day[0] = index[0].normalize() != self.last_day
+        if len(index):
+            self.last_day = index[-1].normalize()
+        rows = [self.step(*x) for x in zip(
+            np.asarray(da, dtype=float).tolist(), np.asarray(fcr, dtype=float).tolist(),
+            np.asarray(pos, dtype=float).tolist(), np.asarray(neg, dtype=float).tolist(), new_day.tolist(),
+        )]
+        return {name: np.array([row[name] for row in rows], dtype=float) for name in _COLUMNS}
+
+def replay(code="DE", c_rate=0.5, cycles=1.0, batch=1, window=None, warmup=96, out_dir=OUT_DIR / "online"):
+    """
+    Feed the year of one country to OnlineHeuristic, batch steps at a time,
+    write its Operation CSV and compare the revenue with the batch heuristic
+    (thresholds over the whole year). Returns the latency per step in µs
+    (mean, p50, p99) and both revenues.
+    """
+    da, fcr, afrr, _ = load_prices()
+    index, arrays, stats = country_arrays(da, fcr, afrr, code)
+    engine = OnlineHeuristic(c_rate, cycles, window=window, warmup=warmup)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sink = OperationCSVSink(out_dir / "TechArena_Phase1_Operation.csv")
+
+    latencies = []
+    n = len(index)
+    if batch == 1:
+        # real-time use: one step() per price, rows flushed to the CSV by chunks
+        new_day = day_starts(index).tolist()
+        prices = [arrays[k].tolist() for k in ("da", "fcr", "pos", "neg")]
+        rows = []
+        for i in range(n):
+            t0 = time.perf_counter_ns()
+            rows.append(engine.step(prices[0][i], prices[1][i], prices[2][i], prices[3][i], new_day[i]))
+            latencies.append((time.perf_counter_ns() - t0) / 1000)
+            if len(rows) == CHUNK_STEPS or i == n - 1:
+                a = i + 1 - len(rows)
+                sink.write(index[a:i + 1], {name: np.array([row[name] for row in rows]) for name in _COLUMNS})
+                rows = []
+    else:
+        for a in range(0, n, batch):
+            b = min(a + batch, n)
+            t0 = time.perf_counter_ns()
+            cols = engine.update(index[a:b], arrays["da"][a:b], arrays["fcr"][a:b], arrays["pos"][a:b],
+                                 arrays["neg"][a:b])
+            latencies.append((time.perf_counter_ns() - t0) / 1000 / (b - a))
+            sink.write(index[a:b], cols)
+    totals = sink.close()
+
+    offline = simulate_prepared(arrays, stats, c_rate, cycles)
+    offline_revenue = float(offline["Energy revenue [EUR]"].sum() + offline["Capacity revenue [EUR]"].sum())
+    latencies = np.array(latencies)
+    result = {
+        "steps": n,
+        "mean [us]": float(latencies.mean()),
+        "p50 [us]": float(np.percentile(latencies, 50)),
+        "p99 [us]": float(np.percentile(latencies, 99)),
+        "online revenue [EUR]": totals["Total revenue [EUR]"],
+        "batch revenue [EUR]": offline_revenue,
+    }
+    print(pd.Series(result).to_string())
+    print("Final thresholds:", {k: round(v, 2) for k, v in engine.thresholds().items()})
+    return result
@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from methods.XLSCache import load_tables
+from methods.MarketManager import PriceStore, DA, FCR, AFRR, Country_Market
+
+#############################################
+## Memory-mapped price archive             ##
+#############################################
+# Several years and any number of countries on disk:
+#   <root>/meta.json             markets, countries, finance table
+#   <root>/<market>/_index.npy   int64 epoch (ns), shared by the countries of the market
+#   <root>/<market>/<code>.npy   float64 prices of one country
+# Every file is opened with mmap_mode="r" the first time a country is asked
+# for, and a date range is a slice of the mapping: only the pages of the
+# window are read, so the resident memory follows the window, not the archive.
+
+ARCHIVE_VERSION = 1
+ARCHIVE_DIR = Path(__file__).parent / "../input/archive"
+
+MARKETS = ("da", "fcr", "afrr_pos", "afrr_neg")
+
+# DA columns of the workbook that are not named by the country code
+DA_CODES = {"DE_LU": "DE"}
+
+def _epoch(ts):
+    return None if ts is None else pd.Timestamp(ts).as_unit("ns").value
+
+def write_archive(root, da, fcr, afrr_pos, afrr_neg, finance=None):
+    """
+    Write an archive from one DataFrame per market (DatetimeIndex, one column
+    per country code). The directory is replaced atomically.
+    """
+    root = Path(root)
+    root.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=root.name + ".", dir=root.parent))
+    meta = {"version": ARCHIVE_VERSION, "markets": {}}
+    try:
+        for market, df in zip(MARKETS, (da, fcr, afrr_pos, afrr_neg)):
+            df = df[~df.index.isna()].sort_index()
+            df = df[~df.index.duplicated(keep="last")]
+            (tmp / market).mkdir()
+            np.save(tmp / market / "_index.npy", df.index.as_unit("ns").asi8)
+            for code in df.columns:
+                np.save(tmp / market / f"{code}.npy", df[code].to_numpy(dtype=np.float64))
+            meta["markets"][market] = {
+                "countries": [str(c) for c in df.columns],
+                "start": str(df.index[0]) if len(df) else None,
+                "end": str(df.index[-1]) if len(df) else None,
+                "length": len(df),
+            }
+        meta["finance"] = None if finance is None else finance.to_dict(orient="list")
+        (tmp / "meta.json").write_text(json.dumps(meta, indent=1))
+        shutil.rmtree(root, ignore_errors=True)
+        os.replace(tmp, root)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return PriceArchive(root)
+
+def from_workbooks(root=ARCHIVE_DIR, xls_paths=("input/TechArena2025_data.xlsx",)):
+    """Archive of one or several workbooks with the TechArena layout (e.g. one per year)"""
+    parts = [load_tables(path) for path in xls_paths]
+    da = pd.concat([t["da"].rename(columns=DA_CODES) for t in parts])
+    fcr = pd.concat([t["fcr"] for t in parts])
+    afrr = pd.concat([t["afrr"] for t in parts])
+    # finance of the last workbook
+    return write_archive(root, da, fcr, afrr.xs("Pos", axis=1, level=1), afrr.xs("Neg", axis=1, level=1),
+                         parts[-1]["finance"])
+
+def from_synthetic(root, years=10, n_countries=30, volatility=1.0, seed=0, start="2015-01-01"):
+    """Archive of synthetic prices (SyntheticData), e.g. for tests at the scale of years x dozens of zones"""
+    from methods.SyntheticData import synthetic_prices
+    prices = synthetic_prices(int(round(365 * years)), n_countries, volatility, seed, start)
+    codes = {da_col: code for code, da_col, _, _, _ in prices["countries"]}
+    finance = pd.DataFrame([(code, wacc, infl) for code, _, _, wacc, infl in prices["countries"]],
+                           columns=["Code", "WACC", "Inflation"])
+    return write_archive(root, prices["da"].rename(columns=codes), prices["fcr"], prices["afrr_pos"],
+                         prices["afrr_neg"], finance)
+
+def open_archive(archive=ARCHIVE_DIR):
+    """PriceArchive of a directory (an archive is returned as is)"""
+    return archive if isinstance(archive, PriceArchive) else PriceArchive(archive)
+
+class PriceArchive:
+    """Read side of an archive: countries are mapped lazily, windows are views"""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = Path(root)
+        meta_path = self.root / "meta.json"
+        if not meta_path.exists():
+            raise ValueError(f"No price archive in {self.root} (build it with from_workbooks)")
+        self.meta = json.loads(meta_path.read_text())
+        if self.meta.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"Archive version {self.meta.get('version')} in {self.root}, expected {ARCHIVE_VERSION}")
+        self._maps = {}
+
+    def countries(self, market="da"):
+        return list(self.meta["markets"][market]["countries"])
+
+    def start(self, market="da"):
+        return pd.Timestamp(self.meta["markets"][market]["start"])
+
+    def finance(self):
+        if self.meta["finance"] is None:
+            raise ValueError(f"The archive {self.root} has no finance table")
+        return pd.DataFrame(self.meta["finance"])
+
+    def _map(self, market, name):
+        key = (market, name)
+        arr = self._maps.get(key)
+        if arr is None:
+            if name != "_index" and name not in self.meta["markets"][market]["countries"]:
+                raise ValueError(f"The country '{name}' is not in the {market} prices ({self.countries(market)})")
+            arr = self._maps[key] = np.load(self.root / market / f"{name}.npy", mmap_mode="r")
+        return arr
+
+    def index(self, market):
+        """Epoch (ns) of the whole market, memory-mapped"""
+        return self._map(market, "_index")
+
+    def range(self, market, start=None, end=None):
+        """slice of the positions with start <= timestamp < end (None = open)"""
+        epoch = self.index(market)
+        a = 0 if start is None else int(np.searchsorted(epoch, _epoch(start)))
+        b = len(epoch) if end is None else int(np.searchsorted(epoch, _epoch(end)))
+        return slice(a, b)
+
+    def window(self, market, code, start=None, end=None):
+        """(epoch, prices) of one country on [start, end), read-only views of the files"""
+        sl = self.range(market, start, end)
+        return self.index(market)[sl], self._map(market, code)[sl]
+
+    def series(self, market, code, start=None, end=None):
+        epoch, values = self.window(market, code, start, end)
+        return pd.Series(np.array(values), index=pd.DatetimeIndex(np.array(epoch), name="Timestep"), name=code)
+
+    def country_prices(self, code, start=None, end=None):
+        """DA, FCR, aFRR POS and NEG arrays of one country (Solver / rolling_horizon inputs)"""
+        return tuple(self.window(market, code, start, end)[1] for market in MARKETS)
+
+    def country_market(self, code, start=None, end=None, waac=0.0, inflation_rate=0.0):
+        """Country_Market of one country on a window, its stores are views of the archive"""
+        epoch, da = self.window("da", code, start, end)
+        fcr_epoch, fcr = self.window("fcr", code, start, end)
+        afrr_epoch, pos = self.window("afrr_pos", code, start, end)
+        _, neg = self.window("afrr_neg", code, start, end)
+        return Country_Market(
+            code,
+            DA.from_store(PriceStore(epoch, da, ["price"])),
+            FCR.from_store(PriceStore(fcr_epoch, fcr, ["price"])),
+            AFRR.from_store(PriceStore(afrr_epoch, np.stack([pos, neg]), ["Pos", "Neg"])),
+            waac,
+            inflation_rate,
+        )
+
+    def prices(self, start=None, end=None):
+        """
+        (da, fcr, afrr, countries) like heuristic_method.load_prices, but the
+        tables only read a country when it is indexed (da["DE"],
+        afrr[("DE", "Pos")]), on the [start, end) window.
+        """
+        afrr = LazyTable(self, {("afrr_pos", "Pos"), ("afrr_neg", "Neg")}, start, end)
+        return (LazyTable(self, {("da", None)}, start, end), LazyTable(self, {("fcr", None)}, start, end),
+                afrr, set(self.countries("afrr_pos")))
+
+class LazyTable:
+    """Column access of a price table (DataFrame-like) backed by the archive"""
+
+    def __init__(self, archive, markets, start=None, end=None):
+        self.archive = archive
+        self.start = start
+        self.end = end
+        # column key -> market: code, or (code, direction) for the aFRR
+        self._markets = {}
+        for market, direction in sorted(markets, key=str):
+            for code in archive.countries(market):
+                self._markets[code if direction is None else (code, direction)] = market
+        keys = list(self._markets)
+        self.columns = pd.MultiIndex.from_tuples(keys) if keys and isinstance(keys[0], tuple) else pd.Index(keys)
+        self._series = {}
+
+    def __contains__(self, key):
+        return key in self._markets
+
+    def __getitem__(self, key):
+        if key not in self._markets:
+            raise KeyError(key)
+        s = self._series.get(key)
+        if s is None:
+            code = key[0] if isinstance(key, tuple) else key
+            s = self._series[key] = self.archive.series(self._markets[key], code, self.start, self.end)
+        return s
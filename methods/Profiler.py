@@ -0,0 +1,167 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import resource
+import time
+
+import pandas as pd
+
+#############################################
+## Stage timers and counters               ##
+#############################################
+# Off by default: stage() then returns a shared null context and timed()
+# wrappers only test a flag. Once enabled (main.py --profile), every stage
+# records its calls, wall time and peak RSS, and every HiGHS solve its node
+# count, iterations and gap. Only the current process is measured (not the
+# workers of a process pool).
+
+_enabled = False
+_stages = {}
+_counters = {}
+_solves = {}
+_stack = []
+_OFF = contextlib.nullcontext()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+    _solves.clear()
+    _stack.clear()
+
+def _peak_rss_kb():
+    # peak RSS since the last reset of the high-water mark (Linux), else of the process
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+class _Stage:
+    __slots__ = ("name", "t0", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        # the high-water mark is reset for this stage, the parent keeps its peak so far
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, _peak_rss_kb())
+        _reset_peak()
+        self.peak = 0
+        _stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        _stack.pop()
+        peak = max(self.peak, _peak_rss_kb())
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, peak)
+        s = _stages.get(self.name)
+        if s is None:
+            s = _stages[self.name] = {"calls": 0, "time_s": 0.0, "max_s": 0.0, "peak_rss_mb": 0.0}
+        s["calls"] += 1
+        s["time_s"] += elapsed
+        s["max_s"] = max(s["max_s"], elapsed)
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], peak / 1024)
+        return False
+
+def stage(name):
+    """Context manager timing the block as stage `name` (no-op when profiling is off)"""
+    return _Stage(name) if _enabled else _OFF
+
+def timed(name):
+    """Decorator: every call of the function is a `name` stage"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def highs_stats(label, highs):
+    """Node count, iterations and gap of the last run of a highspy.Highs object"""
+    if not _enabled:
+        return
+    info = highs.getInfo()
+    s = _solves.get(label)
+    if s is None:
+        s = _solves[label] = {"solves": 0, "mip_nodes": 0, "simplex_iterations": 0, "ipm_iterations": 0,
+                              "max_mip_gap": None, "last_mip_gap": None}
+    s["solves"] += 1
+    s["mip_nodes"] += max(int(info.mip_node_count), 0)
+    s["simplex_iterations"] += max(int(info.simplex_iteration_count), 0)
+    s["ipm_iterations"] += max(int(info.ipm_iteration_count), 0)
+    gap = float(info.mip_gap)
+    if math.isfinite(gap) and int(info.mip_node_count) >= 0:
+        s["last_mip_gap"] = gap
+        s["max_mip_gap"] = gap if s["max_mip_gap"] is None else max(s["max_mip_gap"], gap)
+
+def report():
+    """Stages, counters and HiGHS statistics as a dict (JSON ready)"""
+    return {
+        "stages": {name: dict(s) for name, s in _stages.items()},
+        "counters": dict(_counters),
+        "highs": {label: dict(s) for label, s in _solves.items()},
+        # the stages reset the high-water mark: the process peak is the largest of them
+        "peak_rss_mb": max([resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024]
+                           + [s["peak_rss_mb"] for s in _stages.values()]),
+    }
+
+def table():
+    """One row per stage, slowest first"""
+    rows = [{
+        "stage": name,
+        "calls": s["calls"],
+        "total [s]": s["time_s"],
+        "mean [ms]": 1000 * s["time_s"] / s["calls"],
+        "max [s]": s["max_s"],
+        "peak RSS [MB]": s["peak_rss_mb"],
+    } for name, s in _stages.items()]
+    columns = ["stage", "calls", "total [s]", "mean [ms]", "max [s]", "peak RSS [MB]"]
+    return pd.DataFrame(rows, columns=columns).sort_values("total [s]", ascending=False)
+
+def write(path):
+    """Write the report as JSON and print it as tables"""
+    data = report()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    print(table().to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+    if data["counters"]:
+        print(pd.Series(data["counters"], name="count").to_string())
+    if data["highs"]:
+        print(pd.DataFrame.from_dict(data["highs"], orient="index").to_string())
+    print(f"Peak RSS: {data['peak_rss_mb']:.1f} MB, profile written to {path}")
+    return data
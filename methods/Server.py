@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from methods import Finance
+from methods.heuristic_method import (
+    DATA_XLS, LIMIT_DAYS, COUNTRIES, CONFIGS, load_prices, load_finance, prepare_market, configuration_results,
+    _country_rates, _share_arrays, _attach_shared, _shared_job, _shared_arrays,
+)
+
+#############################################
+## Daemon mode                             ##
+#############################################
+# One process keeps the prices, the finance table and the prepared markets in
+# memory and answers JSON requests over localhost HTTP (asyncio, no framework):
+#   GET  /health                     countries and counters
+#   POST /simulate  {"country", "c_rate", "cycles"}           heuristic revenues of the year
+#   POST /roi       {... + "wacc", "inflation", "capex_per_mwh", "years"...}   Finance.evaluate
+#   POST /sweep     {"countries", "configs"}                  Configuration table
+#   POST /optimize  {"country", "c_rate", "cycles", "start_day", "days", "time_limit", "mip_gap"}
+# The simulations run in a bounded process pool attached to the shared price
+# arrays (as in sweep). Requests arriving within batch_window_s are sent to the
+# pool together, a simulation already running is awaited instead of being run
+# twice, and the results are kept in an LRU cache: a repeated what-if is only a
+# dictionary lookup and a Finance.evaluate.
+
+HOST = "127.0.0.1"
+PORT = 8765
+RESULT_CACHE_SIZE = 4096
+ROI_KEYS = ("wacc", "inflation", "capex_per_mwh", "capex_power_per_mw", "opex_rate", "years")
+
+def _batch_job(jobs, stats, e_nom_mwh):
+    # several (code, c_rate, cycles) simulations in one call to the worker
+    return [_shared_job(code, stats[code], c_rate, cycles, e_nom_mwh) for code, c_rate, cycles in jobs]
+
+def _optimize_job(code, c_rate, cycles, start, n_quarters, time_limit, mip_gap):
+    # the MIP window of one configuration, on the shared arrays (DA per quarter, reserves per 4h block)
+    from methods.LUNA2000Battery import LUNA2000Battery
+    from methods.MatrixSolver import MatrixSolver
+    qpb = MatrixSolver.quarters_per_block
+    battery = LUNA2000Battery(cycles_max=cycles)
+    battery.c_rate_max = c_rate
+    prices = [_shared_arrays[(code, "da")]] + [_shared_arrays[(code, key)][::qpb] for key in ("fcr", "pos", "neg")]
+    solver = MatrixSolver(battery, *prices, start=start, n_quarters=n_quarters)
+    solver.solve(time_limit=time_limit, mip_gap=mip_gap, verbose=False)
+    result = {"status": solver.status(), "solve_time_s": solver.solve_time, "gap": solver.gap}
+    if solver.feasible():
+        result["objective"] = solver.objective_value()
+        result["schedule"] = solver.schedule().to_dict(orient="list")
+    return result
+
+class UnknownEndpoint(LookupError):
+    """Path without a route (answered 404)"""
+
+def _json_default(x):
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    raise TypeError(f"{type(x).__name__} is not JSON serializable")
+
+class MarketServer:
+    """Markets loaded once, requests answered from memory (see the endpoints above)"""
+
+    def __init__(self, xls_path=DATA_XLS, archive=None, start=None, end=None, countries=COUNTRIES,
+                 limit_days=LIMIT_DAYS, workers=None, batch_window_s=0.005, e_nom_mwh=4.472):
+        t0 = time.perf_counter()
+        da, fcr, afrr, avail = load_prices(xls_path, archive, start, end)
+        self.finance = load_finance(xls_path, archive)
+        self.countries = [c for c in countries if c in avail]
+        self.limit_days = limit_days
+        self.e_nom_mwh = e_nom_mwh
+        self.markets = {code: prepare_market(da, fcr, afrr, code, limit_days) for code in self.countries}
+        self.stats = {code: market.stats for code, market in self.markets.items()}
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_window_s = batch_window_s
+        self._shm, layout = _share_arrays(self.markets)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_attach_shared, initargs=(self._shm.name, layout))
+
+        self._results = OrderedDict()
+        self._running = {}
+        self._pending = []
+        self._flush = None
+        self.counters = {"requests": 0, "cache_hits": 0, "simulations": 0, "batches": 0, "errors": 0}
+        self.load_time = time.perf_counter() - t0
+        self.started = time.time()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        self._shm.close()
+        self._shm.unlink()
+
+    # simulations: cache, jobs already running, batches
+
+    def _check_country(self, code):
+        if code not in self.markets:
+            raise ValueError(f"Unknown country '{code}', loaded: {self.countries}")
+
+    async def totals(self, code, c_rate, cycles):
+        """AggregateSink totals of one configuration (cached)"""
+        self._check_country(code)
+        key = (code, float(c_rate), float(cycles))
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.counters["cache_hits"] += 1
+            return self._results[key]
+        future = self._running.get(key)
+        if future is None:
+            future = self._running[key] = asyncio.get_running_loop().create_future()
+            self._pending.append(key)
+            if self._flush is None:
+                self._flush = asyncio.get_running_loop().call_later(self.batch_window_s, self._submit)
+        return await asyncio.shield(future)
+
+    def _submit(self):
+        # pending simulations split in one batch per worker
+        jobs, self._pending, self._flush = self._pending, [], None
+        loop = asyncio.get_running_loop()
+        for part in np.array_split(np.arange(len(jobs)), min(self.workers, len(jobs))):
+            batch = [jobs[i] for i in part]
+            self.counters["batches"] += 1
+            done = loop.run_in_executor(self.pool, _batch_job, batch, self.stats, self.e_nom_mwh)
+            done.add_done_callback(lambda f, batch=batch: self._finish(batch, f))
+
+    def _finish(self, batch, done):
+        error = done.exception()
+        for i, key in enumerate(batch):
+            future = self._running.pop(key)
+            if error is not None:
+                future.set_exception(error)
+                continue
+            self.counters["simulations"] += 1
+            self._results[key] = done.result()[i]
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+            future.set_result(self._results[key])
+
+    # endpoints
+
+    async def simulate(self, country="DE", c_rate=0.5, cycles=1.0):
+        totals = await self.totals(country, c_rate, cycles)
+        profit = totals["Total revenue [EUR]"] * (365 / self.limit_days)
+        return {"country": country, "c_rate": c_rate, "cycles": cycles, **totals, "yearly profit [EUR]": profit,
+                "yearly profits [kEUR/MW]": profit / (c_rate * self.e_nom_mwh) / 1000}
+
+    async def roi(self, country="DE", c_rate=0.5, cycles=1.0, **finance):
+        unknown = set(finance) - set(ROI_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown ROI parameters {sorted(unknown)}, expected {ROI_KEYS}")
+        result = await self.simulate(country, c_rate, cycles)
+        (wacc,), (infl,) = _country_rates(self.finance, [country])
+        kwargs = {"wacc": wacc, "inflation": infl, "e_nom_mwh": self.e_nom_mwh, **finance}
+        res = Finance.evaluate(result["yearly profit [EUR]"], c_rate * self.e_nom_mwh, **kwargs)
+        result.update({k: v for k, v in kwargs.items() if k != "e_nom_mwh"})
+        result.update({"CAPEX [EUR]": res["capex"], "NPV [EUR]": res["npv"], "levelized ROI": res["levelized_roi"]})
+        return result
+
+    async def sweep(self, countries=None, configs=None):
+        countries = self.countries if countries is None else countries
+        configs = CONFIGS if configs is None else [tuple(c) for c in configs]
+        jobs = [(code, c_rate, cycles) for code in countries for c_rate, cycles in configs]
+        results = await asyncio.gather(*(self.totals(*job) for job in jobs))
+        cfg, (code, c_rate, cycles, _, _) = configuration_results(
+            [(code, c_rate, cycles, totals["Total revenue [EUR]"] * (365 / self.limit_days), c_rate * self.e_nom_mwh)
+             for (code, c_rate, cycles), totals in zip(jobs, results)],
+            self.finance,
+        )
+        return {"configurations": cfg.to_dict(orient="records"),
+                "best": {"country": code, "c_rate": c_rate, "cycles": cycles}}
+
+    async def optimize(self, country="DE", c_rate=0.5, cycles=1.0, start_day=0, days=1, time_limit=10.0, mip_gap=None):
+        self._check_country(country)
+        n = len(self.markets[country].index)
+        start, n_quarters = int(start_day) * 96, int(round(days * 96))
+        if start < 0 or start + n_quarters > n:
+            raise ValueError(f"Days {start_day} to {start_day + days} are outside of the {n // 96} days loaded")
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, _optimize_job, country, c_rate, cycles, start, n_quarters, time_limit, mip_gap)
+
+    async def health(self):
+        return {"countries": self.countries, "workers": self.workers, "load_time_s": self.load_time,
+                "uptime_s": time.time() - self.started, "cached_results": len(self._results), **self.counters}
+
+    # HTTP
+
+    async def handle(self, method, path, payload):
+        routes = {"/health": self.health, "/simulate": self.simulate, "/roi": self.roi, "/sweep": self.sweep,
+                  "/optimize": self.optimize}
+        if path not in routes:
+            raise UnknownEndpoint(f"Unknown endpoint '{path}', expected one of {sorted(routes)}")
+        if method == "GET" and path != "/health":
+            raise ValueError(f"POST a JSON body to {path}")
+        return await routes[path](**payload)
+
+    async def _read_request(self, reader):
+        # (method, path, headers, body) of the next request, None at the end of the
+        # connection; ValueError when the request cannot be framed
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise ValueError(f"Malformed request line {line[:200]!r}")
+        method, path, _ = parts
+        headers = {}
+        while (header := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            raise ValueError(f"Content-Length must be a non-negative integer, got '{length}'")
+        body = await reader.readexactly(int(length))
+        return method, path, headers, body
+
+    async def _respond(self, writer, code, result, keep_alive):
+        data = json.dumps(result, default=_json_default).encode()
+        writer.write(
+            f"HTTP/1.1 {code} {'OK' if code == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            .encode() + data)
+        await writer.drain()
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as e:
+                    # the rest of the stream cannot be framed: answer and close
+                    self.counters["requests"] += 1
+                    self.counters["errors"] += 1
+                    await self._respond(writer, 400, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                self.counters["requests"] += 1
+                t0 = time.perf_counter()
+                try:
+                    payload = json.loads(body) if body.strip() else {}
+                    code, result = 200, await self.handle(method, path.split("?", 1)[0], payload)
+                except UnknownEndpoint as e:
+                    code, result = 404, {"error": str(e)}
+                except (ValueError, TypeError) as e:
+                    code, result = 400, {"error": str(e)}
+                except Exception as e:
+                    code, result = 500, {"error": f"{type(e).__name__}: {e}"}
+                if code != 200:
+                    self.counters["errors"] += 1
+                elif isinstance(result, dict):
+                    result["elapsed_ms"] = 1000 * (time.perf_counter() - t0)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, code, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self._connection, host, port)
+        print(f"Serving {self.countries} on http://{host}:{port} "
+              f"(loaded in {self.load_time:.1f} s, {self.workers} workers)")
+        async with server:
+            await server.serve_forever()
+
+def serve(host=HOST, port=PORT, **kwargs):
+    """Load the markets and answer requests until interrupted"""
+    server = MarketServer(**kwargs)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def request(path, payload=None, host=HOST, port=PORT, timeout=600):
+    """Client side: one JSON request to a running server, e.g. request("/roi", {"country": "AT", "wacc": 0.07})"""
+    import http.client
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if payload is None:
+            conn.request("GET", path)
+        else:
+            conn.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise ValueError(f"{path}: {result.get('error')}")
+    return result
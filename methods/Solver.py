@@ -1,18 +1,121 @@
+import math
+import time
+from datetime import datetime
+
 import pyomo.environ as pyo
 import pandas as pd
 import numpy as np
 
+from methods import Profiler
+
+def _as_list(prices):
+    # market dicts (timestamp -> price) or plain sequences/arrays
+    return list(prices.values()) if isinstance(prices, dict) else list(prices)
+
+# Formulations of the model, selected by name in Solver / MatrixSolver:
+#   binaries: u_ch / u_dis with the big-M couplings (bind_ch, bind_dis,
+#             fcr_availability, no_simul). Without them the model is an LP and
+#             the solution is checked and repaired afterwards (lp_repair)
+#   tight:    big-M of bind_ch / bind_dis reduced to the largest reachable
+#             Pch + R_aFRR_neg, which makes crate_ch / crate_dis redundant
+FORMULATIONS = {
+    "milp": {"binaries": True, "tight": False, "description": "original MILP"},
+    "tight": {"binaries": True, "tight": True, "description": "MILP with tightened big-M"},
+    "lp": {"binaries": False, "tight": False, "description": "LP without binaries + repair"},
+}
+
+def get_formulation(name):
+    if name not in FORMULATIONS:
+        raise ValueError(f"Unknown formulation '{name}', choose from {sorted(FORMULATIONS)}")
+    return FORMULATIONS[name]
+
+def time_left(time_limit=None, deadline=None):
+    """Time limit of a solve: time_limit, shortened to the time left before the deadline (epoch s or datetime)"""
+    if deadline is None:
+        return time_limit
+    if isinstance(deadline, datetime):
+        deadline = deadline.timestamp()
+    left = max(deadline - time.time(), 0.0)
+    return left if time_limit is None else min(time_limit, left)
+
+def _finite(x):
+    return float(x) if x is not None and math.isfinite(x) else None
+
+class SolveProgress:
+    """
+    Incumbents and best bounds of one solve, from the HiGHS callbacks. Every
+    new incumbent, and every move of the best bound during the branch and
+    bound, is an event
+    {"event", "time_s", "objective", "bound", "gap"} kept in `events` and
+    passed to on_progress.
+    """
+
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress
+        self.events = []
+        self._last = None
+
+    def incumbent(self, data):
+        self._add("incumbent", data, data.objective_function_value)
+
+    def log(self, data):
+        self._add("bound", data, data.mip_primal_bound)
+
+    def _add(self, kind, data, objective):
+        objective, bound = _finite(objective), _finite(data.mip_dual_bound)
+        if kind == "bound" and (bound is None or (objective, bound) == self._last):
+            return
+        self._last = (objective, bound)
+        event = {"event": kind, "time_s": float(data.running_time), "objective": objective, "bound": bound,
+                 "gap": _finite(data.mip_gap) if objective is not None else None}
+        self.events.append(event)
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+def print_progress(event):
+    """on_progress printing one line per event"""
+    gap = "-" if event["gap"] is None else f"{100 * event['gap']:.3f}%"
+    obj = "-" if event["objective"] is None else f"{event['objective']:.3f}"
+    bound = "-" if event["bound"] is None else f"{event['bound']:.3f}"
+    print(f"{event['time_s']:8.2f}s {event['event']:<9} objective {obj:>12} bound {bound:>12} gap {gap}")
+
+def big_m(solver):
+    # largest Pch + R_aFRR_neg (or Pdis + R_aFRR_pos) allowed by the other limits
+    return min(solver.Pnom, solver.P, 2 * solver.P * solver.C_rate)
+
 class Solver:
     n_quarters = 96
+    quarters_per_block = 16
     dt = 0.25       # heures (15 min)
     dt_block = 4.0  # heures (4h)
 
     eta_ch = 0.95  # ignore
     eta_dis = 0.95 # ignore
 
-    model = pyo.ConcreteModel()
+    @Profiler.timed("model_build")
+    def __init__(self, battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg, c_rate= 0.25, daily_cycle= 1.0,
+                 start=0, n_quarters=None, soc0=0.0, formulation="milp"):
+        # start / n_quarters select the window (in quarter-hours) of the price series,
+        # soc0 is the SoC before the first quarter of the window
+        self.formulation = formulation
+        self.form = get_formulation(formulation)
+        if start % self.quarters_per_block != 0:
+            raise ValueError(f"The window must start on a 4h block (start={start})")
+        n_quarters = self.n_quarters if n_quarters is None else n_quarters
+        self.start = start
+        self.SoC0 = soc0
+        self.model = pyo.ConcreteModel()
+        self.results = None
+        self.solve_time = None
+        self.gap = None
+        self.start_values = None
+        self.warm_stats = None
+        self.first_incumbent_time = None
+        self.repair = None
+        self.bound = None
+        self._restricted = []   # variables fixed by _solve_restricted
+        self.progress = None
 
-    def __init__(self, battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg, c_rate= 0.25, daily_cycle= 1.0):
         # init battery s parameters:
         self.C_rate = battery.c_rate_max # per hour
         self.cycles_max = battery.cycles_max
@@ -22,16 +125,18 @@ class Solver:
         self.E_step_15 = self.P * 0.25
 
         # mes listes
-        da_lst = list(market_da_prices.values())
-        fcr_lst = list(market_fcr_prices.values())
-        afrr_pos_lst = list(market_afrr_prices_pos.values())
-        afrr_neg_lst = list(market_afrr_prices_neg.values())
+        da_lst = _as_list(market_da_prices)
+        fcr_lst = _as_list(market_fcr_prices)
+        afrr_pos_lst = _as_list(market_afrr_prices_pos)
+        afrr_neg_lst = _as_list(market_afrr_prices_neg)
 
         # init market : c_*
-        self.c_DA = da_lst[0:96*1]
-        self.c_FCR_block = fcr_lst[0:6*1]
-        self.c_aFRR_pos_block = afrr_pos_lst[0:6*1]
-        self.c_aFRR_neg_block = afrr_neg_lst[0:6*1]
+        self.c_DA = da_lst[start:start + n_quarters]
+        first_block = start // self.quarters_per_block
+        n_blocks = math.ceil(len(self.c_DA) / self.quarters_per_block)
+        self.c_FCR_block = fcr_lst[first_block:first_block + n_blocks]
+        self.c_aFRR_pos_block = afrr_pos_lst[first_block:first_block + n_blocks]
+        self.c_aFRR_neg_block = afrr_neg_lst[first_block:first_block + n_blocks]
 
         # number of time
         self.model.T = pyo.RangeSet(0, len(self.c_DA)-1)
@@ -42,8 +147,9 @@ class Solver:
         self.model.D = pyo.RangeSet(0, n_days-1)
         
         # Variables pour ne pas avoir la charge et la décharge en même temps
-        self.model.u_ch  = pyo.Var(self.model.T, within=pyo.Binary)
-        self.model.u_dis = pyo.Var(self.model.T, within=pyo.Binary)
+        if self.form["binaries"]:
+            self.model.u_ch  = pyo.Var(self.model.T, within=pyo.Binary)
+            self.model.u_dis = pyo.Var(self.model.T, within=pyo.Binary)
         
         # Variables par pas de temps
         self.model.Pch   = pyo.Var(self.model.T, bounds=(0, self.P*self.C_rate))        # MW
@@ -64,12 +170,16 @@ class Solver:
         self.model.soc_cons = pyo.Constraint(self.model.T,rule=lambda m,t: self.soc_rule(m,t))
         self.model.afrr_pos = pyo.Constraint(self.model.B, rule=lambda m,b: self.afrr_pos_rule(m,b))
         self.model.afrr_neg = pyo.Constraint(self.model.B, rule=lambda m,b: self.afrr_neg_rule(m,b))
-        self.model.fcr_availability_rule = pyo.Constraint(self.model.T, rule=lambda m,t: self.fcr_availability_rule(m,t))
-        self.model.no_simul = pyo.Constraint(self.model.T, rule=lambda m,t: self.no_simul_rule(m,t))
-        self.model.bind_ch = pyo.Constraint(self.model.T, rule=lambda m,t: self.bind_ch_rule(m,t))
-        self.model.crate_dis = pyo.Constraint(self.model.T, rule=lambda m,t: self.crate_dis_rule(m,t))
-        self.model.bind_dis = pyo.Constraint(self.model.T, rule=lambda m,t: self.bind_dis_rule(m,t))
-        self.model.crate_ch = pyo.Constraint(self.model.T, rule=lambda m,t: self.crate_ch_rule(m,t))
+        if self.form["binaries"]:
+            self.model.fcr_availability_rule = pyo.Constraint(self.model.T, rule=lambda m,t: self.fcr_availability_rule(m,t))
+            self.model.no_simul = pyo.Constraint(self.model.T, rule=lambda m,t: self.no_simul_rule(m,t))
+            self.model.bind_ch = pyo.Constraint(self.model.T, rule=lambda m,t: self.bind_ch_rule(m,t))
+        if not self.form["tight"]:
+            self.model.crate_dis = pyo.Constraint(self.model.T, rule=lambda m,t: self.crate_dis_rule(m,t))
+        if self.form["binaries"]:
+            self.model.bind_dis = pyo.Constraint(self.model.T, rule=lambda m,t: self.bind_dis_rule(m,t))
+        if not self.form["tight"]:
+            self.model.crate_ch = pyo.Constraint(self.model.T, rule=lambda m,t: self.crate_ch_rule(m,t))
         self.model.power_cap = pyo.Constraint(self.model.T, rule=lambda m,t: self.power_cap_rule(m,t))
         self.model.cycles_rule_day = pyo.Constraint(self.model.D, rule=lambda m,d: self.cycles_rule_day(m,d))
                
@@ -102,12 +212,10 @@ class Solver:
 
     # SoC dynamics
     def soc_rule(self, m, t):
-        if t == 0:
-            SoC0 = 0  # SoC initial
-            return m.SoC[t] == SoC0
-        else:
-            b = int(t // 16)
-            return m.SoC[t] == m.SoC[t-1] + (
+        # SoC[t] is the state after quarter t, SoC0 the state before the window
+        prev = self.SoC0 if t == 0 else m.SoC[t-1]
+        b = int(t // 16)
+        return m.SoC[t] == prev + (
                 (m.Pch[t] - m.Pdis[t]) * self.dt
                 + (m.R_aFRR_neg[b] * self.dt_block)   # réserve négative = charge
                 - (m.R_aFRR_pos[b] * self.dt_block)   # réserve positive = décharge
@@ -120,11 +228,13 @@ class Solver:
 
     def bind_ch_rule(self, m, t):
         b = int(t // 16)  # bloc 4h correspondant
-        return m.Pch[t] + m.R_aFRR_neg[b] <= self.Pnom * m.u_ch[t]
+        M = big_m(self) if self.form["tight"] else self.Pnom
+        return m.Pch[t] + m.R_aFRR_neg[b] <= M * m.u_ch[t]
 
     def bind_dis_rule(self, m, t):
         b = int(t // 16)
-        return m.Pdis[t] + m.R_aFRR_pos[b] <= self.Pnom * m.u_dis[t]
+        M = big_m(self) if self.form["tight"] else self.Pnom
+        return m.Pdis[t] + m.R_aFRR_pos[b] <= M * m.u_dis[t]
 
     # C-rate limit (per-step)
     def crate_ch_rule(self, m, t):
@@ -152,11 +262,127 @@ class Solver:
         return sum((m.Pch[t] + m.Pdis[t]) * self.dt 
                 for t in range(start, end+1)) <= self.cycles_max * self.Cap_nom
 
-    def solve(self):
+    def warm_start(self, schedule):
+        """Repair schedule (e.g. heuristic_schedule(op)) into a feasible first incumbent for solve"""
+        values, stats = repair_schedule(self, schedule)
+        self._set_values(values)
+        self.start_values = {name: vals for name, vals in values.items() if hasattr(self.model, name)}
+        self.warm_stats = stats
+        return stats
+
+    def _set_values(self, values):
+        for name, vals in values.items():
+            if hasattr(self.model, name):
+                var = getattr(self.model, name)
+                for i, v in enumerate(vals.tolist()):
+                    var[i].value = v
+
+    def solve(self, time_limit=None, mip_gap=None, verbose=True, deadline=None, on_progress=None):
+        """
+        time_limit (s) and mip_gap stop the search, deadline (epoch s or
+        datetime) shortens the time limit to the time left. The incumbents and
+        bounds found are streamed to on_progress (see SolveProgress).
+        """
+        # nothing of a previous solve is kept: variables fixed by lp_repair, results
+        for var in self._restricted:
+            var.unfix()
+        self._restricted = []
+        self.repair = None
+        self.gap = None
+        self.bound = None
         solver = pyo.SolverFactory('highs')   # ou 'gurobi'
-        res = solver.solve(self.model, tee=False)
-        print(res.solver.status, res.solver.termination_condition)
+        options = {}
+        if mip_gap is not None:
+            options['mip_rel_gap'] = mip_gap
+        # the HiGHS model is built here so that the start solution and the
+        # incumbent callback can be set before the solve
+        with Profiler.stage("highs_load"):
+            solver.set_instance(self.model)
+            highs = solver._solver_model
+            self.first_incumbent_time = None
+            self.progress = SolveProgress(on_progress)
+            highs.cbMipImprovingSolution.subscribe(self._on_incumbent)
+            highs.cbMipInterrupt.subscribe(self._on_mip_log)
+            if self.start_values is not None:
+                cols = [solver._pyomo_var_to_solver_var_map[id(getattr(self.model, name)[i])]
+                        for name, vals in self.start_values.items() for i in range(len(vals))]
+                vals = np.concatenate(list(self.start_values.values()))
+                highs.setSolution(len(cols), np.asarray(cols, dtype=np.int32), vals)
+        t0 = time.perf_counter()
+        with Profiler.stage("highs_solve"):
+            # the incumbent is loaded by hand: with none at the time limit the
+            # default loading raises instead of reporting the status
+            res = solver.solve(self.model, tee=False, timelimit=time_left(time_limit, deadline), options=options,
+                               load_solutions=False)
+        self.solve_time = time.perf_counter() - t0
+        if len(res.solution):
+            for symbol, val in res.solution(0).variable.items():
+                res._smap.bySymbol[symbol].set_value(val['Value'], skip_validation=True)
+        Profiler.highs_stats("pyomo", highs)
+        self.results = res
+        # maximization: lower bound = incumbent, upper bound = best bound
+        lb, ub = res.problem.lower_bound, res.problem.upper_bound
+        self.bound = _finite(ub)
+        if lb is None or ub is None or not (math.isfinite(lb) and math.isfinite(ub)):
+            self.gap = math.nan
+        else:
+            self.gap = abs(ub - lb) / max(abs(lb), 1e-9)
+        if not self.form["binaries"] and self.status() == "optimal":
+            self.repair = lp_repair(self)
+            self.gap = self.repair["gap"]
+        if verbose:
+            print(res.solver.status, res.solver.termination_condition)
+        return res
+
+    def _solve_restricted(self, zero):
+        # LP again with the variables of the mask fixed to 0 (lp_repair)
+        for name, mask in zero.items():
+            var = getattr(self.model, name)
+            for i in np.flatnonzero(mask).tolist():
+                var[i].fix(0.0)
+                self._restricted.append(var[i])
+        res = pyo.SolverFactory('highs').solve(self.model, tee=False)
+        return str(res.solver.termination_condition) == "optimal"
+
+    def _on_incumbent(self, e):
+        # HiGHS clock of the first improving solution (the start solution counts)
+        if self.first_incumbent_time is None:
+            self.first_incumbent_time = e.data_out.running_time
+        self.progress.incumbent(e.data_out)
+
+    def _on_mip_log(self, e):
+        self.progress.log(e.data_out)
+
+    def feasible(self):
+        """True when the last solve has a feasible schedule (optimal or stopped with an incumbent)"""
+        return self.results is not None and self.results.problem.lower_bound is not None \
+            and math.isfinite(self.results.problem.lower_bound)
+
+    def status(self):
+        return str(self.results.solver.termination_condition)
+
+    def objective_value(self):
+        return pyo.value(self.model.obj)
+
+    @Profiler.timed("result_extraction")
+    def schedule(self):
+        """One row per quarter of the window, reserves repeated over their 4h block"""
+        m = self.model
+        blocks = [min(t // 16, len(self.c_FCR_block) - 1) for t in m.T]
+        r_fcr = [pyo.value(m.R_FCR[b]) for b in m.B]
+        r_pos = [pyo.value(m.R_aFRR_pos[b]) for b in m.B]
+        r_neg = [pyo.value(m.R_aFRR_neg[b]) for b in m.B]
+        return pd.DataFrame({
+            'time_step': [self.start + t for t in m.T],
+            'P_charge_MW': [pyo.value(m.Pch[t]) for t in m.T],
+            'P_discharge_MW': [pyo.value(m.Pdis[t]) for t in m.T],
+            'SoC': [pyo.value(m.SoC[t]) for t in m.T],
+            'R_FCR': [r_fcr[b] for b in blocks],
+            'R_AFRR_pos': [r_pos[b] for b in blocks],
+            'R_AFRR_neg': [r_neg[b] for b in blocks],
+        })
     
+    @Profiler.timed("result_extraction")
     def print_result(self):
         obj_val = pyo.value(self.model.obj)
         print("Objective (EUR or unité):", obj_val)
@@ -196,4 +422,303 @@ class Solver:
             'R_AFRR_pos': R_AFRR_values_pos
         })
         
-        return df_results
\ No newline at end of file
+        return df_results
+
+#############################################
+## Warm start from a heuristic schedule    ##
+#############################################
+
+def heuristic_schedule(op, dt=0.25):
+    """Schedule (same columns as Solver.schedule) from the Operation trace of the heuristic"""
+    return pd.DataFrame({
+        'time_step': np.arange(len(op)),
+        'P_charge_MW': op['Charge [MWh]'].to_numpy() / dt,
+        'P_discharge_MW': op['Discharge [MWh]'].to_numpy() / dt,
+        'SoC': op['SoC [-]'].to_numpy(),
+        'R_FCR': op['FCR Capacity [MW]'].to_numpy(),
+        'R_AFRR_pos': op['aFRR Capacity POS [MW]'].to_numpy(),
+        'R_AFRR_neg': op['aFRR Capacity NEG [MW]'].to_numpy(),
+    })
+
+def repair_schedule(solver, schedule):
+    """
+    Feasible values of every model variable, as close as possible to schedule.
+
+    The model allows a single mode per 4h block: FCR only, aFRR NEG with
+    charging, aFRR POS with discharging, or DA only. Each block tries the
+    modes the schedule uses, clips the powers so that the SoC, C-rate and
+    daily cycle limits hold (the reserves keep their SoC headroom until the
+    end of the block), and keeps the mode with the best revenue plus the value
+    of the stored energy at the mean DA price of the window. Works on Solver
+    and MatrixSolver. Returns (values by variable name, stats).
+    """
+    dt, dt_block, qpb = solver.dt, solver.dt_block, solver.quarters_per_block
+    da = np.asarray(solver.c_DA, dtype=float)
+    fcr_p = np.asarray(solver.c_FCR_block, dtype=float)
+    pos_p = np.asarray(solver.c_aFRR_pos_block, dtype=float)
+    neg_p = np.asarray(solver.c_aFRR_neg_block, dtype=float)
+    T, B = len(da), len(fcr_p)
+    cap = solver.Cap_nom
+    steps_per_day = int(24 / dt)
+
+    # schedule of the window, missing quarters are idle
+    sched = schedule.set_index('time_step').reindex(solver.start + np.arange(T)).fillna(0.0)
+    ch = sched['P_charge_MW'].to_numpy(dtype=float)
+    dis = sched['P_discharge_MW'].to_numpy(dtype=float)
+    ch, dis = np.maximum(ch - dis, 0.0), np.maximum(dis - ch, 0.0)
+    blocks = np.arange(T) // qpb
+    n_in_block = np.bincount(blocks, minlength=B)
+    r_fcr_in = np.bincount(blocks, sched['R_FCR'].to_numpy(dtype=float), B) / np.maximum(n_in_block, 1)
+    r_pos_in = np.bincount(blocks, sched['R_AFRR_pos'].to_numpy(dtype=float), B) / np.maximum(n_in_block, 1)
+    r_neg_in = np.bincount(blocks, sched['R_AFRR_neg'].to_numpy(dtype=float), B) / np.maximum(n_in_block, 1)
+
+    p_move = min(solver.P * solver.C_rate, solver.P, solver.Pnom)
+    r_max = min(solver.P * solver.C_rate, solver.P)
+    day_budget = solver.cycles_max * cap
+    energy_value = float(np.nanmean(da)) if T else 0.0
+
+    out = {name: np.zeros(T) for name in ("u_ch", "u_dis", "Pch", "Pdis", "SoC")}
+    out.update({name: np.zeros(B) for name in ("R_FCR", "R_aFRR_pos", "R_aFRR_neg")})
+    soc = solver.SoC0
+    used = 0.0   # throughput of the current day [MWh]
+    clipped = 0
+
+    for b in range(B):
+        q = np.arange(b * qpb, min((b + 1) * qpb, T))
+        n = len(q)
+        day_start = q[0] % steps_per_day == 0
+        used_b = 0.0 if day_start else used
+
+        def play(mode):
+            s, u = soc, used_b
+            r_neg = r_pos = r_fcr = 0.0
+            if mode == "neg":
+                r_neg = max(0.0, min(r_neg_in[b], r_max, (1 - s) * cap / (dt_block * (n + 1))))
+            elif mode == "pos":
+                r_pos = max(0.0, min(r_pos_in[b], r_max, s * cap / (dt_block * (n + 1))))
+            elif mode == "fcr":
+                s_ref = s if b == 0 else out["SoC"][b]
+                r_fcr = max(0.0, min(r_fcr_in[b], solver.Pnom, s_ref * cap))
+            pch = np.zeros(n)
+            pdis = np.zeros(n)
+            socs = np.zeros(n)
+            for k, t in enumerate(q):
+                if t % steps_per_day == 0 and k > 0:
+                    u = 0.0
+                if mode in ("energy", "neg") and ch[t] > 0:
+                    room = ((1 - s) * cap - r_neg * dt_block * (n - k + 1)) / dt
+                    pch[k] = max(0.0, min(ch[t], p_move - r_neg, room, (day_budget - u) / dt))
+                if mode in ("energy", "pos") and dis[t] > 0:
+                    room = (s * cap - r_pos * dt_block * (n - k + 1)) / dt
+                    pdis[k] = max(0.0, min(dis[t], p_move - r_pos, room, (day_budget - u) / dt))
+                u += (pch[k] + pdis[k]) * dt
+                s = s + ((pch[k] - pdis[k]) * dt + r_neg * dt_block - r_pos * dt_block) / cap
+                socs[k] = s
+            revenue = (np.dot(da[q], pdis - pch) * dt
+                       + (fcr_p[b] * r_fcr + pos_p[b] * r_pos + neg_p[b] * r_neg) * dt_block)
+            return revenue + (s - soc) * cap * energy_value, (r_fcr, r_pos, r_neg, pch, pdis, socs, u)
+
+        modes = ["energy"]
+        if r_neg_in[b] > 0:
+            modes.append("neg")
+        if r_pos_in[b] > 0:
+            modes.append("pos")
+        if r_fcr_in[b] > 0:
+            modes.append("fcr")
+        mode, (_, (r_fcr, r_pos, r_neg, pch, pdis, socs, used)) = max(
+            ((m, play(m)) for m in modes), key=lambda x: x[1][0])
+
+        clipped += int(np.sum(pch < ch[q] - 1e-9) + np.sum(pdis < dis[q] - 1e-9))
+        out["Pch"][q] = pch
+        out["Pdis"][q] = pdis
+        out["SoC"][q] = socs
+        out["u_ch"][q] = 1.0 if mode == "neg" else (pch > 0)
+        out["u_dis"][q] = 1.0 if mode == "pos" else (pdis > 0)
+        out["R_FCR"][b] = r_fcr
+        out["R_aFRR_pos"][b] = r_pos
+        out["R_aFRR_neg"][b] = r_neg
+        soc = socs[-1]
+
+    objective = (np.dot(da, out["Pdis"] - out["Pch"]) * dt
+                 + np.dot(fcr_p, out["R_FCR"]) * dt_block
+                 + (np.dot(pos_p, out["R_aFRR_pos"]) + np.dot(neg_p, out["R_aFRR_neg"])) * dt_block)
+    stats = {"objective": float(objective), "clipped_quarters": clipped}
+    return out, stats
+
+def lp_repair(solver, tol=1e-6):
+    """
+    Check the LP solution (formulation without binaries) against the
+    exclusions the binaries enforce: no simultaneous charge and discharge,
+    no FCR together with any other activity in a 4h block, aFRR NEG only
+    with charging and aFRR POS only with discharging.
+
+    If a block is in conflict, repair_schedule picks one mode per block and
+    the LP is solved again with every variable outside of these modes fixed
+    to 0 (the charge / discharge direction of the DA-only quarters is the one
+    of the first LP). That solution satisfies all the MILP constraints.
+    Returns the stats; objective is the feasible one, lp_objective the bound.
+    """
+    sched = solver.schedule()
+    lp_objective = solver.objective_value()
+    pch = sched['P_charge_MW'].to_numpy()
+    pdis = sched['P_discharge_MW'].to_numpy()
+    ch = pch > tol
+    dis = pdis > tol
+    fcr = sched['R_FCR'].to_numpy() > tol
+    pos = sched['R_AFRR_pos'].to_numpy() > tol
+    neg = sched['R_AFRR_neg'].to_numpy() > tol
+    blocks = (sched['time_step'].to_numpy() - solver.start) // solver.quarters_per_block
+    n_blocks = int(blocks[-1]) + 1 if len(blocks) else 0
+
+    # a block is in conflict as soon as one of its quarters is
+    move_ch = np.bincount(blocks, ch, n_blocks)[blocks] > 0
+    move_dis = np.bincount(blocks, dis, n_blocks)[blocks] > 0
+    conflict = ((ch & dis) | (fcr & (move_ch | move_dis | pos | neg))
+                | (neg & move_dis) | (pos & move_ch) | (pos & neg))
+    conflict_blocks = int(np.unique(blocks[conflict]).size)
+
+    objective = lp_objective
+    if conflict_blocks:
+        values, repaired = repair_schedule(solver, sched)
+        fcr_mode = values['R_FCR'] > 0
+        pos_mode = values['R_aFRR_pos'] > 0
+        neg_mode = values['R_aFRR_neg'] > 0
+        energy = ~(fcr_mode | pos_mode | neg_mode)
+        zero = {
+            'R_FCR': ~fcr_mode,
+            'R_aFRR_pos': ~pos_mode,
+            'R_aFRR_neg': ~neg_mode,
+            'Pch': ~(neg_mode[blocks] | energy[blocks] & (pch > pdis)),
+            'Pdis': ~(pos_mode[blocks] | energy[blocks] & (pdis > pch)),
+        }
+        if solver._solve_restricted(zero):
+            objective = solver.objective_value()
+        else:
+            # keep the repaired schedule if the restricted LP fails
+            solver._set_values(values)
+            objective = repaired['objective']
+    stats = {
+        'conflict_quarters': int(conflict.sum()),
+        'conflict_blocks': conflict_blocks,
+        'blocks': n_blocks,
+        'lp_objective': lp_objective,
+        'objective': objective,
+        'gap': abs(lp_objective - objective) / max(abs(objective), 1e-9),
+    }
+    return stats
+
+def schedule_revenue(schedule, da_prices, fcr_prices, afrr_pos_prices, afrr_neg_prices, dt=0.25):
+    """DA + reserve revenue of a quarter-hour schedule (same terms as objective_rule)"""
+    t = schedule['time_step'].to_numpy()
+    b = t // Solver.quarters_per_block
+    da = np.asarray(_as_list(da_prices), dtype=float)[t]
+    fcr = np.asarray(_as_list(fcr_prices), dtype=float)[b]
+    pos = np.asarray(_as_list(afrr_pos_prices), dtype=float)[b]
+    neg = np.asarray(_as_list(afrr_neg_prices), dtype=float)[b]
+    term_DA = (da * (schedule['P_discharge_MW'] - schedule['P_charge_MW'])).sum() * dt
+    # each block is 16 rows of dt -> price * R * dt_block
+    term_res = (fcr * schedule['R_FCR'] + pos * schedule['R_AFRR_pos'] + neg * schedule['R_AFRR_neg']).sum() * dt
+    return float(term_DA + term_res)
+
+def anytime_solve(solver, deadline=None, gap=None, time_limit=None, on_progress=None):
+    """
+    Solve (Solver or MatrixSolver) until the deadline (epoch s or datetime),
+    the time limit or the relative gap target, whichever comes first, with
+    the incumbents and bounds streamed to on_progress (print_progress for a
+    log). Returns a dict: status, best feasible schedule (None when no
+    solution was found in time), its objective, the best bound, the certified
+    gap, the solve time and the progress events.
+    """
+    solver.solve(time_limit=time_limit, mip_gap=gap, verbose=False, deadline=deadline, on_progress=on_progress)
+    feasible = solver.feasible()
+    return {
+        "status": solver.status(),
+        "schedule": solver.schedule() if feasible else None,
+        "objective": solver.objective_value() if feasible else None,
+        "bound": solver.bound,
+        "gap": _finite(solver.gap) if feasible else None,
+        "solve_time_s": solver.solve_time,
+        "progress": solver.progress.events,
+    }
+
+def rolling_horizon(battery, market_da_prices, market_fcr_prices, market_afrr_prices_pos, market_afrr_prices_neg,
+                    window_days=1, overlap_days=1, n_days=None, soc0=0.0, time_limit=None, mip_gap=None,
+                    solver_class=Solver, warm_start=None, formulation="milp", deadline=None):
+    """
+    Solve a long period as a sequence of windows of window_days + overlap_days.
+
+    Only the first window_days of each window are kept, the SoC at the end of
+    them is the initial SoC of the next window. Returns the schedule of the
+    whole period, its objective and one report row per window (build and
+    solve time, MIP gap, status). solver_class selects the backend (Solver or
+    MatrixSolver). warm_start is an optional schedule of the whole period (e.g.
+    the heuristic one), repaired into the first incumbent of every window.
+    formulation is a key of FORMULATIONS. deadline (epoch s or datetime)
+    shares the time left between the remaining windows; a window stopped by
+    its share keeps its best schedule, its gap is in the report. A window
+    without any schedule in time takes the repaired warm start ('fallback'
+    in the report), or raises ValueError without warm_start.
+    """
+    if isinstance(deadline, datetime):
+        deadline = deadline.timestamp()
+    da_lst = _as_list(market_da_prices)
+    fcr_lst = _as_list(market_fcr_prices)
+    pos_lst = _as_list(market_afrr_prices_pos)
+    neg_lst = _as_list(market_afrr_prices_neg)
+
+    steps_per_day = Solver.n_quarters
+    blocks_per_day = steps_per_day // Solver.quarters_per_block
+    max_days = min(len(da_lst) // steps_per_day, len(fcr_lst) // blocks_per_day,
+                   len(pos_lst) // blocks_per_day, len(neg_lst) // blocks_per_day)
+    n_days = max_days if n_days is None else min(n_days, max_days)
+
+    parts = []
+    report = []
+    soc = soc0
+    for w, day in enumerate(range(0, n_days, window_days)):
+        keep_days = min(window_days, n_days - day)
+        horizon_days = min(window_days + overlap_days, n_days - day)
+
+        t0 = time.perf_counter()
+        solver = solver_class(battery, da_lst, fcr_lst, pos_lst, neg_lst,
+                        start=day * steps_per_day, n_quarters=horizon_days * steps_per_day, soc0=soc,
+                        formulation=formulation)
+        build_time = time.perf_counter() - t0
+        if warm_start is not None:
+            solver.warm_start(warm_start)
+        window_deadline = None
+        if deadline is not None:
+            windows_left = len(range(day, n_days, window_days))
+            window_deadline = time.time() + max(deadline - time.time(), 0.0) / windows_left
+        solver.solve(time_limit=time_limit, mip_gap=mip_gap, verbose=False, deadline=window_deadline)
+
+        # no incumbent in time: the repaired warm start of the window is kept
+        fallback = not solver.feasible()
+        if fallback:
+            if warm_start is None:
+                raise ValueError(f"Window {w} (day {day}) has no feasible schedule ({solver.status()}), "
+                                 "give a warm_start or a longer time limit")
+            values, _ = repair_schedule(solver, warm_start)
+            solver._set_values(values)
+        part = solver.schedule().iloc[:keep_days * steps_per_day]
+        soc = float(part['SoC'].iloc[-1])
+        parts.append(part)
+        report.append({
+            'window': w,
+            'first_day': day,
+            'days_kept': keep_days,
+            'days_solved': horizon_days,
+            'build_time_s': build_time,
+            'solve_time_s': solver.solve_time,
+            'mip_gap': solver.gap,
+            'first_incumbent_s': solver.first_incumbent_time,
+            'status': solver.status(),
+            'fallback': fallback,
+            'window_objective': solver.warm_stats['objective'] if fallback else solver.objective_value(),
+            'warm_start_objective': solver.warm_stats['objective'] if solver.warm_stats else None,
+            'repaired_blocks': solver.repair['conflict_blocks'] if solver.repair else None,
+        })
+
+    schedule = pd.concat(parts, ignore_index=True)
+    objective = schedule_revenue(schedule, da_lst, fcr_lst, pos_lst, neg_lst)
+    return schedule, objective, pd.DataFrame(report)
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from methods.XLSCache import DA_SHEET, FCR_SHEET, AFRR_SHEET, FINANCE_SHEET
+
+#############################################
+## Synthetic market data                   ##
+#############################################
+# Prices with the shape of the TechArena data (daily DA profile, 4h reserve
+# blocks) and a workbook with the same layout as input/TechArena2025_data.xlsx,
+# so the whole pipeline can run and be measured without the private file.
+
+# code, DA column, name in the description sheet, WACC, inflation
+COUNTRIES = [
+    ("DE", "DE_LU", "Germany (DE)", 0.083, 0.020),
+    ("AT", "AT", "Austria (AT)", 0.083, 0.033),
+    ("CH", "CH", "Switzerland (CH)", 0.083, 0.001),
+    ("CZ", "CZ", "Czech Republic (CZ)", 0.120, 0.029),
+    ("HU", "HU", "Hungary (HU)", 0.150, 0.046),
+]
+
+# the loaders read 5 DA / FCR columns and 10 aFRR columns
+MAX_WORKBOOK_COUNTRIES = len(COUNTRIES)
+
+def country_table(n_countries):
+    """The first n countries, extra ones get generated codes (X6, X7...)"""
+    rows = list(COUNTRIES[:n_countries])
+    for i in range(len(rows), n_countries):
+        code = f"X{i + 1}"
+        rows.append((code, code, f"Country {i + 1} ({code})", 0.10, 0.02))
+    return rows
+
+def synthetic_prices(days=365, n_countries=5, volatility=1.0, seed=0, start="2024-01-01"):
+    """
+    DA prices at 15 min, FCR and aFRR POS/NEG prices per 4h block.
+
+    volatility scales the noise, the spikes and the amplitude of the daily
+    profile (1.0 ~ the 2024 data, 0 = deterministic profile). Returns a dict
+    of DataFrames (da, fcr, afrr_pos, afrr_neg) with one column per DA
+    column / country code, and the country table.
+    """
+    rng = np.random.default_rng(seed)
+    countries = country_table(n_countries)
+    idx = pd.date_range(start, periods=days * 96, freq="15min")
+    idx4 = pd.date_range(start, periods=days * 6, freq="4h")
+    hour = idx.hour.to_numpy() + idx.minute.to_numpy() / 60
+    season = np.cos(2 * np.pi * idx.dayofyear.to_numpy() / 365)
+
+    da = {}
+    fcr = {}
+    pos = {}
+    neg = {}
+    for k, (code, da_col, _, _, _) in enumerate(countries):
+        level = 80 + 10 * k + 15 * season
+        # morning and evening peaks, solar dip at noon
+        profile = 25 * np.exp(-((hour - 8) / 2) ** 2) + 35 * np.exp(-((hour - 19) / 2.5) ** 2) \
+            - 30 * np.exp(-((hour - 13) / 2.5) ** 2)
+        noise = rng.normal(0, 15, len(idx))
+        spikes = rng.random(len(idx)) < 0.002
+        spike = np.where(spikes, rng.normal(0, 200, len(idx)), 0.0)
+        da[da_col] = level + (1 + 0.5 * volatility) * profile + volatility * (noise + spike)
+
+        shape = 1 + 0.3 * volatility * np.sin(2 * np.pi * np.arange(len(idx4)) / 6)
+        fcr[code] = np.maximum(0, rng.gamma(4, 5, len(idx4)) * shape)
+        pos[code] = np.maximum(0, rng.gamma(3, 4, len(idx4)) * (1 + volatility * rng.exponential(0.3, len(idx4))))
+        neg[code] = np.maximum(0, rng.gamma(3, 4, len(idx4)) * (1 + volatility * rng.exponential(0.3, len(idx4))))
+
+    return {
+        "da": pd.DataFrame(da, index=idx),
+        "fcr": pd.DataFrame(fcr, index=idx4),
+        "afrr_pos": pd.DataFrame(pos, index=idx4),
+        "afrr_neg": pd.DataFrame(neg, index=idx4),
+        "countries": countries,
+    }
+
+def _sheet(writer, name, title_rows, data):
+    pd.DataFrame(title_rows).to_excel(writer, sheet_name=name, header=False, index=False)
+    data.to_excel(writer, sheet_name=name, header=False, index=False, startrow=len(title_rows))
+
+def write_workbook(path, days=365, n_countries=5, volatility=1.0, seed=0, start="2024-01-01"):
+    """
+    Write a workbook with the layout of TechArena2025_data.xlsx (sheets
+    "Day-ahead prices", "FCR prices", "aFRR capacity prices" and the WACC /
+    inflation table of "Data description"). Returns the prices it contains.
+    """
+    if not 1 <= n_countries <= MAX_WORKBOOK_COUNTRIES:
+        raise ValueError(f"The workbook layout holds 1 to {MAX_WORKBOOK_COUNTRIES} countries (got {n_countries})")
+    prices = synthetic_prices(days, n_countries, volatility, seed, start)
+    countries = prices["countries"]
+    da_cols = [c[1] for c in countries]
+    codes = [c[0] for c in countries]
+
+    def timestep(df):
+        return pd.concat([pd.Series(df.index, name="Timestep"), df.reset_index(drop=True)], axis=1)
+
+    with pd.ExcelWriter(path, engine="openpyxl") as w:
+        _sheet(w, DA_SHEET, [[DA_SHEET], ["Timestep"] + da_cols], timestep(prices["da"]))
+        _sheet(w, FCR_SHEET, [[FCR_SHEET], ["Timestep"] + codes], timestep(prices["fcr"]))
+
+        # merged country cells: the code on the Pos column, empty on the Neg one
+        countries_row = ["aFRR"]
+        dirs_row = ["Timestep"]
+        afrr = {}
+        for code in codes:
+            countries_row += [code, None]
+            dirs_row += ["Pos", "Neg"]
+            afrr[f"{code} Pos"] = prices["afrr_pos"][code]
+            afrr[f"{code} Neg"] = prices["afrr_neg"][code]
+        afrr = pd.DataFrame(afrr, index=prices["afrr_pos"].index)
+        _sheet(w, AFRR_SHEET, [[AFRR_SHEET], countries_row, dirs_row], timestep(afrr))
+
+        # WACC / inflation table from row 21 of the sheet
+        desc = [[f"line {i}", None, None] for i in range(19)]
+        desc += [[name, wacc, infl] for _, _, name, wacc, infl in countries]
+        pd.DataFrame(desc, columns=["Description", "WACC", "Inflation"]).to_excel(
+            w, sheet_name=FINANCE_SHEET, index=False)
+    return prices
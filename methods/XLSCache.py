@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from methods import Profiler
+
+#############################################
+## Columnar cache of the TechArena workbook ##
+#############################################
+# The workbook is parsed once with openpyxl, the cleaned tables are saved as
+# .npy columns in <workbook dir>/.cache/<stem>-<sha256>/ and reloaded from there
+# as long as the content of the workbook does not change.
+
+CACHE_VERSION = 2
+
+DA_SHEET = "Day-ahead prices"
+FCR_SHEET = "FCR prices"
+AFRR_SHEET = "aFRR capacity prices"
+FINANCE_SHEET = "Data description"
+
+# afrr as read by the heuristic (text cells -> NaN), afrr_comma as read by
+# xls_sheet (text cells with a decimal comma are numbers)
+PRICE_TABLES = ("da", "fcr", "afrr", "afrr_comma")
+
+# (path, mtime, size) -> sha256, avoids hashing the same file twice per process
+_hash_memo = {}
+
+def file_hash(path):
+    """sha256 of the content of a file"""
+    st = os.stat(path)
+    key = (str(Path(path).resolve()), st.st_mtime_ns, st.st_size)
+    if key not in _hash_memo:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _hash_memo[key] = h.hexdigest()
+    return _hash_memo[key]
+
+def _num(s):
+    return pd.to_numeric(s, errors="coerce")
+
+def _price_sheet(raw, n_cols):
+    # row 0 = title, row 1 = header, data from row 2
+    hdr = raw.iloc[1].tolist()
+    data = raw.iloc[2:, 0:n_cols + 1]
+    data.columns = ["Timestep"] + hdr[1:n_cols + 1]
+    data["Timestep"] = pd.to_datetime(data["Timestep"])
+    return data.set_index("Timestep").apply(_num)
+
+def _afrr_sheet(raw, decimal_comma=False):
+    # row 1 = countries (merged cells), row 2 = Pos/Neg, data from row 3
+    countries = raw.iloc[1, 1:11].tolist()
+    dirs = raw.iloc[2, 1:11].tolist()
+    afrr = raw.iloc[3:, [0] + list(range(1, 11))].copy()
+    afrr.columns = ["Timestep"] + list(range(10))
+    afrr["Timestep"] = pd.to_datetime(afrr["Timestep"])
+    afrr = afrr.set_index("Timestep")
+
+    clean_cols = []
+    c_prec = "UNK"
+    for c, d in zip(countries, dirs):
+        cc = c if isinstance(c, str) else c_prec
+        clean_cols.append((cc, d))
+        c_prec = cc
+    afrr.columns = pd.MultiIndex.from_tuples(clean_cols, names=["Country", "Dir"])
+    afrr.sort_index(axis=1, inplace=True)
+    if decimal_comma:
+        return afrr.apply(lambda s: _num(s.replace(",", ".", regex=True) if s.dtype == object else s))
+    return afrr.apply(_num)
+
+def _finance_sheet(raw):
+    # same rows as read_excel(header=0).iloc[19:29]
+    t2 = raw.iloc[20:30, 0:3].copy()
+    t2.columns = ["Country", "WACC", "Inflation"]
+    t2 = t2.dropna().reset_index(drop=True)
+    t2["Code"] = t2["Country"].str.extract(r"\((\w+)\)").iloc[:, 0]
+    t2["WACC"] = t2["WACC"].astype(float)
+    t2["Inflation"] = t2["Inflation"].astype(float)
+    return t2[["Code", "WACC", "Inflation"]]
+
+def read_tables(xls_path):
+    """Parse the workbook (one openpyxl pass) into the cleaned tables"""
+    raw = pd.read_excel(xls_path, sheet_name=[DA_SHEET, FCR_SHEET, AFRR_SHEET, FINANCE_SHEET], header=None)
+    return {
+        "da": _price_sheet(raw[DA_SHEET], 5),
+        "fcr": _price_sheet(raw[FCR_SHEET], 5),
+        "afrr": _afrr_sheet(raw[AFRR_SHEET]),
+        "afrr_comma": _afrr_sheet(raw[AFRR_SHEET], decimal_comma=True),
+        "finance": _finance_sheet(raw[FINANCE_SHEET]),
+    }
+
+def _cache_root(xls_path, cache_dir=None):
+    return Path(cache_dir) if cache_dir is not None else Path(xls_path).parent / ".cache"
+
+def _write_cache(tables, target):
+    meta = {"version": CACHE_VERSION, "tables": {}}
+    tmp = Path(tempfile.mkdtemp(prefix=target.name + ".", dir=target.parent))
+    try:
+        for name in PRICE_TABLES:
+            df = tables[name]
+            np.save(tmp / f"{name}_index.npy", df.index.values)
+            # one contiguous row per column
+            np.save(tmp / f"{name}_values.npy", np.ascontiguousarray(df.to_numpy(dtype=float).T))
+            meta["tables"][name] = {
+                "columns": [list(c) if isinstance(c, tuple) else c for c in df.columns],
+                "column_names": list(df.columns.names),
+            }
+        meta["finance"] = tables["finance"].to_dict(orient="list")
+        (tmp / "meta.json").write_text(json.dumps(meta))
+        os.replace(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not target.is_dir():
+            raise
+
+def _read_cache(target):
+    meta = json.loads((target / "meta.json").read_text())
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    tables = {}
+    for name in PRICE_TABLES:
+        info = meta["tables"][name]
+        index = pd.DatetimeIndex(np.load(target / f"{name}_index.npy"), name="Timestep")
+        values = np.load(target / f"{name}_values.npy")
+        if any(isinstance(c, list) for c in info["columns"]):
+            columns = pd.MultiIndex.from_tuples([tuple(c) for c in info["columns"]], names=info["column_names"])
+        else:
+            columns = pd.Index(info["columns"])
+        tables[name] = pd.DataFrame(values.T, index=index, columns=columns)
+    tables["finance"] = pd.DataFrame(meta["finance"])
+    return tables
+
+@Profiler.timed("excel_load")
+def load_tables(xls_path, cache_dir=None, use_cache=True):
+    """
+    Cleaned DA, FCR, aFRR and finance tables of the workbook.
+
+    The cache entry is keyed on the content hash of the file, so editing or
+    replacing the workbook invalidates it. Entries of older versions of the
+    same workbook are removed when a new one is written.
+    """
+    if not use_cache:
+        return read_tables(xls_path)
+
+    root = _cache_root(xls_path, cache_dir)
+    stem = Path(xls_path).stem
+    target = root / f"{stem}-{file_hash(xls_path)}"
+    if target.is_dir():
+        try:
+            tables = _read_cache(target)
+            if tables is not None:
+                Profiler.count("xls_cache_hit")
+                return tables
+        except (OSError, ValueError, KeyError):
+            pass
+        shutil.rmtree(target, ignore_errors=True)
+
+    Profiler.count("xls_cache_miss")
+    tables = read_tables(xls_path)
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        # only former entries of this workbook, not data-2020-<sha> nor the
+        # <stem>-<sha>.XXXX staging dirs of concurrent writers
+        former = re.compile(rf"{re.escape(stem)}-[0-9a-f]{{64}}")
+        for old in root.glob(f"{stem}-*"):
+            if old.is_dir() and old != target and former.fullmatch(old.name):
+                shutil.rmtree(old, ignore_errors=True)
+        _write_cache(tables, target)
+    except OSError as e:
+        warnings.warn(f"Cache not written ({e}), continuing without it")
+    return tables
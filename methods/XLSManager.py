@@ -1,5 +1,7 @@
 import pandas as pd 
 
+from methods.XLSCache import load_tables
+
 class xls_sheet:
     xls_file_name = ""
 
@@ -14,10 +16,11 @@ class xls_sheet:
 
     def __init__(self, xls_file_name):
         self.xls_file_name = xls_file_name
-        # import all sheets (skiprows=1 to skip the title)
-        self.da_prices_sheet = pd.read_excel(xls_file_name, sheet_name=self.da_sheet_name, skiprows=1)
-        self.fcr_prices_sheet = pd.read_excel(xls_file_name, sheet_name=self.fcr_sheet_name, skiprows=1)
-        self.afrr_prices_sheet = pd.read_excel(xls_file_name, sheet_name=self.afrr_sheet_name, skiprows=1, header=[0, 1], index_col=0, decimal=',')
+        # import all sheets (from the columnar cache once the workbook has been parsed)
+        tables = load_tables(xls_file_name)
+        self.da_prices_sheet = tables["da"].reset_index()
+        self.fcr_prices_sheet = tables["fcr"].reset_index()
+        self.afrr_prices_sheet = tables["afrr_comma"]
         print("All input sheets are imported successfully")
     
     def _normalize_timestamp(self, timestamp):
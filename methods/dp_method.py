@@ -0,0 +1,347 @@
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from methods import Finance, Profiler
+from methods.heuristic_method import (
+    DATA_XLS, LIMIT_DAYS, OUT_DIR, COUNTRIES, CONFIGS, OPERATION_COLUMNS,
+    load_prices, load_finance, country_arrays, prepare_market, operation_frame,
+    configuration_results, investment_tables, write_phase1, _country_rates,
+)
+from methods.LUNA2000Battery import LUNA2000Battery
+from methods.XLSCache import load_tables
+
+#############################################
+## Dynamic programming optimizer           ##
+#############################################
+# Same battery as the heuristic (round-trip efficiency, SoC bounds, C-rate,
+# full cycles per day), dispatched by backward dynamic programming over a SoC
+# grid instead of fixed price thresholds.
+#
+# State: (reserve mode of the current 4h block, SoC level). The reserve mode
+# is chosen at the start of every block and holds a share of p_max as FCR or
+# aFRR capacity: that power is not available for the DA arbitrage and the SoC
+# must keep reserve_hours of full activation in the needed direction(s).
+# The daily cycle budget is handled with a Lagrangian penalty per day on the
+# energy throughput, adjusted by bisection until the budget holds; the last
+# forward pass also clips the throughput to the budget, so the dispatch is
+# always feasible.
+
+# (FCR, aFRR POS, aFRR NEG) shares of p_max held during a 4h block
+RESERVE_MODES = (
+    (0.0, 0.0, 0.0),
+    (0.5, 0.0, 0.0),
+    (1.0, 0.0, 0.0),
+    (0.0, 0.5, 0.0),
+    (0.0, 0.0, 0.5),
+)
+
+BLOCK_STEPS = 16
+NEG = -1e15  # value of the infeasible states
+
+def _grid(c_rate, levels, eta_rt, soc_min, soc_max, e_nom_mwh, dt_h, modes, reserve_hours):
+    # SoC levels, actions (shifts of levels) and the masks of every mode
+    eta_c = math.sqrt(eta_rt)
+    eta_d = math.sqrt(eta_rt)
+    p_max = c_rate * e_nom_mwh
+    soc = np.linspace(soc_min, soc_max, levels)
+    de = (soc_max - soc_min) * e_nom_mwh / (levels - 1)  # stored MWh per level
+
+    shares = np.asarray(modes, dtype=float)
+    p_arb = p_max * (1 - shares.sum(axis=1))  # MW left for the arbitrage
+    up = np.floor(p_arb * dt_h * eta_c / de + 1e-9).astype(int)
+    down = np.floor(p_arb * dt_h / eta_d / de + 1e-9).astype(int)
+    shifts = np.arange(-down.max(), up.max() + 1)
+
+    e_ch = np.maximum(shifts, 0) * de / eta_c    # MWh bought
+    e_dis = np.maximum(-shifts, 0) * de * eta_d  # MWh sold
+    action_mask = np.where((shifts[None, :] > up[:, None]) | (-shifts[None, :] > down[:, None]), NEG, 0.0)
+
+    # energy kept for reserve_hours of activation (FCR both ways, aFRR one way)
+    need_dis = (shares[:, 0] + shares[:, 1]) * p_max * reserve_hours
+    need_ch = (shares[:, 0] + shares[:, 2]) * p_max * reserve_hours
+    stored = (soc - soc_min) * e_nom_mwh
+    room = (soc_max - soc) * e_nom_mwh
+    ok = (stored[None, :] >= need_dis[:, None] - 1e-9) & (room[None, :] >= need_ch[:, None] - 1e-9)
+    return {
+        "soc": soc, "de": de, "e_nom": e_nom_mwh, "dt": dt_h, "eta_c": eta_c, "eta_d": eta_d,
+        "p_max": p_max, "p_arb": p_arb, "shares": shares, "shifts": shifts, "e_ch": e_ch, "e_dis": e_dis,
+        "action_mask": action_mask[:, None, :],
+        "state_mask": np.where(ok, 0.0, NEG),
+        "feasible": ok,
+    }
+
+def _backward(g, da, rev, lam):
+    """
+    Backward pass. Returns the best action (index in shifts) of every
+    (step, mode, SoC level) and the best mode of every block start and level.
+    """
+    n = len(da)
+    n_modes, levels = g["state_mask"].shape
+    shifts = g["shifts"]
+    down = -int(shifts[0])
+    policy = np.empty((n, n_modes, levels), dtype=np.int8)
+    block_mode = np.empty((-(-n // BLOCK_STEPS), levels), dtype=np.int8)
+
+    # reward of every action at every step, the throughput carries the penalty
+    reward = np.outer(da, g["e_dis"] - g["e_ch"]) - np.outer(lam, g["e_ch"] + g["e_dis"])
+    state_mask = g["state_mask"]
+    action_mask = g["action_mask"]
+
+    # next values padded with NEG: window k of the padded row = levels k+shifts
+    padded = np.full((n_modes, levels + len(shifts) - 1), NEG)
+    window = np.lib.stride_tricks.sliding_window_view(padded, len(shifts), axis=1)
+    # argmax + take is much faster than max on the short last axis
+    flat = np.arange(n_modes * levels) * len(shifts)
+    v_block = np.zeros(levels)
+    v_cur = None
+    for t in range(n - 1, -1, -1):
+        if t == n - 1 or (t + 1) % BLOCK_STEPS == 0:
+            padded[:, down:down + levels] = v_block  # next block: any mode
+            padded[:, down:down + levels] += state_mask  # within the limits of this one
+        else:
+            padded[:, down:down + levels] = v_cur
+        cand = window + (action_mask + reward[t])
+        best = cand.argmax(axis=2)
+        v_cur = np.take(cand, best.ravel() + flat).reshape(n_modes, levels)
+        v_cur += rev[t][:, None]
+        v_cur += state_mask
+        policy[t] = best
+        if t % BLOCK_STEPS == 0:
+            block_mode[t // BLOCK_STEPS] = v_cur.argmax(axis=0)
+            v_block = v_cur.max(axis=0)
+    return policy, block_mode
+
+def _forward_grid(g, policy, block_mode, new_day, k0, budget=None):
+    """
+    Follow the policy of the backward pass from level k0. Returns the level
+    after every step, the energy bought / sold, the mode and the daily
+    throughput. With budget (MWh of throughput per day) a move is shortened
+    to what is left of the day.
+    """
+    n = len(new_day)
+    shifts = g["shifts"].tolist()
+    e_ch_a = g["e_ch"].tolist()
+    e_dis_a = g["e_dis"].tolist()
+    per_ch = g["de"] / g["eta_c"]   # MWh bought per level
+    per_dis = g["de"] * g["eta_d"]  # MWh sold per level
+    new_day = new_day.tolist()
+    level = np.empty(n, dtype=np.int64)
+    e_ch = np.zeros(n)
+    e_dis = np.zeros(n)
+    mode_out = np.empty(n, dtype=np.int64)
+    throughput = []
+    k = k0
+    used = 0.0
+    mode = 0
+    for t in range(n):
+        if new_day[t] and t:
+            throughput.append(used)
+            used = 0.0
+        if t % BLOCK_STEPS == 0:
+            mode = int(block_mode[t // BLOCK_STEPS, k])
+        a = int(policy[t, mode, k])
+        s = shifts[a]
+        ch = e_ch_a[a]
+        dis = e_dis_a[a]
+        if budget is not None and used + ch + dis > budget:
+            left = max(budget - used, 0.0)
+            if s > 0:
+                s = min(s, int(left / per_ch + 1e-9))
+                ch = s * per_ch
+            else:
+                s = -min(-s, int(left / per_dis + 1e-9))
+                dis = -s * per_dis
+        k += s
+        used += ch + dis
+        level[t] = k
+        e_ch[t] = ch
+        e_dis[t] = dis
+        mode_out[t] = mode
+    throughput.append(used)
+    return level, e_ch, e_dis, mode_out, np.array(throughput)
+
+@Profiler.timed("dp")
+def dp_arrays(
+    da, fcr, afrr_pos, afrr_neg, new_day, c_rate, cycles_per_day,
+    eta_rt=0.88, soc_min=0.1, soc_max=0.9, e_nom_mwh=4.472, soc0=0.6, dt_h=0.25,
+    levels=51, modes=RESERVE_MODES, reserve_hours=0.5, iterations=4, tol=0.01
+):
+    """
+    DP dispatch on the arrays of country_arrays. Returns a dict of float64
+    columns named like the Operation trace (same as simulate_arrays) and a
+    dict with the revenue, the penalty of each day (EUR/MWh) and the number
+    of backward passes.
+
+    levels is the size of the SoC grid, iterations the number of backward
+    passes used to adjust the daily penalties (the best dispatch is kept).
+    """
+    da = np.asarray(da, dtype=float)
+    g = _grid(c_rate, levels, eta_rt, soc_min, soc_max, e_nom_mwh, dt_h, modes, reserve_hours)
+    shares = g["shares"] * g["p_max"]  # MW per mode
+    rev = dt_h * (np.outer(fcr, shares[:, 0]) + np.outer(afrr_pos, shares[:, 1]) + np.outer(afrr_neg, shares[:, 2]))
+
+    day = np.cumsum(new_day) - 1
+    day[day < 0] = 0
+    budget = 2 * cycles_per_day * e_nom_mwh  # MWh of throughput per day
+    n_days = int(day[-1]) + 1 if len(day) else 0
+    lam_day = np.zeros(n_days)
+    lo = np.zeros(n_days)
+    hi = np.full(n_days, np.inf)
+    step = max(float(np.std(da)), 1.0) * 0.05
+
+    k0 = int(round((min(max(soc0, soc_min), soc_max) - soc_min) / (g["soc"][1] - g["soc"][0])))
+    steps = np.arange(len(da))
+    best = None
+    done = 0
+    for done in range(1, iterations + 1):
+        policy, block_mode = _backward(g, da, rev, lam_day[day])
+        # dispatch within the budget, the best one over the iterations is kept
+        path = _forward_grid(g, policy, block_mode, new_day, k0, budget)
+        value = np.sum(da * (path[2] - path[1])) + np.sum(rev[steps, path[3]])
+        if best is None or value > best[0]:
+            best = (value, path, lam_day)
+        if done == iterations:
+            break
+        throughput = _forward_grid(g, policy, block_mode, new_day, k0)[-1]
+        over = throughput > budget * (1 + tol)
+        slack = (throughput < budget * (1 - tol)) & (lam_day > 0)
+        if not over.any() and not slack.any():
+            break
+        # bisection on the penalty of every day, doubling until the budget holds
+        lo = np.where(over, lam_day, lo)
+        hi = np.where(slack, lam_day, hi)
+        grow = over & np.isinf(hi)
+        lam_day = np.where(grow, np.where(lam_day > 0, 2 * lam_day, step), lam_day)
+        lam_day = np.where((over | slack) & ~grow, (lo + np.where(np.isinf(hi), lo, hi)) / 2, lam_day)
+
+    value, (level, e_ch, e_dis, mode, _), lam_day = best
+    soc = g["soc"][level]
+    cfcr = shares[mode, 0]
+    cap_pos = shares[mode, 1]
+    cap_neg = shares[mode, 2]
+    return {
+        "Stored energy [MWh]": soc * e_nom_mwh,
+        "SoC [-]": soc,
+        "Charge [MWh]": e_ch,
+        "Discharge [MWh]": e_dis,
+        "Day-ahead buy [MWh]": e_ch.copy(),
+        "Day-ahead sell [MWh]": e_dis.copy(),
+        "FCR Capacity [MW]": cfcr,
+        "aFRR Capacity POS [MW]": cap_pos,
+        "aFRR Capacity NEG [MW]": cap_neg,
+        "Energy revenue [EUR]": e_dis * da - e_ch * da,
+        "Capacity revenue [EUR]": (cfcr * fcr + cap_pos * afrr_pos + cap_neg * afrr_neg) * dt_h,
+    }, {"revenue": float(value), "lambda": lam_day, "iterations": done}
+
+def dp_prepared(arrays, c_rate, cycles_per_day, **kwargs):
+    return dp_arrays(arrays["da"], arrays["fcr"], arrays["pos"], arrays["neg"], arrays["new_day"],
+                     c_rate, cycles_per_day, **kwargs)
+
+def dp_country(da, fcr, afrr, code, c_rate, cycles_per_day, e_nom_mwh=4.472, limit_days=LIMIT_DAYS, **kwargs):
+    """Same inputs and outputs as simulate_country: (Operation frame, yearly profit, p_max)"""
+    index, arrays, _ = prepare_market(da, fcr, afrr, code, limit_days)
+    cols, _ = dp_prepared(arrays, c_rate, cycles_per_day, e_nom_mwh=e_nom_mwh, **kwargs)
+    op, year_profit_scaled = operation_frame(cols, index, limit_days)
+    return op, year_profit_scaled, c_rate * e_nom_mwh
+
+def solver_gap(code="DE", c_rate=0.5, cycles=1.0, n_days=7, time_limit=60.0, mip_gap=1e-4,
+               soc_min=0.1, xls_path=DATA_XLS, out_dir=OUT_DIR / "dp"):
+    """
+    DP against the MIP (Solver) on the first n_days days, one day at a time,
+    both starting empty. Solver has no conversion losses and its own reserve
+    rules: for the gap, the DP runs with the limits of the MIP (power, SoC
+    range, throughput, no losses) and its dispatch is made feasible for the
+    MIP and valued by its objective (repair_schedule). The distance between
+    the MIP objective and the DP revenue on its own model is kept as the
+    model difference. The reserves stay sized by the DP modes (shares of the
+    power, no activation in the SoC), so the gap still includes the reserve
+    rules the DP cannot express.
+    """
+    from methods.Solver import Solver, heuristic_schedule, repair_schedule  # Pyomo, only for this comparison
+    tables = load_tables(xls_path)
+    da = tables["da"].rename(columns={"DE_LU": "DE"})
+    index, arrays, _ = country_arrays(da, tables["fcr"], tables["afrr"], code, n_days)
+    prices = (
+        da[code].tolist(),
+        tables["fcr"][code].tolist(),
+        tables["afrr"][(code, "Pos")].tolist(),
+        tables["afrr"][(code, "Neg")].tolist(),
+    )
+    battery = LUNA2000Battery(cycles_max=cycles)
+    battery.c_rate_max = c_rate
+
+    rows = []
+    steps = Solver.n_quarters
+    for d in range(min(n_days, len(arrays["da"]) // steps)):
+        solver = Solver(battery, *prices, c_rate, cycles, start=d * steps, n_quarters=steps)
+        solver.solve(time_limit=time_limit, mip_gap=mip_gap, verbose=False)
+        solver_objective = solver.objective_value()
+
+        day = {key: arr[d * steps:(d + 1) * steps] for key, arr in arrays.items()}
+        t0 = time.perf_counter()
+        _, info = dp_prepared(day, c_rate, cycles, soc0=soc_min)
+        dp_time = time.perf_counter() - t0
+        # same DP on the limits of the MIP (bounds of Pch / Pdis, budget of charge + discharge counted once)
+        p_move = min(solver.P * solver.C_rate, solver.P, solver.Pnom)
+        cols, _ = dp_prepared(day, p_move / solver.Cap_nom, solver.cycles_max / 2, eta_rt=1.0, soc_min=0.0,
+                              soc_max=1.0, soc0=solver.SoC0, e_nom_mwh=solver.Cap_nom)
+        schedule = heuristic_schedule(pd.DataFrame(cols))
+        schedule["time_step"] += d * steps
+        _, on_mip = repair_schedule(solver, schedule)
+        scale = max(abs(solver_objective), 1e-9)
+        rows.append({
+            "day": str(index[d * steps].date()),
+            "MIP objective [EUR]": solver_objective,
+            "MIP status": solver.status(),
+            "MIP time [s]": solver.solve_time,
+            "DP revenue [EUR]": info["revenue"],
+            "DP on the MIP model [EUR]": on_mip["objective"],
+            "DP time [s]": dp_time,
+            "gap [%]": 100 * (solver_objective - on_mip["objective"]) / scale,
+            "model difference [%]": 100 * (solver_objective - info["revenue"]) / scale,
+        })
+    table = pd.DataFrame(rows)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    table.to_csv(out_dir / f"dp_solver_gap_{code}_{c_rate}_{cycles}.csv", index=False)
+    print(table.to_string(index=False))
+    return table
+
+def run(out_dir=OUT_DIR / "dp", **kwargs):
+    """Same sweep and CSVs as heuristic_method.run, dispatched by dynamic programming"""
+    da, fcr, afrr, avail_countries = load_prices()
+    finance = load_finance()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    prepared = {code: prepare_market(da, fcr, afrr, code, LIMIT_DAYS) for code in COUNTRIES}
+    wacc, infl = _country_rates(finance, COUNTRIES)
+    results = []
+    best = None   # (levelized ROI, columns) of the best trace so far, first one on ties
+    t0 = time.perf_counter()
+    for code, w, i in zip(COUNTRIES, wacc, infl):
+        _, arrays, _ = prepared[code]
+        for c_rate, cycles in CONFIGS:
+            cols, info = dp_prepared(arrays, c_rate, cycles, **kwargs)
+            profit = info["revenue"] * (365 / LIMIT_DAYS)
+            results.append((code, c_rate, cycles, profit, c_rate * 4.472))
+            roi = float(Finance.evaluate(profit, c_rate * 4.472, wacc=float(w), inflation=float(i))["levelized_roi"])
+            if best is None or roi > best[0]:
+                best = (roi, cols)
+    print(f"DP sweep: {len(results)} configurations in {time.perf_counter() - t0:.1f} s")
+
+    cfg, best_tuple = configuration_results(results, finance)
+    ctry, c_rate, cycles, profit, p_max = best_tuple
+    inv_summary, inv_df = investment_tables(ctry, c_rate, cycles, profit, p_max, finance)
+    write_phase1(cfg, inv_summary, inv_df, out_dir)
+
+    # trace of the best configuration, kept by the sweep
+    index, _, _ = prepared[ctry]
+    cols = best[1]
+    with Profiler.stage("csv_write"):
+        pd.DataFrame({name: cols[name] for name in OPERATION_COLUMNS}, index=index.rename("Timestamp")) \
+            .to_csv(out_dir / "TechArena_Phase1_Operation.csv")
+
+    print("Fichiers générés dans", out_dir.resolve())
+    print(cfg.head().to_string(index=False))
@@ -1,12 +1,21 @@
-# main.py
+# heuristic_method.py
 
 import math
+import os
+import shutil
+import tempfile
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+from methods.XLSCache import load_tables
+from methods import Finance, Profiler
+
 # Robust helpers for numeric coercion and stats
 def num_series(s):
     return pd.to_numeric(s, errors="coerce")
@@ -33,76 +42,161 @@ LIMIT_DAYS = 365
 
 warnings.filterwarnings("ignore", category=pd.errors.PerformanceWarning)
 
-def load_prices(xls_path=DATA_XLS):
-    # Day-ahead
-    raw = pd.read_excel(xls_path, sheet_name="Day-ahead prices", header=None)
-    hdr = raw.iloc[1].tolist()
-    cols = ["Timestep"] + hdr[1:6]
-    da_clean = raw.iloc[2:, 0:6]
-    da_clean.columns = cols
-    da_clean["Timestep"] = pd.to_datetime(da_clean["Timestep"])
-    da = da_clean.set_index("Timestep").rename(columns={"DE_LU": "DE"})
-    da = da.apply(num_series)  # <-- coercition numérique
-
-    # FCR
-    raw = pd.read_excel(xls_path, sheet_name="FCR prices", header=None)
-    hdr = raw.iloc[1].tolist()
-    cols = ["Timestep"] + hdr[1:6]
-    fcr_clean = raw.iloc[2:, 0:6]
-    fcr_clean.columns = cols
-    fcr_clean["Timestep"] = pd.to_datetime(fcr_clean["Timestep"])
-    fcr = fcr_clean.set_index("Timestep")
-    fcr = fcr.apply(num_series)  # <-- coercition numérique
-
-    # aFRR capacity
-    raw = pd.read_excel(xls_path, sheet_name="aFRR capacity prices", header=None)
-    countries_row = 1
-    dir_row = 2
-    timestamps_start = 3
-    countries = raw.iloc[countries_row, 1:11].tolist()
-    dirs = raw.iloc[dir_row, 1:11].tolist()
-    mcols = pd.MultiIndex.from_arrays([countries, dirs])
-    afrr_data = raw.iloc[timestamps_start:, [0] + list(range(1, 11))].copy()
-    afrr_data.columns = ["Timestep"] + list(mcols)
-    afrr_data["Timestep"] = pd.to_datetime(afrr_data["Timestep"])
-    afrr = afrr_data.set_index("Timestep")
-
-    # Clean multiindex columns + numeric coercion
-    clean_cols = []
-    c_prec = "UNK"
-    for c, d in afrr.columns:
-        cc = c if isinstance(c, str) else c_prec
-        clean_cols.append((cc, d))
-        c_prec = cc
-
-    afrr.columns = pd.MultiIndex.from_tuples(clean_cols, names=["Country", "Dir"])
-    afrr.sort_index(axis=1, inplace=True)
-    afrr = afrr.apply(num_series)  # <-- global numeric coercion
+def load_prices(xls_path=DATA_XLS, archive=None, start=None, end=None):
+    # archive: PriceArchive directory (or object), the countries are then read
+    # lazily on the [start, end) window instead of loading the workbook
+    if archive is not None:
+        from methods.PriceArchive import open_archive
+        return open_archive(archive).prices(start, end)
+    # cleaned sheets, parsed once and then read back from the columnar cache
+    tables = load_tables(xls_path)
+    da = tables["da"].rename(columns={"DE_LU": "DE"})
+    fcr = tables["fcr"]
+    afrr = tables["afrr"]
     avail_countries = set(afrr.columns.get_level_values(0))
     return da, fcr, afrr, avail_countries
 
-def load_finance(xls_path=DATA_XLS):
-    d = pd.read_excel(xls_path, sheet_name="Data description")
-    t2 = d.iloc[19:29, 0:3].copy()
-    t2.columns = ["Country", "WACC", "Inflation"]
-    t2 = t2.dropna().reset_index(drop=True)
-    t2["Code"] = t2["Country"].str.extract(r"\((\w+)\)").iloc[:, 0]
-    return t2[["Code", "WACC", "Inflation"]]
-
-def simulate_country(
-    da, fcr, afrr, avail_countries, code, c_rate, cycles_per_day,
-    eta_rt=0.88, soc_min=0.1, soc_max=0.9, e_nom_mwh=4.472, limit_days=LIMIT_DAYS
+def load_finance(xls_path=DATA_XLS, archive=None):
+    if archive is not None:
+        from methods.PriceArchive import open_archive
+        return open_archive(archive).finance()
+    return load_tables(xls_path)["finance"]
+
+# Array kernel of the heuristic: every input is an aligned float64 array at 15 min
+def day_starts(index):
+    """Boolean mask of the steps where a new calendar day begins"""
+    days = index.normalize().asi8
+    starts = np.ones(len(days), dtype=bool)
+    starts[1:] = days[1:] != days[:-1]
+    return starts
+
+def simulate_arrays(
+    da, fcr, afrr_pos, afrr_neg, new_day, c_rate, cycles_per_day,
+    fcr_med, afr_pos_med, afr_neg_med, q_low, q_high,
+    eta_rt=0.88, soc_min=0.1, soc_max=0.9, e_nom_mwh=4.472, soc0=0.6, dt_h=0.25, fce0=0.0
 ):
+    """
+    Heuristic dispatch on plain arrays.
+
+    soc0 and fce0 (full cycles already done on the current day) are the state
+    before the first step, so a long period can be simulated piece by piece.
+
+    The reserve bids only depend on the prices and on the SoC factor, so the
+    price tests are done once with numpy. The SoC recursion is the only
+    sequential part and runs on python floats. Returns a dict of float64
+    columns named like the Operation trace.
+    """
     eta_c = math.sqrt(eta_rt)
     eta_d = math.sqrt(eta_rt)
     p_max = c_rate * e_nom_mwh  # MW
-
+    soc_range = soc_max - soc_min
+    n = len(da)
+
+    # reserve allocation (vectorized): FCR takes half of p_max scaled by the
+    # SoC factor, each active aFRR direction takes half of what is left
+    fcr_base = np.where(fcr >= fcr_med, 0.5 * p_max, 0.0)
+    pos_on = afrr_pos > afr_pos_med
+    neg_on = afrr_neg > afr_neg_med
+    avail_share = 1.0 - 0.5 * (pos_on.astype(float) + neg_on.astype(float))
+
+    # python lists are much faster than numpy scalars inside the loop
+    price_l = da.tolist()
+    base_l = fcr_base.tolist()
+    share_l = avail_share.tolist()
+    new_day_l = new_day.tolist()
+
+    # preallocated output columns, idle steps only write the SoC
+    soc_out = [0.0] * n
+    e_ch_out = [0.0] * n
+    e_dis_out = [0.0] * n
+
+    soc = soc0
+    fce_today = fce0
+    for i in range(n):
+        if new_day_l[i]:
+            fce_today = 0.0
+        price = price_l[i]
+        e_headroom = (cycles_per_day - fce_today) * e_nom_mwh
+        do_ch = price <= q_low and soc < soc_max
+        do_dis = price >= q_high and soc > soc_min
+
+        if e_headroom > 0 and (do_ch or do_dis):
+            soc_gap = soc - soc_min
+            soc_factor = (soc_gap if soc_gap > 0 else 0.0) / soc_range
+            e_avail = (p_max - base_l[i] * soc_factor) * share_l[i] * dt_h
+
+            e_ch = 0.0
+            e_dis = 0.0
+            if do_ch:
+                e_ch = e_avail
+                e_room = (soc_max - soc) * e_nom_mwh
+                if e_room < e_ch:
+                    e_ch = e_room
+                if e_headroom < e_ch:
+                    e_ch = e_headroom
+                if e_ch < 0:
+                    e_ch = 0.0
+            if do_dis:
+                e_dis = e_avail
+                e_room = soc_gap * e_nom_mwh
+                if e_room < e_dis:
+                    e_dis = e_room
+                if e_headroom < e_dis:
+                    e_dis = e_headroom
+                if e_dis < 0:
+                    e_dis = 0.0
+
+            soc = soc + (e_ch * eta_c - e_dis / eta_d) / e_nom_mwh
+            if soc < soc_min:
+                soc = soc_min
+            elif soc > soc_max:
+                soc = soc_max
+            fce_today += (e_ch + e_dis) / (2 * e_nom_mwh)
+            e_ch_out[i] = e_ch
+            e_dis_out[i] = e_dis
+
+        soc_out[i] = soc
+
+    soc_out = np.array(soc_out)
+    e_ch_out = np.array(e_ch_out)
+    e_dis_out = np.array(e_dis_out)
+
+    # reserves from the SoC at the start of each step
+    soc_prev = np.empty(n)
+    soc_prev[:1] = soc0
+    soc_prev[1:] = soc_out[:-1]
+    soc_factor = np.maximum(0.0, soc_prev - soc_min) / soc_range
+    cfcr = fcr_base * soc_factor
+    cap_free = 0.5 * (p_max - cfcr)
+    cap_pos = np.where(pos_on, cap_free, 0.0)
+    cap_neg = np.where(neg_on, cap_free, 0.0)
+
+    return {
+        "Stored energy [MWh]": soc_out * e_nom_mwh,
+        "SoC [-]": soc_out,
+        "Charge [MWh]": e_ch_out,
+        "Discharge [MWh]": e_dis_out,
+        "Day-ahead buy [MWh]": e_ch_out.copy(),
+        "Day-ahead sell [MWh]": e_dis_out.copy(),
+        "FCR Capacity [MW]": cfcr,
+        "aFRR Capacity POS [MW]": cap_pos,
+        "aFRR Capacity NEG [MW]": cap_neg,
+        "Energy revenue [EUR]": e_dis_out * da - e_ch_out * da,
+        "Capacity revenue [EUR]": (cfcr * fcr + cap_pos * afrr_pos + cap_neg * afrr_neg) * dt_h,
+    }
+
+@Profiler.timed("resample")
+def country_arrays(da, fcr, afrr, code, limit_days=LIMIT_DAYS):
+    """
+    Align the DA, FCR and aFRR prices of one country on the 15 min DA index.
+    Returns the index, a dict of float64 arrays (da, fcr, pos, neg, new_day)
+    and the thresholds used by the heuristic.
+    """
     # DA prices 15 min
     prices_full = num_series(da[code]).dropna()
     start = prices_full.index.min()
     end = start + pd.Timedelta(days=limit_days)
     prices = prices_full.loc[start:end]
-    dt_h = 0.25
     prices = num_series(prices).dropna()  # sécurise
 
     # FCR 4h -> 15min
@@ -129,219 +223,455 @@ def simulate_country(
     # Resample à 15 min et aligner avec l'index des prix
     afr_pos_15 = afr_pos_series.resample("15min").ffill().reindex(prices.index, method="ffill").fillna(0.0)
     afr_neg_15 = afr_neg_series.resample("15min").ffill().reindex(prices.index, method="ffill").fillna(0.0)
-    
-    rows = []
-    soc = 0.6
-    last_day = None
-    fce_today = 0.0
+
+    arrays = {
+        "da": prices.to_numpy(dtype=float),
+        "fcr": fcr_15.to_numpy(dtype=float),
+        "pos": afr_pos_15.to_numpy(dtype=float),
+        "neg": afr_neg_15.to_numpy(dtype=float),
+        "new_day": day_starts(prices.index),
+    }
 
     # robust thresholds
-    fcr_med     = num_median(fcr_15)
-    afr_pos_med = num_median(afr_pos_15)
-    afr_neg_med = num_median(afr_neg_15)
-    q_low  = num_quantile(prices, 0.30)
-    q_high = num_quantile(prices, 0.70)
-    
-    for ts, price in prices.items():
-        if pd.isna(price):
-            continue
-        day = ts.date()
-        if last_day is None or day != last_day:
-            fce_today = 0.0
-            last_day = day
-
-        # Secured step values
-        cfcr_price    = float(fcr_15.get(ts, 0.0)) or 0.0
-        afr_pos_price = float(afr_pos_15.get(ts, 0.0)) or 0.0
-        afr_neg_price = float(afr_neg_15.get(ts, 0.0)) or 0.0
-
-        # reserves
-        # Coefficient basé sur le SOC
-        soc_available = max(0.0, soc - soc_min)  # SOC disponible au-dessus du minimum
-        soc_range = soc_max - soc_min
-        soc_factor = soc_available / soc_range  # normalisé entre 0 et 1
-
-        # Capacité FCR indexée sur le SOC
-        cfcr_base = min(0.8 * p_max, 0.5 * p_max) if cfcr_price >= fcr_med else 0.0
-        cfcr = cfcr_base * soc_factor
-    
-        cap_pos = min(0.5 * (p_max - cfcr), max(0.0, p_max - cfcr)) if afr_pos_price > afr_pos_med else 0.0
-        cap_neg = min(0.5 * (p_max - cfcr), max(0.0, p_max - cfcr)) if afr_neg_price > afr_neg_med else 0.0
-
-        total_res = cfcr + cap_pos + cap_neg
-        if total_res > p_max and total_res > 0:
-            scale = p_max / total_res
-            cfcr *= scale
-            cap_pos *= scale
-            cap_neg *= scale
-
-        p_avail = max(0.0, p_max - (cfcr + cap_pos + cap_neg))
-
-        # Remaining cycles
-        remaining_fce = max(0.0, cycles_per_day - fce_today)
-        e_headroom = remaining_fce * e_nom_mwh
-
-        # decisions
-        p_ch = 0.0
-        p_dis = 0.0
-        if price <= q_low and soc < soc_max and e_headroom > 0:
-            e_allow = min(p_avail * dt_h, (soc_max - soc) * e_nom_mwh, e_headroom)
-            p_ch = e_allow / dt_h if e_allow > 0 else 0.0
-        if price >= q_high and soc > soc_min and e_headroom > 0:
-            e_allow = min(p_avail * dt_h, (soc - soc_min) * e_nom_mwh, e_headroom)
-            p_dis = e_allow / dt_h if e_allow > 0 else 0.0
-
-        e_ch = p_ch * dt_h
-        e_dis = p_dis * dt_h
-
-        soc = soc + (e_ch * eta_c - e_dis / eta_d) / e_nom_mwh
-        soc = min(max(soc, soc_min), soc_max)
-
-        fce_today += (e_ch + e_dis) / (2 * e_nom_mwh)
-
-        rev_energy = e_dis * price - e_ch * price
-        rev_capacity = (cfcr * cfcr_price + cap_pos * afr_pos_price + cap_neg * afr_neg_price) * dt_h
-          
-        rows.append(
-            {
-                "Timestamp": ts,
-                "Stored energy [MWh]": soc * e_nom_mwh,
-                "SoC [-]": soc,
-                "Charge [MWh]": e_ch,
-                "Discharge [MWh]": e_dis,
-                "Day-ahead buy [MWh]": e_ch,
-                "Day-ahead sell [MWh]": e_dis,
-                "FCR Capacity [MW]": cfcr,
-                "aFRR Capacity POS [MW]": cap_pos,
-                "aFRR Capacity NEG [MW]": cap_neg,
-                "Energy revenue [EUR]": rev_energy,
-                "Capacity revenue [EUR]": rev_capacity,
-            }
-        )
-    
-    op = pd.DataFrame(rows).set_index("Timestamp")
+    stats = {
+        "fcr_med": num_median(fcr_15),
+        "afr_pos_med": num_median(afr_pos_15),
+        "afr_neg_med": num_median(afr_neg_15),
+        "q_low": num_quantile(prices, 0.30),
+        "q_high": num_quantile(prices, 0.70),
+    }
+    return prices.index, arrays, stats
+
+class PreparedMarket:
+    """
+    Aligned 15 min arrays and thresholds of one country (country_arrays),
+    built once and shared by every configuration. The arrays are read-only.
+    Unpacks as (index, arrays, stats).
+    """
+    __slots__ = ("code", "limit_days", "index", "arrays", "stats")
+
+    def __init__(self, code, index, arrays, stats, limit_days=LIMIT_DAYS):
+        for arr in arrays.values():
+            arr.flags.writeable = False
+        self.code = code
+        self.limit_days = limit_days
+        self.index = index
+        self.arrays = arrays
+        self.stats = stats
+
+    def __iter__(self):
+        return iter((self.index, self.arrays, self.stats))
+
+# LRU of the prepared markets, keyed on the price tables (by identity), the
+# country and the period. The tables are kept in the entry so an id is never reused.
+MARKET_CACHE_SIZE = 8
+_market_cache = OrderedDict()
+
+def prepare_market(da, fcr, afrr, code, limit_days=LIMIT_DAYS):
+    """PreparedMarket of one country, from the cache when the same tables were already prepared"""
+    key = (id(da), id(fcr), id(afrr), code, limit_days)
+    entry = _market_cache.get(key)
+    if entry is not None and entry[0] is da and entry[1] is fcr and entry[2] is afrr:
+        _market_cache.move_to_end(key)
+        Profiler.count("market_cache_hit")
+        return entry[3]
+    Profiler.count("market_cache_miss")
+    market = PreparedMarket(code, *country_arrays(da, fcr, afrr, code, limit_days), limit_days=limit_days)
+    _market_cache[key] = (da, fcr, afrr, market)
+    while len(_market_cache) > MARKET_CACHE_SIZE:
+        _market_cache.popitem(last=False)
+    return market
+
+def clear_market_cache():
+    _market_cache.clear()
+
+@Profiler.timed("simulate")
+def simulate_prepared(arrays, stats, c_rate, cycles_per_day, **kwargs):
+    return simulate_arrays(
+        arrays["da"], arrays["fcr"], arrays["pos"], arrays["neg"], arrays["new_day"],
+        c_rate, cycles_per_day,
+        stats["fcr_med"], stats["afr_pos_med"], stats["afr_neg_med"], stats["q_low"], stats["q_high"],
+        **kwargs,
+    )
+
+def operation_frame(cols, index, limit_days=LIMIT_DAYS):
+    """Operation DataFrame and yearly profit from the kernel columns"""
+    op = pd.DataFrame(cols, index=index.rename("Timestamp"))
     op["Total revenue [EUR]"] = op["Energy revenue [EUR]"] + op["Capacity revenue [EUR]"]
     year_profit_scaled = op["Total revenue [EUR]"].sum() * (365 / limit_days)
+    return op, year_profit_scaled
+
+def simulate_country(
+    da, fcr, afrr, avail_countries, code, c_rate, cycles_per_day,
+    eta_rt=0.88, soc_min=0.1, soc_max=0.9, e_nom_mwh=4.472, limit_days=LIMIT_DAYS, market=None
+):
+    # market: PreparedMarket of the country, else taken from the cache (prepare_market)
+    p_max = c_rate * e_nom_mwh  # MW
+    if market is None:
+        market = prepare_market(da, fcr, afrr, code, limit_days)
+    index, arrays, stats = market
+    cols = simulate_prepared(
+        arrays, stats, c_rate, cycles_per_day,
+        eta_rt=eta_rt, soc_min=soc_min, soc_max=soc_max, e_nom_mwh=e_nom_mwh,
+    )
+    op, year_profit_scaled = operation_frame(cols, index, limit_days)
     return op, year_profit_scaled, p_max
 
+# Streaming output: the simulation is run by chunks of CHUNK_STEPS steps and
+# every chunk is handed to a sink, the full trace is never held in memory
+CHUNK_STEPS = 96 * 7
+
+OPERATION_COLUMNS = [
+    "Stored energy [MWh]", "SoC [-]", "Charge [MWh]", "Discharge [MWh]",
+    "Day-ahead buy [MWh]", "Day-ahead sell [MWh]",
+    "FCR Capacity [MW]", "aFRR Capacity POS [MW]", "aFRR Capacity NEG [MW]",
+]
+
+class AggregateSink:
+    """Keeps running totals of the trace only"""
+
+    def __init__(self):
+        self.steps = 0
+        self.totals = {"Energy revenue [EUR]": [], "Capacity revenue [EUR]": [],
+                       "Charge [MWh]": [], "Discharge [MWh]": []}
+
+    def write(self, index, cols):
+        self.steps += len(index)
+        for name, parts in self.totals.items():
+            parts.append(math.fsum(cols[name]))
+
+    def close(self):
+        result = {name: math.fsum(parts) for name, parts in self.totals.items()}
+        result["Total revenue [EUR]"] = result["Energy revenue [EUR]"] + result["Capacity revenue [EUR]"]
+        result["steps"] = self.steps
+        return result
+
+class OperationCSVSink(AggregateSink):
+    """Appends each chunk to the Operation CSV (same format as DataFrame.to_csv) and keeps the totals"""
+
+    def __init__(self, path, columns=OPERATION_COLUMNS):
+        super().__init__()
+        self.columns = columns
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.header = True
+
+    def write(self, index, cols):
+        super().write(index, cols)
+        with Profiler.stage("csv_write"):
+            chunk = pd.DataFrame({name: cols[name] for name in self.columns}, index=index.rename("Timestamp"))
+            chunk.to_csv(self.file, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+        return super().close()
+
+class ColumnSink(AggregateSink):
+    """Keeps the totals and the columns of the trace (one configuration at a time)"""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def write(self, index, cols):
+        super().write(index, cols)
+        self.parts.append(cols)
+
+    def columns(self):
+        return {name: np.concatenate([part[name] for part in self.parts]) for name in self.parts[0]}
+
+def write_operation(cols, index, path, chunk_steps=CHUNK_STEPS):
+    """Operation CSV of kernel columns already computed, by chunks (OperationCSVSink)"""
+    sink = OperationCSVSink(path)
+    for a in range(0, len(index), chunk_steps):
+        sink.write(index[a:a + chunk_steps], {name: col[a:a + chunk_steps] for name, col in cols.items()})
+    return sink.close()
+
+def _chunk_state(cols, new_day, soc, fce, e_nom_mwh):
+    # SoC and full cycles of the day at the end of a chunk
+    if len(new_day) == 0:
+        return soc, fce
+    steps_fce = (cols["Charge [MWh]"] + cols["Discharge [MWh]"]) / (2 * e_nom_mwh)
+    starts = np.flatnonzero(new_day)
+    if len(starts):
+        fce = 0.0
+        steps_fce = steps_fce[starts[-1]:]
+    for x in steps_fce.tolist():
+        fce += x
+    return float(cols["SoC [-]"][-1]), fce
+
+def simulate_stream(arrays, stats, c_rate, cycles_per_day, sink, index, chunk_steps=CHUNK_STEPS,
+                    soc0=0.6, e_nom_mwh=4.472, **kwargs):
+    """
+    Same simulation as simulate_prepared, by chunks of chunk_steps steps
+    written to sink (AggregateSink, OperationCSVSink...). Returns sink.close().
+    """
+    n = len(arrays["da"])
+    soc, fce = soc0, 0.0
+    for a in range(0, n, chunk_steps):
+        b = min(a + chunk_steps, n)
+        part = {key: arr[a:b] for key, arr in arrays.items()}
+        cols = simulate_prepared(part, stats, c_rate, cycles_per_day, soc0=soc, fce0=fce,
+                                 e_nom_mwh=e_nom_mwh, **kwargs)
+        sink.write(index[a:b], cols)
+        soc, fce = _chunk_state(cols, part["new_day"], soc, fce, e_nom_mwh)
+    return sink.close()
+
+# Parallel sweep: the aligned price arrays of every country are written once in
+# a shared memory block, workers only receive (country, c_rate, cycles)
+_shared_arrays = {}
+
+def _share_arrays(prepared):
+    layout = {}
+    offset = 0
+    for code, (_, arrays, _) in prepared.items():
+        for key, arr in arrays.items():
+            layout[(code, key)] = (offset, arr.size, arr.dtype.str)
+            offset += arr.size
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1) * 8)
+    block = np.ndarray((offset,), dtype=np.float64, buffer=shm.buf)
+    for code, (_, arrays, _) in prepared.items():
+        for key, arr in arrays.items():
+            start, size, _ = layout[(code, key)]
+            block[start:start + size] = arr
+    return shm, layout
+
+def _attach_shared(name, layout):
+    shm = shared_memory.SharedMemory(name=name)
+    block = np.ndarray((shm.size // 8,), dtype=np.float64, buffer=shm.buf)
+    _shared_arrays["shm"] = shm  # keep the mapping alive in the worker
+    for (code, key), (start, size, dtype) in layout.items():
+        arr = block[start:start + size]
+        _shared_arrays[(code, key)] = arr if dtype == arr.dtype.str else arr.astype(dtype)
+
+# Best trace of the sweep: every job with `best` computes its levelized ROI and
+# each process keeps the columns of its best job so far (in memory, or in a
+# .npz file of trace_dir for the pool workers), so the Operation trace of the
+# winner is written without simulating it again and only one year of columns
+# is held per process
+_best_trace = {}
+
+def _job_roi(totals, c_rate, e_nom_mwh, limit_days, wacc, infl):
+    profit = totals["Total revenue [EUR]"] * (365 / limit_days)
+    return float(Finance.evaluate(profit, c_rate * e_nom_mwh, wacc=wacc, inflation=infl)["levelized_roi"])
+
+def _keep_best(job, roi, sink, trace_dir):
+    # ties: the first job in the sweep order, like configuration_results
+    key = (roi, -job)
+    if "key" in _best_trace and _best_trace["key"] >= key:
+        return
+    cols = sink.columns()
+    if trace_dir is not None:
+        np.savez(Path(trace_dir) / f"{job}.npz", names=np.array(list(cols)), data=np.column_stack(list(cols.values())))
+        if "job" in _best_trace:
+            os.remove(Path(trace_dir) / f"{_best_trace['job']}.npz")
+        cols = None
+    _best_trace.update(key=key, job=job, cols=cols)
+
+def _aggregate_job(arrays, stats, c_rate, cycles, e_nom_mwh, best=None):
+    # best: (job, limit_days, wacc, inflation, trace_dir) to keep the trace of the best job
+    n = len(arrays["da"])
+    if best is None:
+        return simulate_stream(arrays, stats, c_rate, cycles, AggregateSink(), range(n), e_nom_mwh=e_nom_mwh)
+    job, limit_days, wacc, infl, trace_dir = best
+    sink = ColumnSink()
+    totals = simulate_stream(arrays, stats, c_rate, cycles, sink, range(n), e_nom_mwh=e_nom_mwh)
+    _keep_best(job, _job_roi(totals, c_rate, e_nom_mwh, limit_days, wacc, infl), sink, trace_dir)
+    return totals
+
+def _shared_job(code, stats, c_rate, cycles, e_nom_mwh, best=None):
+    arrays = {key: _shared_arrays[(code, key)] for key in ("da", "fcr", "pos", "neg", "new_day")}
+    return _aggregate_job(arrays, stats, c_rate, cycles, e_nom_mwh, best)
+
+def sweep(da, fcr, afrr, countries, configs, limit_days=LIMIT_DAYS, workers=None, e_nom_mwh=4.472, rates=None,
+          best=None):
+    """
+    Simulate every country x (c_rate, cycles) pair.
+
+    Jobs are spread over a process pool of `workers` processes (None = all
+    cores, 1 = in process). Only the running totals of each trace are kept
+    (AggregateSink). Results are yielded as
+    (code, c_rate, cycles, totals, profit, p_max) in job order, so the output
+    does not depend on the number of workers.
+
+    With rates ({code: (wacc, inflation)}) and a dict best, the columns of
+    the job with the best levelized ROI are kept and put in best ("job":
+    index in the job order, "cols") once the sweep is done.
+    """
+    prepared = {code: prepare_market(da, fcr, afrr, code, limit_days) for code in countries}
+    jobs = [(code, c_rate, cycles) for code in countries for c_rate, cycles in configs]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    keep = rates is not None and best is not None
+    _best_trace.clear()
+
+    def collect(code, c_rate, cycles, totals):
+        profit = totals["Total revenue [EUR]"] * (365 / limit_days)
+        return code, c_rate, cycles, totals, profit, c_rate * e_nom_mwh
+
+    if workers == 1:
+        for job, (code, c_rate, cycles) in enumerate(jobs):
+            _, arrays, stats = prepared[code]
+            keep_job = (job, limit_days, *rates[code], None) if keep else None
+            yield collect(code, c_rate, cycles, _aggregate_job(arrays, stats, c_rate, cycles, e_nom_mwh, keep_job))
+        if keep:
+            best.update(job=_best_trace["job"], cols=_best_trace["cols"])
+            _best_trace.clear()
+        return
+
+    shm, layout = _share_arrays(prepared)
+    trace_dir = tempfile.mkdtemp(prefix="sweep_") if keep else None
+    try:
+        with ProcessPoolExecutor(workers, initializer=_attach_shared, initargs=(shm.name, layout)) as pool:
+            futures = [
+                pool.submit(_shared_job, code, prepared[code].stats, c_rate, cycles, e_nom_mwh,
+                            (job, limit_days, *rates[code], trace_dir) if keep else None)
+                for job, (code, c_rate, cycles) in enumerate(jobs)
+            ]
+            keys = []
+            for job, ((code, c_rate, cycles), fut) in enumerate(zip(jobs, futures)):
+                totals = fut.result()
+                if keep:
+                    keys.append((_job_roi(totals, c_rate, e_nom_mwh, limit_days, *rates[code]), -job))
+                yield collect(code, c_rate, cycles, totals)
+        if keep:
+            # the best job is the best of its worker: its file is there
+            job = -max(keys)[1]
+            with np.load(Path(trace_dir) / f"{job}.npz") as f:
+                best.update(job=job, cols=dict(zip(f["names"].tolist(), f["data"].T)))
+    finally:
+        shm.close()
+        shm.unlink()
+        if trace_dir is not None:
+            shutil.rmtree(trace_dir, ignore_errors=True)
+
 def levelized_roi(
     year_profit_eur, p_max_mw,
     capex_per_mwh=380000, e_nom_mwh=4.472, capex_power_per_mw=200000,
     wacc=0.10, years=10, opex_rate=0.02, inflation=0.02
 ):
-    profit_per_mw = year_profit_eur / p_max_mw if p_max_mw > 0 else 0.0
-    inv = capex_per_mwh * e_nom_mwh + capex_power_per_mw * p_max_mw
-    opex = inv * opex_rate
-    cashflows = []
-    for y in range(1, years + 1):
-        prof = year_profit_eur * (1 + inflation) ** (y - 1)
-        cf = prof - opex
-        disc = cf / ((1 + wacc) ** y)
-        cashflows.append(disc)
-    npv = -inv + sum(cashflows)
-    lvl_roi = npv / inv if inv > 0 else 0.0
-    return profit_per_mw / 1000.0, lvl_roi
-
-def run():
-    da, fcr, afrr, avail_countries = load_prices()
-    finance = load_finance()
-
-    countries = ["DE", "AT", "CH", "CZ", "HU"]
-    configs = [
-        (0.25, 1.0), (0.25, 1.5), (0.25, 2.0),
-        (0.33, 1.0), (0.33, 1.5), (0.33, 2.0),
-        (0.50, 1.0), (0.50, 1.5), (0.50, 2.0),
-    ]
-
-    results = []
-    best = None
-    best_tuple = None
-    best_op = None
-
-    for ctry in countries:
-        for c_rate, cycles in configs:
-            op, profit, p_max = simulate_country(
-                da, fcr, afrr, avail_countries, ctry, c_rate, cycles, limit_days=LIMIT_DAYS
-            )
-            wacc = float(finance.loc[finance["Code"] == ctry, "WACC"].iloc[0])
-            infl = float(finance.loc[finance["Code"] == ctry, "Inflation"].iloc[0])
-            kEUR_MW, lvl_roi = levelized_roi(profit, p_max, wacc=wacc, inflation=infl)
-            results.append(
-                {
-                    "Country": ctry,
-                    "C-rate": c_rate,
-                    "number of cycles": cycles,
-                    "yearly profits [kEUR/MW]": round(kEUR_MW, 2),
-                    "levelized ROI [%]": round(100 * lvl_roi, 2),
-                }
-            )
-            if best is None or lvl_roi > best:
-                best = lvl_roi
-                best_tuple = (ctry, c_rate, cycles)
-                best_op = op
-
-    cfg = pd.DataFrame(results).sort_values(["levelized ROI [%]"], ascending=False)
-
-    # Best case
-    ctry, c_rate, cycles = best_tuple
-    op, profit, p_max = simulate_country(
-        da, fcr, afrr, avail_countries, ctry, c_rate, cycles, limit_days=LIMIT_DAYS
-    )
-    wacc = float(finance.loc[finance["Code"] == ctry, "WACC"].iloc[0])
-    infl = float(finance.loc[finance["Code"] == ctry, "Inflation"].iloc[0])
-
-    capex_per_mwh = 380000
-    e_nom_mwh = 4.472
-    capex_power_per_mw = 200000
-    opex_rate = 0.02
-    years = 10
-
-    inv = capex_per_mwh * e_nom_mwh + capex_power_per_mw * p_max
-    opex = inv * opex_rate
-
-    yearly_rows = []
-    npv = -inv
-    for y in range(1, years + 1):
-        prof = profit * (1 + infl) ** (y - 1)
-        cf = prof - opex
-        disc = cf / ((1 + wacc) ** y)
-        yearly_rows.append(
-            {
-                "Year": y,
-                "Yearly profits [EUR]": prof,
-                "OPEX [EUR]": opex,
-                "Discount factor": 1 / ((1 + wacc) ** y),
-                "Discounted CF [EUR]": disc,
-            }
-        )
-        npv += disc
-    lvl_roi = npv / inv
-    inv_df = pd.DataFrame(yearly_rows)
+    """Yearly profit per MW (kEUR/MW) and levelized ROI of one configuration (see Finance.evaluate for arrays)"""
+    res = Finance.evaluate(year_profit_eur, p_max_mw, wacc=wacc, inflation=inflation, capex_per_mwh=capex_per_mwh,
+                           capex_power_per_mw=capex_power_per_mw, e_nom_mwh=e_nom_mwh, opex_rate=opex_rate,
+                           years=years)
+    return float(res["profit_kEUR_MW"]), float(res["levelized_roi"])
+
+def _country_rates(finance, codes):
+    rates = finance.set_index("Code")[["WACC", "Inflation"]].astype(float)
+    return rates["WACC"].loc[codes].to_numpy(), rates["Inflation"].loc[codes].to_numpy()
+
+def investment_tables(ctry, c_rate, cycles, profit, p_max, finance,
+                      capex_per_mwh=380000, e_nom_mwh=4.472, capex_power_per_mw=200000, opex_rate=0.02, years=10):
+    """Summary row and yearly cash flows of the Investment CSV for one configuration"""
+    (wacc,), (infl,) = _country_rates(finance, [ctry])
+    wacc = float(wacc)
+    infl = float(infl)
+    kwargs = dict(wacc=wacc, inflation=infl, capex_per_mwh=capex_per_mwh, capex_power_per_mw=capex_power_per_mw,
+                  e_nom_mwh=e_nom_mwh, opex_rate=opex_rate, years=years)
+    res = Finance.evaluate(profit, p_max, **kwargs)
+    inv_df = pd.DataFrame(Finance.cash_flows(profit, p_max, **kwargs))
 
     inv_summary = pd.DataFrame(
         [{
             "Country": ctry, "C-rate": c_rate, "number of cycles": cycles,
             "WACC": wacc, "inflation rate": infl, "discount rate": wacc,
-            "CAPEX [EUR]": inv, "OPEX rate": opex_rate, "levelized ROI": lvl_roi
+            "CAPEX [EUR]": float(res["capex"]), "OPEX rate": opex_rate, "levelized ROI": float(res["levelized_roi"])
         }]
     )
+    return inv_summary, inv_df
+
+def configuration_results(sweep_results, finance):
+    """
+    Configuration rows (yearly profits and levelized ROI) of the
+    (code, c_rate, cycles, profit, p_max) results, and the best of them
+    """
+    sweep_results = list(sweep_results)
+    ctry, c_rate, cycles, profit, p_max = (list(col) for col in zip(*sweep_results))
+    wacc, infl = _country_rates(finance, ctry)
+    res = Finance.evaluate(np.array(profit, dtype=float), np.array(p_max, dtype=float), wacc=wacc, inflation=infl)
+    lvl_roi = res["levelized_roi"]
+
+    cfg = pd.DataFrame({
+        "Country": ctry,
+        "C-rate": c_rate,
+        "number of cycles": cycles,
+        "yearly profits [kEUR/MW]": np.round(res["profit_kEUR_MW"], 2),
+        "levelized ROI [%]": np.round(100 * lvl_roi, 2),
+    }).sort_values(["levelized ROI [%]"], ascending=False)
+    # first of the best in the sweep order
+    best_tuple = sweep_results[int(np.argmax(lvl_roi))]
+    return cfg, best_tuple
+
+def write_phase1(cfg, inv_summary, inv_df, out_dir=OUT_DIR):
+    """Configuration and Investment CSVs (the Operation one is written by the method)"""
+    with Profiler.stage("csv_write"):
+        (out_dir / "TechArena_Phase1_Configuration.csv").write_text(
+            cfg[["Country", "C-rate", "number of cycles", "yearly profits [kEUR/MW]", "levelized ROI [%]"]]
+            .to_csv(index=False)
+        )
+        with open(out_dir / "TechArena_Phase1_Investment.csv", "w", encoding="utf-8") as f:
+            f.write(inv_summary.to_csv(index=False))
+            f.write("\n")
+            f.write(inv_df.to_csv(index=False))
+
+COUNTRIES = ["DE", "AT", "CH", "CZ", "HU"]
+CONFIGS = [
+    (0.25, 1.0), (0.25, 1.5), (0.25, 2.0),
+    (0.33, 1.0), (0.33, 1.5), (0.33, 2.0),
+    (0.50, 1.0), (0.50, 1.5), (0.50, 2.0),
+]
+
+def _year_prices(xls_path, archive, start, limit_days):
+    # archive / start: year starting at `start` (default: the first day) of a
+    # PriceArchive instead of the workbook, only that year is read
+    end = None
+    if archive is not None:
+        from methods.PriceArchive import open_archive
+        archive = open_archive(archive)
+        start = archive.start() if start is None else pd.Timestamp(start)
+        end = start + pd.Timedelta(days=limit_days + 1)
+    da, fcr, afrr, avail_countries = load_prices(xls_path, archive=archive, start=start, end=end)
+    return da, fcr, afrr, avail_countries, load_finance(xls_path, archive=archive)
+
+def configurations(countries=COUNTRIES, configs=CONFIGS, xls_path=DATA_XLS, archive=None, start=None,
+                   limit_days=LIMIT_DAYS, workers=None):
+    """Configuration table of the sweep and its best (code, c_rate, cycles, profit, p_max), nothing written"""
+    da, fcr, afrr, _, finance = _year_prices(xls_path, archive, start, limit_days)
+    return configuration_results(
+        ((ctry, c_rate, cycles, profit, p_max) for ctry, c_rate, cycles, _, profit, p_max in sweep(
+            da, fcr, afrr, countries, configs, limit_days=limit_days, workers=workers
+        )),
+        finance,
+    )
 
-    # outputs
-    (OUT_DIR / "TechArena_Phase1_Configuration.csv").write_text(
-        cfg[["Country", "C-rate", "number of cycles", "yearly profits [kEUR/MW]", "levelized ROI [%]"]]
-        .to_csv(index=False)
+def run(workers=None, archive=None, start=None, countries=COUNTRIES, configs=CONFIGS, xls_path=DATA_XLS,
+        out_dir=OUT_DIR, limit_days=LIMIT_DAYS):
+    da, fcr, afrr, _, finance = _year_prices(xls_path, archive, start, limit_days)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    wacc, infl = _country_rates(finance, countries)
+    rates = {code: (float(w), float(i)) for code, w, i in zip(countries, wacc, infl)}
+    best = {}
+    cfg, best_tuple = configuration_results(
+        ((ctry, c_rate, cycles, profit, p_max) for ctry, c_rate, cycles, _, profit, p_max in sweep(
+            da, fcr, afrr, countries, configs, limit_days=limit_days, workers=workers, rates=rates, best=best
+        )),
+        finance,
     )
-    with open(OUT_DIR / "TechArena_Phase1_Investment.csv", "w", encoding="utf-8") as f:
-        f.write(inv_summary.to_csv(index=False))
-        f.write("\n")
-        f.write(inv_df.to_csv(index=False))
-    best_op[
-        ["Stored energy [MWh]", "SoC [-]", "Charge [MWh]", "Discharge [MWh]",
-         "Day-ahead buy [MWh]", "Day-ahead sell [MWh]",
-         "FCR Capacity [MW]", "aFRR Capacity POS [MW]", "aFRR Capacity NEG [MW]"]
-    ].to_csv(OUT_DIR / "TechArena_Phase1_Operation.csv")
-
-    print("Fichiers générés dans", OUT_DIR.resolve())
-    print(" -", OUT_DIR / "output/TechArena_Phase1_Configuration.csv")
-    print(" -", OUT_DIR / "output/TechArena_Phase1_Investment.csv")
-    print(" -", OUT_DIR / "output/TechArena_Phase1_Operation.csv")
+
+    # Best case
+    ctry, c_rate, cycles, profit, p_max = best_tuple
+    if [(code, c, cy) for code in countries for c, cy in configs][best["job"]] != (ctry, c_rate, cycles):
+        raise ValueError(f"The trace kept by the sweep is not the one of the best configuration {best_tuple[:3]}")
+    inv_summary, inv_df = investment_tables(ctry, c_rate, cycles, profit, p_max, finance)
+
+    # outputs
+    write_phase1(cfg, inv_summary, inv_df, out_dir)
+    # the trace of the best configuration, kept by the sweep
+    index, _, _ = prepare_market(da, fcr, afrr, ctry, limit_days)
+    write_operation(best["cols"], index, out_dir / "TechArena_Phase1_Operation.csv")
+
+    print("Fichiers générés dans", out_dir.resolve())
+    print(" -", out_dir / "TechArena_Phase1_Configuration.csv")
+    print(" -", out_dir / "TechArena_Phase1_Investment.csv")
+    print(" -", out_dir / "TechArena_Phase1_Operation.csv")
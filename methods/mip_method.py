@@ -1,4 +1,7 @@
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
@@ -7,73 +10,56 @@ from methods.LUNA2000Battery import *
 from methods.XLSManager import *
 from methods.MarketManager import *
 from methods.Solver import *
+from methods.MatrixSolver import *
+from methods import heuristic_method, Profiler
 
 #############################################
 ## Experimental Optimizer 🦆 (using pyomo) ##
 #############################################
 
+DATA_XLS = "input/TechArena2025_data.xlsx"
+OUT_DIR = os.path.join("output", "experimental")
+
 # backup of log data of the minimization function
-def save_dataframe(df, market_name="default", file_format="csv"):
+def save_dataframe(df, market_name="default", file_format="csv", out_dir=OUT_DIR):
     # Create ouptput folder
-    output_dir = os.path.join("output", "experimental", market_name)
+    output_dir = os.path.join(out_dir, market_name)
     os.makedirs(output_dir, exist_ok=True)
 
     # Define file path
     if file_format == "csv":
         filename = os.path.join(output_dir, f"{market_name}_data.csv")
-        df.to_csv(filename, index=False, encoding="utf-8")
+        with Profiler.stage("csv_write"):
+            df.to_csv(filename, index=False, encoding="utf-8")
     elif file_format == "excel":
         filename = os.path.join(output_dir, f"{market_name}_data.xlsx")
-        df.to_excel(filename, index=False, engine="openpyxl")
+        with Profiler.stage("csv_write"):
+            df.to_excel(filename, index=False, engine="openpyxl")
     else:
         raise ValueError("Format non supporté : choisis 'csv' ou 'excel'")
 
     print(f" DataFrame sauvegardé dans : {filename}")
 
-def experimental_test_solver():
-    
-    my_xls_sheet = xls_sheet("input/TechArena2025_data.xlsx")
-
-    # load market data
-    DE_market = Country_Market(
-        "DE",
-        DA(my_xls_sheet.get_da_prices_dict("DE_LU")),
-        FCR(my_xls_sheet.get_fcr_prices_dict("DE")),
-        AFRR(my_xls_sheet.get_afrr_prices_dict("DE")),
-        8.3,
-        2.0)
-   
-    AT_market = Country_Market(
-        "AT",
-        DA(my_xls_sheet.get_da_prices_dict("AT")),
-        FCR(my_xls_sheet.get_fcr_prices_dict("AT")),
-        AFRR(my_xls_sheet.get_afrr_prices_dict("AT")),
-        8.3,
-        3.30)
-
-    CH_market = Country_Market(
-        "CH",
-        DA(my_xls_sheet.get_da_prices_dict("CH")),
-        FCR(my_xls_sheet.get_fcr_prices_dict("CH")),
-        AFRR(my_xls_sheet.get_afrr_prices_dict("CH")),
-        8.3,
-        0.10)
-
-    CZ_market = Country_Market(
-        "CZ",
-        DA(my_xls_sheet.get_da_prices_dict("CZ")),
-        FCR(my_xls_sheet.get_fcr_prices_dict("CZ")),
-        AFRR(my_xls_sheet.get_afrr_prices_dict("CZ")),
-        12,
-        2.90)
-
-    HU_market = Country_Market(
-        "HU",
-        DA(my_xls_sheet.get_da_prices_dict("HU")),
-        FCR(my_xls_sheet.get_fcr_prices_dict("HU")),
-        AFRR(my_xls_sheet.get_afrr_prices_dict("HU")),
-        15,
-        4.60)
+def experimental_test_solver(formulation="milp", archive=None, start=None, budget_s=None, mip_gap=None,
+                             xls_path=DATA_XLS, out_dir=OUT_DIR):
+    # only the DE market is solved: it is the only one loaded. With a
+    # PriceArchive (archive / start), only the solved day is read from disk
+    if archive is not None:
+        from methods.PriceArchive import open_archive
+        archive = open_archive(archive)
+        start = archive.start() if start is None else pd.Timestamp(start)
+        DE_market = archive.country_market("DE", start, start + pd.Timedelta(days=1), 8.3, 2.0)
+    else:
+        my_xls_sheet = xls_sheet(xls_path)
+
+        # load market data
+        DE_market = Country_Market(
+            "DE",
+            DA(my_xls_sheet.get_da_prices_dict("DE_LU")),
+            FCR(my_xls_sheet.get_fcr_prices_dict("DE")),
+            AFRR(my_xls_sheet.get_afrr_prices_dict("DE")),
+            8.3,
+            2.0)
 
     print("Market data are loaded successfully")
 
@@ -84,15 +70,194 @@ def experimental_test_solver():
     afrr = DE_market.get_afrr()
     
     # Initialize data (For DE market)
-    my_solver = Solver(battery1,DE_market.get_da_prices(),DE_market.get_fcr_prices(),DE_market.get_afrr_prices('Pos'),DE_market.get_afrr_prices('Neg'))
-    # Resolve the problem
-    my_solver.solve()
+    my_solver = Solver(battery1,DE_market.get_da_prices(),DE_market.get_fcr_prices(),DE_market.get_afrr_prices('Pos'),DE_market.get_afrr_prices('Neg'),
+                       formulation=formulation)
+    # Resolve the problem (budget_s / mip_gap: stops at the deadline or the gap, progress printed)
+    if budget_s is None and mip_gap is None:
+        my_solver.solve()
+    else:
+        deadline = None if budget_s is None else time.time() + budget_s
+        result = anytime_solve(my_solver, deadline=deadline, gap=mip_gap, on_progress=print_progress)
+        print(f"{result['status']}: objective {result['objective']}, bound {result['bound']}, gap {result['gap']}")
+        if result["schedule"] is None:
+            raise ValueError(f"No feasible schedule found within {budget_s} s")
     # Display the result
     df_result = my_solver.print_result()
-    save_dataframe(df_result,"DE_market_data")
+    save_dataframe(df_result,"DE_market_data", out_dir=out_dir)
     
     print(" All output files generated successfully!")
 
 
-def run ():
-    experimental_test_solver()
+#############################################
+## Full year with a rolling horizon        ##
+#############################################
+
+# DA column of each country in the input workbook
+DA_COLUMNS = {"DE": "DE_LU", "AT": "AT", "CH": "CH", "CZ": "CZ", "HU": "HU"}
+
+# model builders: Pyomo expressions or direct CSR matrix
+BACKENDS = {"pyomo": Solver, "matrix": MatrixSolver}
+
+YEAR_CONFIGS = [
+    (0.25, 1.0), (0.25, 1.5), (0.25, 2.0),
+    (0.33, 1.0), (0.33, 1.5), (0.33, 2.0),
+    (0.50, 1.0), (0.50, 1.5), (0.50, 2.0),
+]
+
+def _year_job(c_rate, cycles, prices, options, backend, warm_start=None, budget_s=None):
+    # budget_s: solver time of the whole job, counted from its start
+    battery = LUNA2000Battery(cycles_max=cycles)
+    battery.c_rate_max = c_rate
+    deadline = None if budget_s is None else time.time() + budget_s
+    return rolling_horizon(battery, *prices, solver_class=BACKENDS[backend], warm_start=warm_start,
+                           deadline=deadline, **options)
+
+def _country_prices(my_xls_sheet, code):
+    # DA, FCR, aFRR POS, aFRR NEG lists of one country
+    afrr = my_xls_sheet.get_afrr_prices_dict(code)
+    return (
+        list(my_xls_sheet.get_da_prices_dict(DA_COLUMNS[code]).values()),
+        list(my_xls_sheet.get_fcr_prices_dict(code).values()),
+        list(afrr['Pos'].values()),
+        list(afrr['Neg'].values()),
+    )
+
+def _heuristic_starts(countries, configs, xls_path, archive=None, start=None, end=None):
+    # heuristic schedule of every country / configuration, used as warm start
+    da, fcr, afrr, avail = heuristic_method.load_prices(xls_path, archive, start, end)
+    starts = {}
+    for code in countries:
+        for c_rate, cycles in configs:
+            op, _, _ = heuristic_method.simulate_country(da, fcr, afrr, avail, code, c_rate, cycles)
+            starts[code, c_rate, cycles] = heuristic_schedule(op)
+    return starts
+
+def run_year(countries=("DE", "AT", "CH", "CZ", "HU"), configs=YEAR_CONFIGS, workers=None,
+             window_days=1, overlap_days=1, n_days=None, time_limit=2.0, mip_gap=0.01,
+             backend="matrix", warm_start=False, formulation="milp", xls_path=DATA_XLS,
+             archive=None, start=None, end=None, budget_s=None, out_dir=OUT_DIR):
+    """
+    Full-year MIP: every country / configuration is solved with a rolling
+    horizon in its own process. Writes the schedule and the per-window report
+    of each job and returns the summary table. time_limit and mip_gap apply to
+    each window, the reached gap is reported per window. backend is "pyomo"
+    or "matrix" (same LP, built without Pyomo). warm_start=True starts every
+    window from the repaired heuristic schedule of the same configuration.
+    formulation is a key of FORMULATIONS (Solver.py). archive (a PriceArchive
+    directory) replaces the workbook, only [start, end) of the countries of
+    the run is read. budget_s is a wall-clock budget per country /
+    configuration, shared between its windows.
+    """
+    get_formulation(formulation)
+    if archive is not None:
+        from methods.PriceArchive import open_archive
+        archive = open_archive(archive)
+        prices = {code: tuple(p.tolist() for p in archive.country_prices(code, start, end)) for code in countries}
+    else:
+        my_xls_sheet = xls_sheet(xls_path)
+        prices = {code: _country_prices(my_xls_sheet, code) for code in countries}
+    starts = _heuristic_starts(countries, configs, xls_path, archive, start, end) if warm_start else {}
+    options = dict(window_days=window_days, overlap_days=overlap_days, n_days=n_days,
+                   time_limit=time_limit, mip_gap=mip_gap, formulation=formulation)
+
+    jobs = [(code, c_rate, cycles) for code in countries for c_rate, cycles in configs]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    if workers == 1:
+        results = [_year_job(c_rate, cycles, prices[code], options, backend, starts.get((code, c_rate, cycles)), budget_s)
+                   for code, c_rate, cycles in jobs]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_year_job, c_rate, cycles, prices[code], options, backend, starts.get((code, c_rate, cycles)),
+                                   budget_s)
+                       for code, c_rate, cycles in jobs]
+            results = [f.result() for f in futures]
+
+    summary = []
+    for (code, c_rate, cycles), (schedule, objective, report) in zip(jobs, results):
+        name = f"year_{code}_{c_rate}_{cycles}"
+        save_dataframe(schedule, name, out_dir=out_dir)
+        save_dataframe(report, name + "_windows", out_dir=out_dir)
+        summary.append({
+            "Country": code,
+            "C-rate": c_rate,
+            "number of cycles": cycles,
+            "days": int(report["days_kept"].sum()),
+            "objective [EUR]": objective,
+            "windows": len(report),
+            "solve time [s]": report["solve_time_s"].sum(),
+            "max window time [s]": report["solve_time_s"].max(),
+            "max MIP gap": report["mip_gap"].max(),
+        })
+    summary = pd.DataFrame(summary)
+    save_dataframe(summary, "year_summary", out_dir=out_dir)
+    print(summary.to_string(index=False))
+    return summary
+
+def warm_start_report(code="DE", c_rate=0.5, cycles=1.0, n_days=7, window_days=1, overlap_days=1,
+                      time_limit=2.0, mip_gap=0.01, backend="matrix", xls_path=DATA_XLS):
+    """
+    Same rolling horizon solved cold and warm-started from the heuristic:
+    time to the first incumbent, final gap and objective of every window.
+    """
+    prices = _country_prices(xls_sheet(xls_path), code)
+    start = _heuristic_starts([code], [(c_rate, cycles)], xls_path)[code, c_rate, cycles]
+    options = dict(window_days=window_days, overlap_days=overlap_days, n_days=n_days,
+                   time_limit=time_limit, mip_gap=mip_gap)
+    _, cold_obj, cold = _year_job(c_rate, cycles, prices, options, backend)
+    _, warm_obj, warm = _year_job(c_rate, cycles, prices, options, backend, start)
+
+    report = pd.DataFrame({
+        "window": cold["window"],
+        "heuristic objective": warm["warm_start_objective"],
+        "cold first incumbent [s]": cold["first_incumbent_s"],
+        "warm first incumbent [s]": warm["first_incumbent_s"],
+        "cold gap": cold["mip_gap"],
+        "warm gap": warm["mip_gap"],
+        "cold objective": cold["window_objective"],
+        "warm objective": warm["window_objective"],
+    })
+    save_dataframe(report, f"warm_start_{code}_{c_rate}_{cycles}")
+    print(report.to_string(index=False))
+    print(f"Total objective: cold {cold_obj:.2f} EUR, warm {warm_obj:.2f} EUR")
+    return report
+
+def formulation_benchmark(countries=("DE", "AT", "CH", "CZ", "HU"), formulations=tuple(FORMULATIONS),
+                          c_rate=0.5, cycles=1.0, n_days=7, time_limit=2.0, mip_gap=0.01, backend="matrix",
+                          xls_path=DATA_XLS, out_dir=OUT_DIR):
+    """Objective and solve time of every formulation on the same days of each country"""
+    my_xls_sheet = xls_sheet(xls_path)
+    options = dict(n_days=n_days, time_limit=time_limit, mip_gap=mip_gap)
+    rows = []
+    for code in countries:
+        prices = _country_prices(my_xls_sheet, code)
+        for formulation in formulations:
+            _, objective, report = _year_job(c_rate, cycles, prices, dict(options, formulation=formulation), backend)
+            blocks = report["days_solved"].sum() * Solver.n_quarters // Solver.quarters_per_block
+            repaired = report["repaired_blocks"].fillna(0).sum()
+            rows.append({
+                "Country": code,
+                "formulation": formulation,
+                "objective [EUR]": objective,
+                "solve time [s]": report["solve_time_s"].sum(),
+                "max MIP gap": report["mip_gap"].max(),
+                "windows repaired": int((report["repaired_blocks"].fillna(0) > 0).sum()),
+                "blocks repaired [%]": 100 * repaired / blocks,
+            })
+    table = pd.DataFrame(rows)
+    save_dataframe(table, "formulation_benchmark", out_dir=out_dir)
+    print(table.to_string(index=False))
+    return table
+
+def run (year=False, formulation="milp", benchmark=False, budget_s=None, mip_gap=None, countries=None,
+         configs=YEAR_CONFIGS, xls_path=DATA_XLS, out_dir=OUT_DIR, archive=None, start=None):
+    # countries / configs: full year (and benchmark countries), the test day is DE only
+    if benchmark:
+        formulation_benchmark(**({} if countries is None else {"countries": countries}), xls_path=xls_path,
+                              out_dir=out_dir)
+    elif year:
+        run_year(**({} if countries is None else {"countries": countries}), configs=configs, formulation=formulation,
+                 budget_s=budget_s, xls_path=xls_path, out_dir=out_dir, archive=archive, start=start,
+                 **({} if mip_gap is None else {"mip_gap": mip_gap}))
+    else:
+        experimental_test_solver(formulation, archive=archive, start=start, budget_s=budget_s, mip_gap=mip_gap,
+                                 xls_path=xls_path, out_dir=out_dir)
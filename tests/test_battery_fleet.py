@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from methods.BatteryFleet import BatteryFleet
+from methods.Degradation import StressModel
+from methods.LUNA2000Battery import LUNA2000Battery
+
+def test_day_per_unit_is_billed_for_the_active_units():
+    fleet = BatteryFleet(3)
+    fleet.charge(price=50, day=np.array([1, 2, 3]), active=[True, False, True], period=np.array([0, 1, 2]))
+    assert fleet.balance[1] == 0
+    assert fleet.balance[2] == pytest.approx(3 * fleet.balance[0])
+    assert fleet.billing.count() == 2
+    assert fleet.billing.total() == pytest.approx(fleet.balance.sum())
+    assert fleet.billing.total(period=1) == 0
+
+def test_rainflow_battery_is_rejected():
+    with pytest.raises(ValueError):
+        BatteryFleet.from_battery(LUNA2000Battery(degradation=StressModel()), 2)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from methods.Billing import Billing
+
+class ReferenceBilling:
+    """Former ledger: one dict per transaction"""
+
+    def __init__(self):
+        self.current_billing = 0
+        self.transaction_history = []
+
+    def _add(self, type, current_price, montant):
+        self.current_billing += montant
+        self.transaction_history.append({"type": type, "price": current_price, "amount": montant,
+                                         "balance": self.current_billing})
+        return self.transaction_history[-1]
+
+    def buy(self, current_price, puissance, n=1):
+        return self._add("buy", current_price, -(current_price * puissance * n))
+
+    def sell(self, current_price, puissance, n=1):
+        return self._add("sell", current_price, current_price * puissance * n)
+
+def transactions(k=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2, k), rng.normal(80, 30, k), rng.uniform(0, 2, k), rng.integers(0, 12, k)
+
+def fill(billing, reference, kinds, prices, powers, periods):
+    for kind, price, power, period in zip(kinds.tolist(), prices.tolist(), powers.tolist(), periods.tolist()):
+        if kind:
+            row = billing.sell(price, power, period=period)
+            assert row == reference.sell(price, power)
+        else:
+            row = billing.buy(price, power, period=period)
+            assert row == reference.buy(price, power)
+
+def test_matches_the_former_ledger():
+    billing, reference = Billing(), ReferenceBilling()
+    kinds, prices, powers, periods = transactions()
+    fill(billing, reference, kinds, prices, powers, periods)
+    assert billing.transaction_history == reference.transaction_history
+    assert billing.current_billing == reference.current_billing
+    amounts = pd.DataFrame(reference.transaction_history)["amount"]
+    assert billing.total() == pytest.approx(amounts.sum(), rel=1e-12)
+    assert billing.total("buy") == pytest.approx(amounts[kinds == 0].sum(), rel=1e-12)
+    assert billing.count("sell", period=3) == np.sum((kinds == 1) & (periods == 3))
+    assert billing.total("sell", period=3) == pytest.approx(amounts[(kinds == 1) & (periods == 3)].sum(), rel=1e-12)
+
+def test_history_frame():
+    billing, reference = Billing(capacity=4), ReferenceBilling()
+    kinds, prices, powers, periods = transactions(500, seed=1)
+    fill(billing, reference, kinds, prices, powers, periods)
+    history = billing.get_history()
+    # the former frame, with the type as a categorical and the period added
+    expected = pd.DataFrame(reference.transaction_history)
+    expected["type"] = pd.Categorical(expected["type"], categories=["buy", "sell"])
+    pd.testing.assert_frame_equal(history.drop(columns="period"), expected)
+    assert history["period"].tolist() == periods.tolist()
+
+def test_vectorized_matches_scalar():
+    kinds, prices, powers, periods = transactions(1000, seed=2)
+    scalar, vector = Billing(), Billing()
+    fill(scalar, ReferenceBilling(), kinds, prices, powers, periods)
+    for i in range(len(kinds)):
+        many = vector.sell_many if kinds[i] else vector.buy_many
+        many(prices[i:i + 1], powers[i:i + 1], periods=periods[i:i + 1])
+    pd.testing.assert_frame_equal(vector.get_history(), scalar.get_history())
+
+def test_spill_round_trip(tmp_path):
+    kinds, prices, powers, periods = transactions(20000, seed=3)
+    ram, spilled = Billing(), Billing(capacity=16, spill_dir=tmp_path)
+    for billing in (ram, spilled):
+        fill(billing, ReferenceBilling(), kinds, prices, powers, periods)
+    spilled.flush()
+    history = spilled.get_history()
+    pd.testing.assert_frame_equal(history.copy(deep=True), ram.get_history())
+    # the files hold the columns, reread from disk
+    n = len(spilled)
+    for name, dtype in Billing.columns.items():
+        on_disk = np.memmap(tmp_path / f"{name}.bin", dtype=dtype, mode="r")[:n]
+        np.testing.assert_array_equal(on_disk, ram.get_history()[name].cat.codes if name == "type"
+                                      else ram.get_history()[name])
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from methods.Degradation import Rainflow, StressModel, trace_degradation
+
+def reference_cycles(series):
+    """Plain ASTM E1049 rainflow on the whole series: list of (range, count)"""
+    reversals = []
+    for x in series:
+        if reversals and x == reversals[-1]:
+            continue
+        if len(reversals) >= 2 and (x - reversals[-1]) * (reversals[-1] - reversals[-2]) > 0:
+            reversals[-1] = x
+        else:
+            reversals.append(x)
+    cycles = []
+    stack = []
+    for x in reversals:
+        stack.append(x)
+        while len(stack) >= 3:
+            x_range = abs(stack[-1] - stack[-2])
+            y_range = abs(stack[-2] - stack[-3])
+            if x_range < y_range:
+                break
+            if len(stack) == 3:
+                cycles.append((y_range, 0.5))
+                del stack[0]
+            else:
+                cycles.append((y_range, 1.0))
+                del stack[-3:-1]
+    cycles += [(abs(a - b), 0.5) for a, b in zip(stack, stack[1:])]
+    return cycles
+
+# damage = sum of count * range ** 2 (with a linear law, pairing two half
+# cycles into a full one would not change the damage)
+SQUARE = StressModel(cycle_life=1, dod_exponent=2.0)
+
+def test_last_point_closes_a_full_cycle():
+    result = Rainflow(SQUARE).update([0.2, 0.8, 0.4, 0.6, 0.1]).result()
+    # full 0.4-0.6 cycle, then half cycles 0.2-0.8 and 0.8-0.1
+    assert result["cycles"] == pytest.approx(2.0)
+    assert result["damage"] == pytest.approx(0.2 ** 2 + 0.5 * 0.6 ** 2 + 0.5 * 0.7 ** 2)
+    assert result["residue"] == 2
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    soc = np.round(rng.random(rng.integers(2, 300)), 2)
+    ref = reference_cycles(soc.tolist())
+    whole = Rainflow(SQUARE).update(soc).result()
+    assert whole["damage"] == pytest.approx(sum(r ** 2 * c for r, c in ref), abs=1e-12)
+    assert whole["cycles"] == pytest.approx(sum(c for _, c in ref))
+
+    chunked = Rainflow(SQUARE)
+    for part in np.array_split(soc, 7):
+        chunked.update(part)
+    assert chunked.result()["damage"] == pytest.approx(whole["damage"], abs=1e-12)
+    assert chunked.result()["cycles"] == whole["cycles"]
+
+def test_result_does_not_change_the_counter():
+    rf = Rainflow(SQUARE).update([0.2, 0.8, 0.4, 0.6])
+    rf.result()
+    rf.update([0.1, 0.9])
+    ref = reference_cycles([0.2, 0.8, 0.4, 0.6, 0.1, 0.9])
+    assert rf.result()["damage"] == pytest.approx(sum(r ** 2 * c for r, c in ref))
+
+def test_capacity_fade():
+    model = StressModel(cycle_life=1000, dod_exponent=1.0, eol_capacity=0.8)
+    # 500 full cycles of 0.1-0.9
+    soc = np.tile([0.1, 0.9], 501)
+    result = trace_degradation(soc, model, years=0.0)
+    assert result["cycles"] == pytest.approx(500.5)
+    assert result["capacity"] == pytest.approx(1.0 - 0.2 * 0.8 * 500.5 / 1000)
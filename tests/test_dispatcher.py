@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from methods.Dispatcher import Dispatcher, QUARTERS_PER_BLOCK
+from methods.LUNA2000Battery import LUNA2000Battery
+from methods.SyntheticData import synthetic_prices
+
+TIME_LIMIT = 0.3
+MARGIN = 0.15  # python work around the solves (bounds, repair, schedule)
+
+def dispatcher(days=2, horizon_hours=8):
+    prices = synthetic_prices(days=days, n_countries=1, seed=5)
+    battery = LUNA2000Battery(cycles_max=1.0)
+    return Dispatcher(battery, prices["da"]["DE_LU"], prices["fcr"]["DE"], prices["afrr_pos"]["DE"],
+                      prices["afrr_neg"]["DE"], horizon_hours=horizon_hours, time_limit=TIME_LIMIT)
+
+@pytest.fixture(scope="module")
+def replay():
+    # one day, the measured SoC is the planned one; block 2 sold beforehand
+    d = dispatcher()
+    d.commit(2, fcr=0.3, pos=0.0, neg=0.0)
+    rows = []
+    soc = 0.5
+    for t in range(96):
+        row = d.step(t, soc)
+        soc = row["SoC"]
+        rows.append(row)
+    return d, rows
+
+def test_no_cycle_exceeds_the_time_limit(replay):
+    _, rows = replay
+    assert max(row["latency_s"] for row in rows) <= TIME_LIMIT + MARGIN
+
+def test_decisions_are_feasible(replay):
+    d, rows = replay
+    pmax = d.Pmax
+    for row in rows:
+        assert 0.0 <= row["SoC"] <= 1.0
+        assert 0.0 <= row["P_charge_MW"] <= pmax + 1e-9 and 0.0 <= row["P_discharge_MW"] <= pmax + 1e-9
+        assert min(row["P_charge_MW"], row["P_discharge_MW"]) <= 1e-9
+    # one set of reserves per block, the ones of its first quarter
+    for t, row in enumerate(rows):
+        first = rows[t - t % QUARTERS_PER_BLOCK]
+        assert all(row[key] == first[key] for key in ("R_FCR", "R_AFRR_pos", "R_AFRR_neg"))
+
+def test_committed_reserves_are_kept(replay):
+    d, rows = replay
+    block = rows[2 * QUARTERS_PER_BLOCK:3 * QUARTERS_PER_BLOCK]
+    assert all(row["R_FCR"] == pytest.approx(0.3) and row["R_AFRR_pos"] == 0 for row in block)
+    assert d.committed[2] == (0.3, 0.0, 0.0)
+
+def test_idle_without_incumbent(monkeypatch):
+    d = dispatcher()
+    d.commit(0, fcr=0.2)
+    monkeypatch.setattr(d.solver, "feasible", lambda: False)
+    row = d.step(0, 0.42)
+    assert (row["P_charge_MW"], row["P_discharge_MW"], row["SoC"]) == (0.0, 0.0, 0.42)
+    assert (row["R_FCR"], row["R_AFRR_pos"], row["R_AFRR_neg"]) == (0.2, 0.0, 0.0)
+    assert np.isnan(row["objective"])
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from methods.Finance import CAPEX_PER_MWH, CAPEX_POWER_PER_MW, E_NOM_MWH, OPEX_RATE, evaluate, evaluate_yearly
+
+# (wacc, inflation), the last two with inflation == wacc (geometric ratio of 1)
+RATES = [(0.10, 0.02), (0.05, 0.0), (0.08, 0.03), (0.06, 0.06), (0.0, 0.0)]
+
+def reference_npv(yearly_profits, p_max, wacc, inflation):
+    """Year by year discounting, profits in prices of the first year"""
+    capex = CAPEX_PER_MWH * E_NOM_MWH + CAPEX_POWER_PER_MW * p_max
+    npv = -capex
+    for year, profit in enumerate(yearly_profits, start=1):
+        npv += (profit * (1 + inflation) ** (year - 1) - capex * OPEX_RATE) / (1 + wacc) ** year
+    return npv, capex
+
+@pytest.mark.parametrize("wacc, inflation", RATES)
+@pytest.mark.parametrize("years", [1, 10, 15])
+def test_closed_form_matches_the_loop(wacc, inflation, years):
+    npv, capex = reference_npv([3e5] * years, 2.2, wacc, inflation)
+    result = evaluate(3e5, 2.2, wacc=wacc, inflation=inflation, years=years)
+    assert result["npv"] == pytest.approx(npv, rel=1e-12)
+    assert result["levelized_roi"] == pytest.approx(npv / capex, rel=1e-12)
+
+@pytest.mark.parametrize("wacc, inflation", RATES)
+def test_yearly_matches_the_loop(wacc, inflation):
+    profits = 3e5 * 0.97 ** np.arange(12)
+    npv, _ = reference_npv(profits, 1.1, wacc, inflation)
+    assert evaluate_yearly(profits, 1.1, wacc=wacc, inflation=inflation)["npv"] == pytest.approx(npv, rel=1e-12)
+
+def test_grid_matches_the_scalars():
+    wacc = np.array([0.05, 0.06, 0.10])[:, None]
+    inflation = np.array([0.0, 0.06])
+    npv = evaluate(3e5, 2.2, wacc=wacc, inflation=inflation)["npv"]
+    assert npv.shape == (3, 2)
+    for i, w in enumerate(wacc[:, 0].tolist()):
+        for j, infl in enumerate(inflation.tolist()):
+            assert npv[i, j] == pytest.approx(reference_npv([3e5] * 10, 2.2, w, infl)[0], rel=1e-12)
@@ -0,0 +1,121 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from methods.heuristic_method import (
+    OPERATION_COLUMNS, ColumnSink, country_arrays, simulate_prepared, simulate_stream,
+)
+from methods.MonteCarlo import simulate_batch
+from methods.OnlineHeuristic import OnlineHeuristic
+from methods.SyntheticData import synthetic_prices
+
+DAYS = 21
+CONFIGS = [(0.25, 1.0), (0.5, 2.0), (1.0, 1.5)]
+
+@pytest.fixture(scope="module")
+def market():
+    prices = synthetic_prices(days=DAYS, n_countries=1, seed=3)
+    da = prices["da"].rename(columns={"DE_LU": "DE"})
+    afrr = pd.concat({("DE", "Pos"): prices["afrr_pos"]["DE"], ("DE", "Neg"): prices["afrr_neg"]["DE"]}, axis=1)
+    return country_arrays(da, prices["fcr"], afrr, "DE", DAYS)
+
+def reference_dispatch(arrays, stats, c_rate, cycles_per_day, eta_rt=0.88, soc_min=0.1, soc_max=0.9,
+                       e_nom_mwh=4.472, dt_h=0.25):
+    """Step by step loop of the former simulate_country, on the aligned arrays"""
+    eta_c = math.sqrt(eta_rt)
+    eta_d = math.sqrt(eta_rt)
+    p_max = c_rate * e_nom_mwh
+    rows = []
+    soc = 0.6
+    fce_today = 0.0
+    for i, price in enumerate(arrays["da"].tolist()):
+        if arrays["new_day"][i]:
+            fce_today = 0.0
+        cfcr_price = float(arrays["fcr"][i])
+        afr_pos_price = float(arrays["pos"][i])
+        afr_neg_price = float(arrays["neg"][i])
+
+        soc_factor = max(0.0, soc - soc_min) / (soc_max - soc_min)
+        cfcr_base = min(0.8 * p_max, 0.5 * p_max) if cfcr_price >= stats["fcr_med"] else 0.0
+        cfcr = cfcr_base * soc_factor
+        cap_pos = min(0.5 * (p_max - cfcr), max(0.0, p_max - cfcr)) if afr_pos_price > stats["afr_pos_med"] else 0.0
+        cap_neg = min(0.5 * (p_max - cfcr), max(0.0, p_max - cfcr)) if afr_neg_price > stats["afr_neg_med"] else 0.0
+        total_res = cfcr + cap_pos + cap_neg
+        if total_res > p_max and total_res > 0:
+            scale = p_max / total_res
+            cfcr *= scale
+            cap_pos *= scale
+            cap_neg *= scale
+        p_avail = max(0.0, p_max - (cfcr + cap_pos + cap_neg))
+        e_headroom = max(0.0, cycles_per_day - fce_today) * e_nom_mwh
+
+        p_ch = 0.0
+        p_dis = 0.0
+        if price <= stats["q_low"] and soc < soc_max and e_headroom > 0:
+            e_allow = min(p_avail * dt_h, (soc_max - soc) * e_nom_mwh, e_headroom)
+            p_ch = e_allow / dt_h if e_allow > 0 else 0.0
+        if price >= stats["q_high"] and soc > soc_min and e_headroom > 0:
+            e_allow = min(p_avail * dt_h, (soc - soc_min) * e_nom_mwh, e_headroom)
+            p_dis = e_allow / dt_h if e_allow > 0 else 0.0
+        e_ch = p_ch * dt_h
+        e_dis = p_dis * dt_h
+        soc = min(max(soc + (e_ch * eta_c - e_dis / eta_d) / e_nom_mwh, soc_min), soc_max)
+        fce_today += (e_ch + e_dis) / (2 * e_nom_mwh)
+        rows.append({
+            "Stored energy [MWh]": soc * e_nom_mwh,
+            "SoC [-]": soc,
+            "Charge [MWh]": e_ch,
+            "Discharge [MWh]": e_dis,
+            "Day-ahead buy [MWh]": e_ch,
+            "Day-ahead sell [MWh]": e_dis,
+            "FCR Capacity [MW]": cfcr,
+            "aFRR Capacity POS [MW]": cap_pos,
+            "aFRR Capacity NEG [MW]": cap_neg,
+            "Energy revenue [EUR]": e_dis * price - e_ch * price,
+            "Capacity revenue [EUR]": (cfcr * cfcr_price + cap_pos * afr_pos_price + cap_neg * afr_neg_price) * dt_h,
+        })
+    return pd.DataFrame(rows)
+
+@pytest.mark.parametrize("c_rate, cycles", CONFIGS)
+def test_kernel_matches_the_row_loop(market, c_rate, cycles):
+    _, arrays, stats = market
+    ref = reference_dispatch(arrays, stats, c_rate, cycles)
+    cols = simulate_prepared(arrays, stats, c_rate, cycles)
+    assert ref["Charge [MWh]"].sum() > 0 and ref["Discharge [MWh]"].sum() > 0
+    for name, col in ref.items():
+        np.testing.assert_allclose(cols[name], col.to_numpy(), rtol=0, atol=1e-9, err_msg=name)
+
+@pytest.mark.parametrize("chunk_steps", [1, 95, 96 * 7])
+def test_stream_matches_kernel(market, chunk_steps):
+    index, arrays, stats = market
+    cols = simulate_prepared(arrays, stats, 0.5, 1.0)
+    sink = ColumnSink()
+    simulate_stream(arrays, stats, 0.5, 1.0, sink, index, chunk_steps=chunk_steps)
+    streamed = sink.columns()
+    for name in OPERATION_COLUMNS:
+        np.testing.assert_allclose(streamed[name], cols[name], rtol=0, atol=1e-12, err_msg=name)
+
+@pytest.mark.parametrize("c_rate, cycles", CONFIGS)
+def test_online_with_frozen_thresholds_matches_kernel(market, c_rate, cycles):
+    index, arrays, stats = market
+    cols = simulate_prepared(arrays, stats, c_rate, cycles)
+    online = OnlineHeuristic(c_rate, cycles, thresholds=stats)
+    half = len(index) // 2
+    parts = [online.update(index[a:b], *(arrays[key][a:b] for key in ("da", "fcr", "pos", "neg")))
+             for a, b in ((0, half), (half, len(index)))]
+    for name, col in cols.items():
+        np.testing.assert_allclose(np.concatenate([part[name] for part in parts]), col, rtol=0, atol=1e-12,
+                                   err_msg=name)
+
+def test_batch_matches_kernel(market):
+    _, arrays, stats = market
+    prices = {key: arrays[key][:, None] for key in ("da", "fcr", "pos", "neg")}
+    prices["new_day"] = arrays["new_day"]
+    energy, capacity = simulate_batch(prices, {key: np.array([value]) for key, value in stats.items()},
+                                      [c for c, _ in CONFIGS], [k for _, k in CONFIGS])
+    for k, (c_rate, cycles) in enumerate(CONFIGS):
+        cols = simulate_prepared(arrays, stats, c_rate, cycles)
+        assert energy[k, 0] == pytest.approx(cols["Energy revenue [EUR]"].sum(), rel=1e-12)
+        assert capacity[k, 0] == pytest.approx(cols["Capacity revenue [EUR]"].sum(), rel=1e-12)
@@ -0,0 +1,19 @@
+import pandas as pd
+
+from methods.Lifetime import lifetime_sweep
+from methods.SyntheticData import synthetic_prices
+
+DAYS = 14
+
+def test_pool_matches_one_process():
+    # None (all the CPUs), an explicit pool and the in-process loop give the same years
+    prices = synthetic_prices(days=DAYS, n_countries=1, seed=4)
+    da = prices["da"].rename(columns={"DE_LU": "DE"})
+    afrr = pd.concat({("DE", "Pos"): prices["afrr_pos"]["DE"], ("DE", "Neg"): prices["afrr_neg"]["DE"]}, axis=1)
+    configs = [(0.5, 1.0), (1.0, 2.0)]
+    runs = [list(lifetime_sweep(da, prices["fcr"], afrr, ["DE"], configs, workers=workers, limit_days=DAYS, years=3))
+            for workers in (1, 2, None)]
+    for results in runs[1:]:
+        assert [r[:3] for r in results] == [r[:3] for r in runs[0]]
+        for (_, _, _, years), (_, _, _, expected) in zip(results, runs[0]):
+            pd.testing.assert_frame_equal(years, expected)
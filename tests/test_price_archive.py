@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from methods.PriceArchive import MARKETS, PriceArchive, from_workbooks
+from methods.SyntheticData import write_workbook
+from methods.XLSCache import load_tables
+
+START, END = "2024-01-03", "2024-01-05 08:00"
+
+@pytest.fixture(scope="module")
+def workbook(tmp_path_factory):
+    path = tmp_path_factory.mktemp("input") / "data.xlsx"
+    write_workbook(path, days=7)
+    return path
+
+@pytest.fixture(scope="module")
+def archive(workbook, tmp_path_factory):
+    return from_workbooks(tmp_path_factory.mktemp("archive") / "archive", [workbook])
+
+def workbook_window(tables, code):
+    # [START, END) of each market, read from the workbook tables
+    afrr = tables["afrr"]
+    frames = (tables["da"]["DE_LU" if code == "DE" else code], tables["fcr"][code], afrr[(code, "Pos")],
+              afrr[(code, "Neg")])
+    return [s[(s.index >= START) & (s.index < END)] for s in frames]
+
+@pytest.mark.parametrize("code", ["DE", "AT"])
+def test_round_trip_matches_the_workbook(workbook, archive, code):
+    expected = workbook_window(load_tables(workbook, use_cache=False), code)
+    prices = archive.country_prices(code, START, END)
+    for market, series, values in zip(MARKETS, expected, prices):
+        assert len(values) == len(series) > 0, market
+        np.testing.assert_array_equal(values, series.to_numpy(dtype=float), err_msg=market)
+    epoch, _ = archive.window("da", code, START, END)
+    assert pd.DatetimeIndex(np.asarray(epoch)).equals(pd.DatetimeIndex(expected[0].index))
+
+def test_windows_are_memory_mapped(archive):
+    # a fresh archive: nothing mapped before the first access
+    reopened = PriceArchive(archive.root)
+    epoch, values = reopened.window("afrr_pos", "DE", START, END)
+    assert isinstance(epoch, np.memmap) and isinstance(values, np.memmap)
+    assert not values.flags.writeable
+    loaded = np.load(archive.root / "afrr_pos" / "DE.npy", mmap_mode="r")
+    np.testing.assert_array_equal(values, loaded[reopened.range("afrr_pos", START, END)])
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from methods.Server import MarketServer, UnknownEndpoint
+
+def read_request(data):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await MarketServer._read_request(None, reader)
+    return asyncio.run(read())
+
+def test_request_is_framed():
+    method, path, headers, body = read_request(b"POST /roi HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}")
+    assert (method, path, headers["content-length"], body) == ("POST", "/roi", "2", b"{}")
+    assert read_request(b"") is None
+
+@pytest.mark.parametrize("data", [
+    b"GARBAGE\r\n\r\n",
+    b"GET /health\r\n\r\n",
+    b"POST /roi HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+    b"POST /roi HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+])
+def test_malformed_request_is_a_value_error(data):
+    # answered 400 by _connection instead of killing the handler
+    with pytest.raises(ValueError):
+        read_request(data)
+
+def test_unknown_endpoint():
+    with pytest.raises(UnknownEndpoint):
+        asyncio.run(MarketServer.handle(MarketServer.__new__(MarketServer), "GET", "/nope", {}))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from methods.LUNA2000Battery import LUNA2000Battery
+from methods.MatrixSolver import MatrixSolver
+from methods.Solver import Solver
+
+def prices(n_quarters=192, seed=0):
+    rng = np.random.default_rng(seed)
+    n_blocks = n_quarters // 16
+    da = 80 + 60 * np.sin(np.arange(n_quarters) * 2 * np.pi / 96) + rng.normal(0, 25, n_quarters)
+    return da, rng.uniform(0, 40, n_blocks), rng.uniform(0, 30, n_blocks), rng.uniform(0, 30, n_blocks)
+
+@pytest.mark.parametrize("cls", [MatrixSolver, Solver])
+def test_second_solve_starts_afresh(cls):
+    # lp_repair fixes columns to 0: the next solve must see the whole LP again
+    solver = cls(LUNA2000Battery(cycles_max=1.0), *prices(), n_quarters=192, formulation="lp")
+    solver.solve(verbose=False, time_limit=30)
+    first = dict(solver.repair)
+    assert first["conflict_blocks"] > 0
+    solver.solve(verbose=False)
+    assert solver.repair["lp_objective"] == pytest.approx(first["lp_objective"], rel=1e-9)
+    assert solver.objective_value() == pytest.approx(first["objective"], rel=1e-9)
+    if cls is MatrixSolver:
+        assert solver.highs.getOptionValue("time_limit")[1] == np.inf
+
+def test_matrix_backend_matches_pyomo():
+    # same rows and column order: HiGHS follows the same path on both backends
+    battery = LUNA2000Battery(cycles_max=1.0)
+    results = []
+    for cls in (Solver, MatrixSolver):
+        solver = cls(battery, *prices(96, seed=1), n_quarters=96)
+        solver.solve(verbose=False, time_limit=60)
+        assert solver.status() == "optimal"
+        results.append((solver.objective_value(), solver.schedule()))
+    (pyomo_objective, pyomo_schedule), (matrix_objective, matrix_schedule) = results
+    assert matrix_objective == pytest.approx(pyomo_objective, rel=1e-9)
+    np.testing.assert_allclose(matrix_schedule.to_numpy(dtype=float), pyomo_schedule.to_numpy(dtype=float),
+                               rtol=0, atol=1e-7)
+
+def test_pyomo_internals_used_by_solver():
+    # Solver.solve reaches into the HiGHS interface of pyomo (no public access to
+    # the highspy model, the column map or the unvalidated loading): this breaks
+    # first if pyomo moves them (pinned in requirements.txt)
+    import highspy
+    import pyomo.environ as pyo
+    solver = Solver(LUNA2000Battery(cycles_max=1.0), *prices(96), n_quarters=96)
+    interface = pyo.SolverFactory('highs')
+    interface.set_instance(solver.model)
+    assert isinstance(interface._solver_model, highspy.Highs)
+    var = solver.model.Pch[0]
+    assert isinstance(interface._pyomo_var_to_solver_var_map[id(var)], int)
+    res = interface.solve(solver.model, tee=False, load_solutions=False)
+    symbol, val = next(iter(res.solution(0).variable.items()))
+    res._smap.bySymbol[symbol].set_value(val['Value'], skip_validation=True)
+    assert res._smap.bySymbol[symbol].value == val['Value']
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from methods.SyntheticData import write_workbook
+from methods.XLSCache import _afrr_sheet, load_tables
+
+def afrr_raw():
+    # title, countries (merged cells), Pos/Neg, then the blocks
+    rows = [
+        ["aFRR capacity prices"] + [None] * 10,
+        [None, "DE", None, "AT", None, "CH", None, "CZ", None, "HU", None],
+        [None] + ["Pos", "Neg"] * 5,
+        ["2024-01-01 00:00"] + [1.5, "2,5"] + [1.0] * 8,
+        ["2024-01-01 04:00"] + [3.0, 4.0] + [1.0] * 8,
+    ]
+    return pd.DataFrame(rows, dtype=object)
+
+def test_heuristic_parsing_is_unchanged():
+    afrr = _afrr_sheet(afrr_raw())
+    assert afrr[("DE", "Pos")].tolist() == [1.5, 3.0]
+    assert np.isnan(afrr[("DE", "Neg")].iloc[0])
+
+def test_decimal_comma():
+    afrr = _afrr_sheet(afrr_raw(), decimal_comma=True)
+    assert afrr[("DE", "Neg")].tolist() == [2.5, 4.0]
+
+def test_miss_removes_only_former_entries_of_the_workbook(tmp_path):
+    path = tmp_path / "data.xlsx"
+    write_workbook(path, days=2)
+    cache = tmp_path / "cache"
+    keep = [cache / f"data-2020-{'a' * 64}", cache / f"data-{'b' * 64}.x1y2"]
+    former = cache / f"data-{'c' * 64}"
+    for d in keep + [former]:
+        d.mkdir(parents=True)
+    load_tables(path, cache_dir=cache)
+    assert all(d.is_dir() for d in keep)
+    assert not former.exists()